@@ -0,0 +1,669 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measure how fast the batch mode (-f) checks an order file, against local stand-ins
+# for COTUS, the window sticker site, the pictures of the cars and the SMTP server,
+# so nothing is sent to Ford or Gmail.
+#
+# Usage: bench_load.py [-s SIZE ...] [-r ROUNDS] [--latency MS] [--down-rate R] ... [-- CHECKER ARGS]
+#
+# For every size a synthetic order file is generated, and the checker is copied into
+# a temporary directory (with a dummy gmail_secret.py) and run on it, every round in
+# the same directory so the rounds after the first one show a warm cache. The HTTP
+# requests of the checker reach the stand-ins through HTTP_PROXY, emails go to a
+# sink. Use --tree to run another checkout, e.g. an older version to compare with,
+# options it doesn't know about (--rate, --smtp-host, --trust-env) are left out.
+#
+# The latency of an order is from the first time COTUS is asked about it, to the
+# last thing done for it (its page, window sticker or email).
+
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import random
+import shutil
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import parse_qs, urlsplit
+
+COTUS_HOSTS = ('wwwqa.cotus.ford.com', 'www.cotus.ford.com', 'www.ordertracking.ford.com')
+STICKER_HOST = 'www.windowsticker.forddirect.com'
+PICTURE_HOST = 'build.ford.com'
+
+STATES = ['In Order Processing', 'In Production', 'Awaiting Shipment', 'In Transit', 'Delivered']
+
+# How many different pictures of cars there are, orders with the same one share it.
+CONFIGS = 20
+
+PAGE = '''<html><head><title>Order Tracking</title></head><body>
+<div class="header">{padding}</div>
+<div class="vehicle">
+<span class="vehicleName">{name}</span>
+<span class="orderDate">{order_date}</span>
+<span class="orderNumber">{order_num}</span>
+<span class="vin">{vin}</span>
+<input type="hidden" id="hidden-estimated-delivery-date" data-part="{edd}"/>
+<span class="dealerName">{dealer_name}</span>
+<img src="http://build.ford.com/dig/Ford/F-150/2018/HD-TILE/{config}/EXT/4/vehicle.png"/>
+</div>
+{dates}
+{summary}
+<script>var order = {{ "dealerInfo": {{ "dealerCode": "{dealer_code}"}}, "selectedStepName": "{state}", "surveyOn": false }};</script>
+<div class="footer">{padding}</div>
+</body></html>'''
+
+ERROR_PAGE = '''<html><head><title>Order Tracking</title></head><body>
+<p class="top-level-error enabled">We are unable to find your order, please check the information you entered.</p>
+</body></html>'''
+
+DOWN_PAGE = '''<html><head><title>Order Tracking</title></head><body>
+<div class="maintenance">{padding}</div>
+</body></html>'''
+
+
+def make_pdf(title, size):
+    """
+    :param title: the title in the /Info dictionary
+    :type title: str
+    :param size: about how many bytes the file should be
+    :type size: int
+    :return: a PDF file with no pages
+    :rtype: bytes
+    """
+
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>',
+               b'<< /Type /Pages /Kids [] /Count 0 >>',
+               '<< /Title ({0}) /Producer (bench_load) >>'.format(title).encode()]
+    out = bytearray(b'%PDF-1.4\n')
+    out += b'%' + b'0' * max(size - 600, 0) + b'\n'
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % i + obj + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n' % (len(objects) + 1)
+    out += b'0000000000 65535 f \n'
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R /Info 3 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def make_png(width, height, seed):
+    """
+    :param width: width of the picture
+    :type width: int
+    :param height: height of the picture
+    :type height: int
+    :param seed: picks the colors
+    :type seed: int
+    :return: an RGBA PNG file with a gradient on it
+    :rtype: bytes
+    """
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    ramp = bytes(i & 0xff for i in range(width + 512))
+    rows = bytearray()
+    for y in range(height):
+        row = bytearray(b'\xff' * (width * 4))
+        row[0::4] = ramp[(seed * 37) & 0xff:][:width]
+        row[1::4] = bytes(((y + seed * 91) & 0xff,)) * width
+        row[2::4] = ramp[y & 0xff:][:width]
+        rows.append(0)
+        rows += row
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(bytes(rows), 6)) +
+            chunk(b'IEND', b''))
+
+
+def lookup_hash(key):
+    """
+    :param key: the lookup, e.g. "vin:1FTEW1EG000000001"
+    :type key: str
+    :return: a number that decides everything about the lookup, the same every time
+    :rtype: int
+    """
+
+    return int(hashlib.sha1(key.encode()).hexdigest()[:12], 16)
+
+
+def make_orders(size, vin_share, email_rate, duplicate_rate, rng):
+    """
+    :param size: number of lines
+    :type size: int
+    :param vin_share: share of the lines looking up a VIN, the others look up an order number and dealer code
+    :type vin_share: float
+    :param email_rate: share of the lines with an email address
+    :type email_rate: float
+    :param duplicate_rate: share of the lines looking up the same thing as an earlier line, with another email address
+    :type duplicate_rate: float
+    :param rng: the random number generator
+    :type rng: random.Random
+    :return: the lines, and the lookup of every email address
+    :rtype: list[str], dict
+    """
+
+    lines = []
+    emails = {}
+    lookups = []
+    for i in range(size):
+        if lookups and rng.random() < duplicate_rate:
+            line, key = rng.choice(lookups)
+            email = 'dup{0}@bench.example'.format(i)
+            lines.append('{0},{1}'.format(line, email))
+            emails[email] = key
+            continue
+
+        if rng.random() < vin_share:
+            vin = '1FTEW1EG{0:09d}'.format(i)
+            line, key = 'vin,{0}'.format(vin), 'vin:{0}'.format(vin)
+        else:
+            order_num, dealer_code = '{0:04d}'.format(i % 10000), '{0:06d}'.format(i // 10000)
+            line, key = 'num,{0},{1}'.format(order_num, dealer_code), 'num:{0}:{1}'.format(order_num, dealer_code)
+        lookups.append((line, key))
+
+        if rng.random() < email_rate:
+            email = 'order{0}@bench.example'.format(i)
+            line = '{0},{1}'.format(line, email)
+            emails[email] = key
+        lines.append(line)
+    return lines, emails
+
+
+class Timeline(object):
+    """
+    When the stand-ins first and last did something for each lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._first = {}
+        self._last = {}
+
+    def start(self, key):
+        """
+        :param key: the lookup COTUS was asked about
+        :type key: str
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self._first.setdefault(key, now)
+            self._last[key] = now
+
+    def touch(self, key):
+        """
+        :param key: the lookup something else was done for
+        :type key: str
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            if key in self._first:
+                self._last[key] = now
+
+    def latencies(self):
+        """
+        :return: seconds from the first to the last thing done for every lookup
+        :rtype: list[float]
+        """
+
+        with self._lock:
+            return sorted(self._last[k] - self._first[k] for k in self._first)
+
+    def reset(self):
+        with self._lock:
+            self._first.clear()
+            self._last.clear()
+
+
+class StandIns(object):
+    """
+    What the stand-ins send back for every request, and how many they got.
+    """
+
+    def __init__(self, args, timeline):
+        """
+        :param args: args parsed from argparse
+        :type args: args
+        :param timeline: when things were done for each lookup
+        :type timeline: Timeline
+        """
+
+        self.args = args
+        self.timeline = timeline
+
+        self._lock = threading.Lock()
+        self._vins = {}
+        self.requests = {}
+        self.bytes_sent = 0
+
+        self._sticker = make_pdf('Window Sticker', args.sticker_size * 1024)
+        self._placeholder = make_pdf('Window Sticker Not Available', 4096)
+        self._pictures = {}
+        self._padding = '<!-- {0} -->'.format('x' * max(args.page_size * 1024 // 2 - 2048, 0))
+
+    def _sleep(self, ms):
+        if ms > 0:
+            time.sleep(ms / 1000.0 * random.uniform(0.5, 1.5))
+
+    def _count(self, name, body):
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+            self.bytes_sent += len(body)
+
+    def handle(self, host, path, query, headers):
+        """
+        :param host: host the request was sent to
+        :type host: str
+        :param path: path of the url
+        :type path: str
+        :param query: the query string
+        :type query: dict
+        :param headers: headers of the request
+        :type headers: http.client.HTTPMessage
+        :return: status, headers and body of the response
+        :rtype: int, list[tuple], bytes
+        """
+
+        if host in COTUS_HOSTS:
+            return self._cotus(query, headers)
+        if host == STICKER_HOST:
+            return self._window_sticker(query)
+        if host == PICTURE_HOST:
+            return self._picture(path)
+        self._count('other', b'')
+        return 404, [], b''
+
+    def _cotus(self, query, headers):
+        if query.get('orderTrackingInputType') == 'vin':
+            key = 'vin:{0}'.format(query.get('vin', ''))
+            vin = query.get('vin', '')
+        else:
+            key = 'num:{0}:{1}'.format(query.get('orderNumber', ''), query.get('dealerCode', ''))
+            vin = '1FMCU9GD{0:09d}'.format(lookup_hash(key) % 10 ** 9)
+        self.timeline.start(key)
+        self._sleep(self.args.latency)
+
+        if random.random() < self.args.error_rate:
+            self._count('cotus 503', b'')
+            return 503, [('Content-Type', 'text/html')], b''
+        if random.random() < self.args.down_rate:
+            body = DOWN_PAGE.format(padding=self._padding).encode()
+            self._count('cotus down', body)
+            return 200, [('Content-Type', 'text/html; charset=utf-8')], body
+
+        h = lookup_hash(key)
+        if (h % 10000) < self.args.invalid_rate * 10000:
+            body = ERROR_PAGE.encode()
+            self._count('cotus invalid', body)
+            self.timeline.touch(key)
+            return 200, [('Content-Type', 'text/html; charset=utf-8')], body
+
+        with self._lock:
+            self._vins[vin] = key
+        state = (h >> 16) % len(STATES)
+        body = PAGE.format(
+            padding=self._padding,
+            name='2018 Ford F-150 XLT SuperCrew',
+            order_date='01/{0:02d}/2018'.format(h % 28 + 1),
+            order_num=key.split(':')[1] if key.startswith('num:') else '{0:04d}'.format(h % 10000),
+            vin=vin,
+            edd='03/{0:02d}/2018'.format((h >> 8) % 28 + 1),
+            dealer_name='Bench Ford',
+            config=(h >> 24) % CONFIGS,
+            dates='\n'.join('<span class="label">Completed On : </span>{0:02d}.{1:02d}.18</span>'.format(i + 1, h % 28 + 1)
+                            for i in range(state + 1)),
+            summary='\n'.join('<div class="part-detail-description">Option {0}</div>'.format(i) for i in range(12)),
+            dealer_code=key.split(':')[2] if key.startswith('num:') else '{0:06d}'.format(h % 10 ** 6),
+            state=STATES[state]).encode()
+
+        etag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+        if self.args.etag and headers.get('If-None-Match') == etag:
+            self._count('cotus 304', b'')
+            self.timeline.touch(key)
+            return 304, [('ETag', etag)], b''
+        self._count('cotus', body)
+        self.timeline.touch(key)
+        response_headers = [('Content-Type', 'text/html; charset=utf-8')]
+        if self.args.etag:
+            response_headers.append(('ETag', etag))
+        return 200, response_headers, body
+
+    def _window_sticker(self, query):
+        vin = query.get('vin', '')
+        self._sleep(self.args.sticker_latency)
+        with self._lock:
+            key = self._vins.get(vin)
+        if key is not None:
+            self.timeline.touch(key)
+        if key is not None and ((lookup_hash(key) >> 32) % 10000) < self.args.sticker_rate * 10000:
+            body = self._sticker
+        else:
+            body = self._placeholder
+        self._count('window sticker', body)
+        return 200, [('Content-Type', 'application/pdf')], body
+
+    def _picture(self, path):
+        self._sleep(self.args.picture_latency)
+        body = self._pictures.get(path)
+        if body is None:
+            body = make_png(600, 400, lookup_hash(path) % 256)
+            with self._lock:
+                body = self._pictures.setdefault(path, body)
+        self._count('picture', body)
+        return 200, [('Content-Type', 'image/png'), ('ETag', '"{0}"'.format(hashlib.sha1(body).hexdigest()))], body
+
+
+class ProxyHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Takes the requests sent through the proxy, and answers them as whichever host they were sent to.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        host = (url.hostname or self.headers.get('Host', '')).split(':')[0]
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        status, headers, body = self.server.stand_ins.handle(host, url.path, query, self.headers)
+        try:
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The checker stops reading a page once it has everything it needs.
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ProxyServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, stand_ins):
+        """
+        :param stand_ins: answers the requests
+        :type stand_ins: StandIns
+        """
+
+        super().__init__(('127.0.0.1', 0), ProxyHandler)
+        self.stand_ins = stand_ins
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """
+    Just enough SMTP to take emails, no STARTTLS and no AUTH.
+    """
+
+    def handle(self):
+        server = self.server
+        self.wfile.write(b'220 bench_load ESMTP\r\n')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.wfile.write(b'250-bench_load\r\n250-8BITMIME\r\n250 SIZE 52428800\r\n')
+            elif command == b'HELO':
+                self.wfile.write(b'250 bench_load\r\n')
+            elif command == b'MAIL':
+                recipients = []
+                self.wfile.write(b'250 OK\r\n')
+            elif command == b'RCPT':
+                address = line.partition(b'<')[2].partition(b'>')[0].decode('ascii', 'replace').lower()
+                recipients.append(address)
+                self.wfile.write(b'250 OK\r\n')
+            elif command == b'DATA':
+                self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line == b'.\r\n':
+                        break
+                if server.latency > 0:
+                    time.sleep(server.latency / 1000.0 * random.uniform(0.5, 1.5))
+                server.received(recipients)
+                self.wfile.write(b'250 OK\r\n')
+            elif command in (b'RSET', b'NOOP'):
+                recipients = [] if command == b'RSET' else recipients
+                self.wfile.write(b'250 OK\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                return
+            else:
+                self.wfile.write(b'502 Command not implemented\r\n')
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+    def __init__(self, timeline, latency):
+        """
+        :param timeline: when things were done for each lookup
+        :type timeline: Timeline
+        :param latency: milliseconds each email takes
+        :type latency: float
+        """
+
+        super().__init__(('127.0.0.1', 0), SmtpHandler)
+        self.timeline = timeline
+        self.latency = latency
+        self.emails = {}
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def received(self, recipients):
+        """
+        :param recipients: who an email was sent to
+        :type recipients: list[str]
+        """
+
+        with self._lock:
+            self.count += 1
+        for each in recipients:
+            key = self.emails.get(each)
+            if key is not None:
+                self.timeline.touch(key)
+
+
+def copy_tree(src, dst):
+    """
+    Copy the checker, without its state, and with a dummy gmail_secret.py.
+
+    :param src: the checker to copy
+    :type src: str
+    :param dst: where to copy it, it must not exist
+    :type dst: str
+    """
+
+    os.mkdir(dst)
+    for name in os.listdir(src):
+        if name.endswith(('.py', '.ttf')) and os.path.isfile(os.path.join(src, name)):
+            shutil.copy2(os.path.join(src, name), dst)
+    with open(os.path.join(dst, 'gmail_secret.py'), 'w') as out_file:
+        out_file.write("gmail_user = 'bench@bench.example'\ngmail_pswd = 'bench'\n")
+
+
+def percentile(values, p):
+    """
+    :param values: sorted values
+    :type values: list[float]
+    :param p: the percentile, 0 to 100
+    :type p: float
+    :return: the nearest rank percentile, 0 if there are no values
+    :rtype: float
+    """
+
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def run_checker(tree, order_file, checker_args, env):
+    """
+    :param tree: the copy of the checker
+    :type tree: str
+    :param order_file: the order file
+    :type order_file: str
+    :param checker_args: other arguments for the checker
+    :type checker_args: list[str]
+    :param env: environment of the checker
+    :type env: dict
+    :return: exit code, seconds it took, peak RSS in bytes
+    :rtype: int, float, int
+    """
+
+    with open(os.path.join(tree, 'bench_stderr.log'), 'ab') as err_file:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, 'cotus-checker.py', '-f', order_file, '-n'] + checker_args,
+                                cwd=tree, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=err_file)
+        pid, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return proc.returncode, elapsed, peak_rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the batch mode against local stand-ins for COTUS and the rest.')
+    parser.add_argument('-s', '--size', type=int, action='append', dest='sizes', help='lines in the order file, can be repeated (default 1000, 10000 and 100000)')
+    parser.add_argument('-r', '--rounds', type=int, default=1, help='runs on the same order file, the later ones have a warm cache')
+    parser.add_argument('--tree', type=str, default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='the checker to run')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the order files and the failures')
+    parser.add_argument('--latency', type=float, default=50, help='milliseconds a COTUS page takes, +/-50%%')
+    parser.add_argument('--sticker-latency', type=float, default=100, help='milliseconds a window sticker takes, +/-50%%')
+    parser.add_argument('--picture-latency', type=float, default=50, help='milliseconds a picture of a car takes, +/-50%%')
+    parser.add_argument('--smtp-latency', type=float, default=20, help='milliseconds an email takes, +/-50%%')
+    parser.add_argument('--down-rate', type=float, default=0.02, help='share of the COTUS pages with nothing on them')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='share of the COTUS requests answered with 503')
+    parser.add_argument('--invalid-rate', type=float, default=0.05, help='share of the orders COTUS doesn\'t know about')
+    parser.add_argument('--sticker-rate', type=float, default=0.3, help='share of the VINs with a window sticker out')
+    parser.add_argument('--vin-share', type=float, default=0.7, help='share of the orders looking up a VIN')
+    parser.add_argument('--email-rate', type=float, default=0.5, help='share of the orders with an email address')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help='share of the orders looking up the same thing as another one')
+    parser.add_argument('--page-size', type=int, default=60, help='kilobytes of a COTUS page')
+    parser.add_argument('--sticker-size', type=int, default=200, help='kilobytes of a window sticker')
+    parser.add_argument('--etag', action='store_true', default=False, help='send ETags and answer 304 when a page didn\'t change')
+    parser.add_argument('--keep', action='store_true', default=False, help='keep the temporary directory')
+    parser.add_argument('checker_args', nargs=argparse.REMAINDER, help='passed to the checker after "--", e.g. -- -w -i --stream')
+    args = parser.parse_args()
+
+    sizes = args.sizes or [1000, 10000, 100000]
+    checker_args = args.checker_args[1:] if args.checker_args[:1] == ['--'] else args.checker_args
+    random.seed(args.seed)
+
+    timeline = Timeline()
+    stand_ins = StandIns(args, timeline)
+    proxy = ProxyServer(stand_ins)
+    sink = SmtpSink(timeline, args.smtp_latency)
+    for server in (proxy, sink):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    env = dict(os.environ)
+    for name in ('NO_PROXY', 'no_proxy', 'HTTPS_PROXY', 'https_proxy', 'ALL_PROXY', 'all_proxy'):
+        env.pop(name, None)
+    env['HTTP_PROXY'] = env['http_proxy'] = 'http://127.0.0.1:{0}'.format(proxy.server_address[1])
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    work_dir = tempfile.mkdtemp(prefix='bench_load_')
+    print('Tree: {0}'.format(os.path.abspath(args.tree)))
+    print('Work directory: {0}'.format(work_dir))
+    print('{0: >8}{1: >7}{2: >10}{3: >10}{4: >10}{5: >10}{6: >11}{7: >10}{8: >8}{9: >6}'.format(
+        'Orders', 'Round', 'Time(s)', 'Orders/s', 'p50(ms)', 'p99(ms)', 'RSS(MB)', 'Requests', 'Emails', 'Exit'))
+
+    failed = False
+    try:
+        for size in sizes:
+            tree = os.path.join(work_dir, 'tree_{0}'.format(size))
+            copy_tree(args.tree, tree)
+
+            # Only use the options this version of the checker has.
+            help_text = subprocess.run([sys.executable, 'cotus-checker.py', '--help'], cwd=tree, env=env,
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode('utf-8', 'replace')
+            extra = []
+            if '--rate' in help_text:
+                for host in COTUS_HOSTS + (STICKER_HOST, PICTURE_HOST):
+                    extra += ['--rate', '{0}=1000000'.format(host)]
+            if '--smtp-host' in help_text:
+                extra += ['--smtp-host', '127.0.0.1', '--smtp-port', str(sink.server_address[1])]
+            if '--trust-env' in help_text:
+                extra += ['--trust-env']
+
+            lines, emails = make_orders(size, args.vin_share, args.email_rate, args.duplicate_rate, random.Random(args.seed))
+            sink.emails = emails
+            order_file = os.path.join(tree, 'orders.txt')
+
+            for i in range(args.rounds):
+                # The checker takes orders out of the file, every round checks all of them.
+                with open(order_file, 'w') as out_file:
+                    out_file.write('\n'.join(lines) + '\n')
+
+                timeline.reset()
+                requests_before = sum(stand_ins.requests.values())
+                emails_before = sink.count
+                code, elapsed, peak_rss = run_checker(tree, order_file, extra + checker_args, env)
+                latencies = timeline.latencies()
+                failed = failed or code != 0
+
+                print('{0: >8}{1: >7}{2: >10.2f}{3: >10.1f}{4: >10.1f}{5: >10.1f}{6: >11.1f}{7: >10}{8: >8}{9: >6}'.format(
+                    size, i + 1, elapsed, size / elapsed, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+                    peak_rss / 1024 / 1024, sum(stand_ins.requests.values()) - requests_before, sink.count - emails_before, code))
+
+                # What the checker says about itself, if it's new enough to write metrics.
+                summary_file = os.path.join(tree, 'metrics', 'metrics.json')
+                if os.path.isfile(summary_file):
+                    stages = json.load(open(summary_file, 'r'))['histograms'].get('stage_seconds', [])
+                    print('{0: >15}'.format('') + ', '.join('{0} {1:.1f}/{2:.1f}ms'.format(
+                        each['labels'].get('stage'), each['p50'] * 1000, each['p99'] * 1000) for each in stages))
+                    os.remove(summary_file)
+
+        print('Responses: ' + ', '.join('{0} {1}'.format(k, v) for k, v in sorted(stand_ins.requests.items())))
+        print('Sent: {0:.1f} MB'.format(stand_ins.bytes_sent / 1024 / 1024))
+    finally:
+        proxy.shutdown()
+        sink.shutdown()
+        if args.keep or failed:
+            print('Kept: {0}'.format(work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    exit(main())
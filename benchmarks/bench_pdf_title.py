@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compare how long it takes to tell a window sticker from a place holder,
+# reading only the trailer and /Info dictionary versus parsing the file with PyPDF2.
+#
+# Usage: bench_pdf_title.py [-n ROUNDS] DIR [DIR ...]
+# Every *.pdf in the directories is used, e.g. a directory of real window
+# stickers and a directory of the place holders returned for unreleased VINs.
+
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_info import get_pdf_title, read_pdf_title
+import PyPDF2
+
+
+def pypdf2_title(data):
+    """
+    What get_window_sticker() used to do.
+
+    :param data: the PDF file
+    :type data: bytes
+    :return: the title
+    :rtype: str
+    """
+
+    try:
+        return PyPDF2.PdfFileReader(io.BytesIO(data)).getDocumentInfo().title or ''
+    except (PyPDF2.utils.PdfReadError, AttributeError, ValueError):
+        return ''
+
+
+def is_window_sticker(title):
+    """
+    :param title: the title of the PDF file
+    :type title: str
+    :return: whether it's a window sticker
+    :rtype: bool
+    """
+
+    return title.lower().replace('\r', '').replace('\n', '').replace(' ', '') == 'windowsticker'
+
+
+def time_it(func, corpus, rounds):
+    """
+    :param func: the function to time
+    :type func: callable
+    :param corpus: the PDF files
+    :type corpus: list[bytes]
+    :param rounds: how many times to go through the corpus
+    :type rounds: int
+    :return: microseconds per file
+    :rtype: float
+    """
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        for data in corpus:
+            func(data)
+    return (time.perf_counter() - start) / (rounds * len(corpus)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PDF place holder detection.')
+    parser.add_argument('dirs', nargs='+', help='directories with PDF files')
+    parser.add_argument('-n', '--rounds', type=int, default=20, help='how many times to go through the corpus')
+    args = parser.parse_args()
+
+    names = []
+    for each in args.dirs:
+        names += sorted(glob.glob(os.path.join(each, '*.pdf')))
+    if not names:
+        print('No PDF files found.')
+        return 1
+    corpus = [open(name, 'rb').read() for name in names]
+
+    # Make sure both ways agree before timing them.
+    stickers = 0
+    fallbacks = 0
+    mismatches = 0
+    for name, data in zip(names, corpus):
+        expected = is_window_sticker(pypdf2_title(data))
+        stickers += expected
+        if read_pdf_title(data) is None:
+            fallbacks += 1
+        if is_window_sticker(get_pdf_title(data)) != expected:
+            mismatches += 1
+            print('MISMATCH: {0}'.format(name))
+
+    print('Files: {0} ({1} window stickers, {2} place holders)'.format(len(corpus), stickers, len(corpus) - stickers))
+    print('Fell back to PyPDF2: {0}'.format(fallbacks))
+    print('Mismatches: {0}'.format(mismatches))
+
+    old = time_it(pypdf2_title, corpus, args.rounds)
+    new = time_it(get_pdf_title, corpus, args.rounds)
+    print('{0: <21}{1:10.1f} us/file'.format('PyPDF2:', old))
+    print('{0: <21}{1:10.1f} us/file'.format('Trailer and /Info:', new))
+    print('{0: <21}{1:10.1f}x'.format('Speedup:', old / new))
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measure how long the checker takes to start, and make sure a plain lookup doesn't
+# load the modules only some runs need.
+#
+# Usage: bench_startup.py [-r ROUNDS] [--budget MS] [--top N] [--tree TREE] [--keep]
+#
+# The checker is copied into a temporary directory (with a dummy gmail_secret.py) and
+# looks up one VIN (-v VIN -n) against the COTUS stand-in of bench_load.py, with no
+# latency and no failures, so what's left is mostly starting up. Its median time over
+# the rounds, less the median time of an empty Python, must stay under the budget.
+# One more run with -X importtime tells which modules were imported, none of
+# the LAZY ones (imaging, PDF, Google sheets and OAuth, SMTP and email, aiohttp)
+# may be among them, and the slowest imports are printed.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_load import ProxyServer, StandIns, Timeline, copy_tree, percentile
+
+# Only the runs that need these may import them.
+LAZY = ('PIL', 'PyPDF2', 'oauth2client', 'apiclient', 'googleapiclient', 'httplib2', 'google_sheets_api',
+        'smtplib', 'email.mime', 'aiohttp', 'outbox', 'profiler')
+
+VIN = '1FTEW1EP5JFA00001'
+
+
+def timed_run(cmd, cwd, env):
+    """
+    :param cmd: the command
+    :type cmd: list[str]
+    :param cwd: where to run it
+    :type cwd: str
+    :param env: environment of the command
+    :type env: dict
+    :return: exit code, seconds it took
+    :rtype: int, float
+    """
+
+    start = time.perf_counter()
+    code = subprocess.call(cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return code, time.perf_counter() - start
+
+
+def import_times(tree, env):
+    """
+    Run the checker once with -X importtime.
+
+    :param tree: the copy of the checker
+    :type tree: str
+    :param env: environment of the checker
+    :type env: dict
+    :return: (module, seconds by itself, seconds with what it imported, nested) of every import, in the order they finished
+    :rtype: list[tuple]
+    """
+
+    proc = subprocess.run([sys.executable, '-X', 'importtime', 'cotus-checker.py', '-v', VIN, '-n'], cwd=tree, env=env,
+                          stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    imports = []
+    for line in proc.stderr.decode('utf-8', 'replace').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        own, total, name = line[len('import time:'):].split('|', 2)
+        if not own.strip().isdigit():
+            continue
+        imports.append((name.strip(), int(own) / 1e6, int(total) / 1e6, name.startswith('  ')))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark how long the checker takes to start.')
+    parser.add_argument('-r', '--rounds', type=int, default=10, help='runs to take the median of')
+    parser.add_argument('--budget', type=float, default=250, help='most milliseconds the checker may take more than an empty Python')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to print')
+    parser.add_argument('--tree', type=str, default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='the checker to run')
+    parser.add_argument('--keep', action='store_true', default=False, help='keep the temporary directory')
+    args = parser.parse_args()
+
+    # A COTUS that answers right away and always has the order.
+    stand_in_args = argparse.Namespace(latency=0, sticker_latency=0, picture_latency=0, down_rate=0, error_rate=0,
+                                       invalid_rate=0, sticker_rate=0, page_size=60, sticker_size=4, etag=False)
+    proxy = ProxyServer(StandIns(stand_in_args, Timeline()))
+    threading.Thread(target=proxy.serve_forever, daemon=True).start()
+
+    env = dict(os.environ)
+    for name in ('NO_PROXY', 'no_proxy', 'HTTPS_PROXY', 'https_proxy', 'ALL_PROXY', 'all_proxy'):
+        env.pop(name, None)
+    env['HTTP_PROXY'] = env['http_proxy'] = 'http://127.0.0.1:{0}'.format(proxy.server_address[1])
+
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    tree = os.path.join(work_dir, 'tree')
+    print('Tree: {0}'.format(os.path.abspath(args.tree)))
+    print('Work directory: {0}'.format(work_dir))
+
+    failed = False
+    try:
+        copy_tree(args.tree, tree)
+
+        # The first run writes the bytecode, it's not counted.
+        timed_run([sys.executable, 'cotus-checker.py', '-v', VIN, '-n'], tree, env)
+
+        empty = []
+        checker = []
+        for i in range(args.rounds):
+            empty.append(timed_run([sys.executable, '-c', 'pass'], tree, env)[1])
+            code, elapsed = timed_run([sys.executable, 'cotus-checker.py', '-v', VIN, '-n'], tree, env)
+            checker.append(elapsed)
+            if code != 0:
+                print('Exit code: {0}'.format(code))
+                failed = True
+        empty.sort()
+        checker.sort()
+        extra = (percentile(checker, 50) - percentile(empty, 50)) * 1000
+
+        print('{0: >16}{1: >10}{2: >10}'.format('', 'p50(ms)', 'max(ms)'))
+        print('{0: >16}{1: >10.1f}{2: >10.1f}'.format('Empty Python', percentile(empty, 50) * 1000, empty[-1] * 1000))
+        print('{0: >16}{1: >10.1f}{2: >10.1f}'.format('Checker', percentile(checker, 50) * 1000, checker[-1] * 1000))
+        print('Startup: {0:.1f}ms, budget {1:.0f}ms'.format(extra, args.budget))
+        if extra > args.budget:
+            print('Over budget')
+            failed = True
+
+        imports = import_times(tree, env)
+        print('\nSlowest imports ({0} modules):'.format(len(imports)))
+        print('{0: >10}{1: >10}  {2}'.format('Self(ms)', 'Total(ms)', 'Module'))
+        for name, own, total, nested in sorted((i for i in imports if not i[3]), key=lambda i: -i[2])[:args.top]:
+            print('{0: >10.1f}{1: >10.1f}  {2}'.format(own * 1000, total * 1000, name))
+
+        loaded = sorted(set(name for name, own, total, nested in imports
+                            if any(name == lazy or name.startswith(lazy + '.') for lazy in LAZY)))
+        if loaded:
+            print('\nImported but not needed: {0}'.format(', '.join(loaded)))
+            failed = True
+    finally:
+        proxy.shutdown()
+        if args.keep or failed:
+            print('Kept: {0}'.format(work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    exit(main())
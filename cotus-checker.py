@@ -14,29 +14,34 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from email.mime.application import MIMEApplication
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.utils import formatdate
-from queue import Queue
-from PIL import Image, ImageDraw, ImageFont
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from gmail_secret import gmail_user, gmail_pswd
-from oauth2client import tools
-from google_sheets_api import get_data_from_sheet
-from google_sheets_api import send_email_invalid_order
-from google_sheets_api import send_email_new_order
+from smtp_pool import _smtplib, shared_pool as smtp_pool
+from http_pool import HttpPool
+from rate_limit import RateLimits
+from cotus_parser import FLAGS, OrderPageParser, parse_order_page
+from fingerprint import order_fingerprint, page_info
+from pdf_info import parse_pdf_title, read_pdf_title
+from state_store import StateStore
+from order_registry import OrderRegistry, normalize
+from render import render_digest, render_summary
+from image_cache import ImageCache
+from cpu_pool import CpuPool
+from scheduler import Scheduler
+from mirror_health import HedgeBudget, MirrorHealth
+from metrics import STAGE_SECONDS, shared_metrics as metrics
+from retry import RetryBudget, DOWN, PERMANENT, TIMEOUT, TRANSIENT, backoff, classify, requeue_later
 import requests
-import PyPDF2
-import re
+import asyncio
 import argparse
 import os
-import smtplib
-import json
 import tempfile
-import threading
 import copy
+import functools
 import hashlib
 import shutil
+import threading
 import time
 import logging
 
@@ -63,17 +68,93 @@ order_states = {
     4: 'Delivered:'
 }
 
-the_lock = threading.Lock()
 order_str_list = []
+order_err_list = []
+
+# Requests per second and adaptive concurrency of every host, set up in main().
+rate_limits = RateLimits()
+
+# How well each mirror is doing, shared by all the workers.
+mirrors = MirrorHealth(COTUS_URL)
+
+# Hedged requests are kept under this share of all the requests to COTUS, set up in main().
+hedge_budget = HedgeBudget(0.05)
+
+# Failed lookups retried in a run, and what went wrong with them.
+retry_budget = RetryBudget()
+
+# Every request goes through here, so connections are kept alive and reused.
+http_pool = HttpPool()
+
+# The state of every order, and what the orders in the order file looked like
+# last time, opened in main().
+state_store = None
+
+# Emails waiting to be sent, set up in main().
+outbox = None
+
+# Pictures of the cars, opened by get_image_cache() the first time a picture is needed.
+image_cache = None
+image_cache_lock = threading.Lock()
+
+# Worker processes for rendering images and parsing PDF files, used in batch mode.
+cpu_pool = CpuPool(0)
 
 GET_TIMEOUT = 5
 GET_RETRY = 3
 COTUS_RETRY = 3
-COTUS_WAIT = 3
+
+# Bytes read at a time when a COTUS page is streamed.
+STREAM_CHUNK_SIZE = 16384
+
+# When a streamed page is stopped early, the rest of it is still read (and thrown away)
+# if it's no more than this many bytes, so the connection goes back to the pool.
+# Bigger or unknown leftovers cost more than a new connection, the connection is closed.
+STREAM_DRAIN_SIZE = 65536
+
+# How many lookups can be in flight at the same time in batch mode, and how many
+# threads are used for the blocking work (window sticker, image, state file, email).
+CONCURRENCY = 100
+WORKERS = 10
+
+# Default requests per second of the hosts we use, the other hosts have no limit.
+HOST_RATES = {
+    'wwwqa.cotus.ford.com': 20,
+    'www.cotus.ford.com': 20,
+    'www.ordertracking.ford.com': 20,
+    'www.windowsticker.forddirect.com': 10,
+    'build.ford.com': 10
+}
+
+# How often (in seconds) the concurrency of every host is logged while a batch runs.
+CONCURRENCY_LOG_INTERVAL = 10
+
+# A mirror taking longer than this percentile of its recent requests is hedged.
+HEDGE_PERCENTILE = 95
+
+# The daemon reads the order file and the google sheet again this often (in seconds),
+# and never sleeps less than DAEMON_MIN_SLEEP between checks.
+DAEMON_RELOAD = 600
+DAEMON_MIN_SLEEP = 1
+
+# Default number of processes rendering images and parsing PDF files in batch mode.
+RENDER_WORKERS = 2
+
+# Seconds between two wall clock samples with --profile.
+PROFILE_INTERVAL = 0.01
+
+# Megabytes of car pictures kept in the cache.
+IMAGE_CACHE_SIZE = 256
+
+# Emails sent from the outbox at the same time.
+EMAIL_WORKERS = 4
 
 DIR_INFO = 'info'
 DIR_IMAGE = 'image'
 DIR_WINDOW_STICKER = 'window_sticker'
+DIR_CACHE = 'cache'
+DIR_OUTBOX = 'outbox'
+DIR_METRICS = 'metrics'
 
 PRINT_TO_SCREEN = True
 
@@ -90,32 +171,222 @@ def print_to_screen(stuff_to_print):
         print(stuff_to_print)
 
 
-def get_requests(url, payload=''):
+def small_leftover(headers, received):
+    """
+    :param headers: headers of the response
+    :type headers: dict
+    :param received: bytes of the body read so far
+    :type received: int
+    :return: whether the rest of the body is known to be no more than STREAM_DRAIN_SIZE bytes
+    :rtype: bool
     """
-    A wrapper function to requests.get().
+
+    # The length of a compressed body isn't what's read from it.
+    length = headers.get('Content-Length')
+    if length is None or not length.isdigit() or headers.get('Content-Encoding', 'identity') != 'identity':
+        return False
+    return int(length) - received <= STREAM_DRAIN_SIZE
+
+
+def get_requests(url, payload='', new_parser=None, headers=None, timing=None):
+    """
+    A wrapper function to requests.get(), using the pooled connections.
+
+    If new_parser is given, the response is streamed into a new parser, and the
+    download stops as soon as the parser has everything it needs. A request that
+    times out is sent again after a short random delay, doubled every time.
 
     :param url: the url to send the request to
     :type url: str
     :param payload: a dictionary of payload
     :type payload: dict
-    :return: error number (0 for success, -1 for failure) and the response of the request
-    :rtype: int, requests.api
+    :param new_parser: creates a parser from the encoding of the response
+    :type new_parser: callable
+    :param headers: extra headers to send
+    :type headers: dict
+    :param timing: gets the seconds the last request took ("latency"), without waiting for the rate limit
+    :type timing: dict
+    :return: error number (0 for success, -1 for failure) and the response of the request, or the parser
+    :rtype: int, requests.api or OrderPageParser
     """
 
     for i in range(GET_RETRY):
+        slot = rate_limits.slot(url)
         try:
-            if payload:
-                r = requests.get(url, params=payload, timeout=GET_TIMEOUT)
-            else:
-                r = requests.get(url, timeout=GET_TIMEOUT)
-            return 0, r
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-            pass
+            with slot:
+                if payload:
+                    r = http_pool.get(url, params=payload, headers=headers, timeout=GET_TIMEOUT, stream=new_parser is not None)
+                else:
+                    r = http_pool.get(url, headers=headers, timeout=GET_TIMEOUT, stream=new_parser is not None)
+                slot.ok = r.status_code < 500
+                if new_parser is None:
+                    metrics.count('received_bytes_total', len(r.content), host=urlsplit(url).hostname)
+                    return 0, r
+
+                # Once the parser has everything, the rest of the page is only read if
+                # it's small enough to be worth keeping the connection for.
+                parser = new_parser(r.encoding or 'utf-8')
+                received = 0
+                try:
+                    for chunk in r.iter_content(STREAM_CHUNK_SIZE):
+                        received += len(chunk)
+                        parser.feed(chunk)
+                        if parser.done:
+                            if small_leftover(r.headers, received):
+                                for chunk in r.iter_content(STREAM_CHUNK_SIZE):
+                                    received += len(chunk)
+                            break
+                finally:
+                    r.close()
+                    metrics.count('received_bytes_total', received, host=urlsplit(url).hostname)
+                return 0, parser.close()
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError):
+            if i < GET_RETRY - 1:
+                time.sleep(backoff(i))
+        finally:
+            if timing is not None and slot.latency is not None:
+                timing['latency'] = slot.latency
+
+    return -1, '{0}SERVER TIMEOUT{1}'.format(RED, RESET)
+
+
+async def get_requests_async(session, url, payload='', new_parser=None, validators=None, timing=None):
+    """
+    The asyncio version of get_requests(), used by the batch mode.
+
+    :param session: the session shared by all the checks
+    :type session: aiohttp.ClientSession
+    :param url: the url to send the request to
+    :type url: str
+    :param payload: a dictionary of payload
+    :type payload: dict
+    :param new_parser: creates a parser from the encoding of the response
+    :type new_parser: callable
+    :param validators: ETag and Last-Modified from last time, updated with the ones of the response
+    :type validators: dict
+    :param timing: gets the seconds the last request took ("latency"), without waiting for the rate limit
+    :type timing: dict
+    :return: error number (0 for success, -1 for failure) and the response body, the parser or an error message,
+             the body is None if the server says nothing changed since last time
+    :rtype: int, bytes or OrderPageParser or str
+    """
+
+    # Ask the server to only send the page if it changed since last time.
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    import aiohttp
+
+    timeout = aiohttp.ClientTimeout(sock_connect=GET_TIMEOUT, sock_read=GET_TIMEOUT)
+    for i in range(GET_RETRY):
+        slot = rate_limits.slot(url)
+        try:
+            async with slot:
+                async with session.get(url, params=payload if payload else None, headers=headers,
+                                       timeout=timeout) as r:
+                    slot.ok = r.status < 500
+                    if validators is not None:
+                        if r.status == 304 and headers:
+                            return 0, None
+                        validators['etag'] = r.headers.get('ETag')
+                        validators['last_modified'] = r.headers.get('Last-Modified')
+
+                    if new_parser is None:
+                        body = await r.read()
+                        metrics.count('received_bytes_total', len(body), host=urlsplit(url).hostname)
+                        return 0, body
+
+                    parser = new_parser(r.charset or 'utf-8')
+                    received = 0
+                    async for chunk in r.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        received += len(chunk)
+                        parser.feed(chunk)
+                        if parser.done:
+                            # Same as get_requests(), the connection is kept if the rest is small.
+                            if small_leftover(r.headers, received):
+                                received += len(await r.read())
+                            else:
+                                r.close()
+                            break
+                    metrics.count('received_bytes_total', received, host=urlsplit(url).hostname)
+                    return 0, parser.close()
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            if i < GET_RETRY - 1:
+                await asyncio.sleep(backoff(i))
+        finally:
+            if timing is not None and slot.latency is not None:
+                timing['latency'] = slot.latency
 
     return -1, '{0}SERVER TIMEOUT{1}'.format(RED, RESET)
 
 
-def get_window_sticker(vin, email_addr):
+def fetch_window_sticker(vin):
+    """
+    Download the window sticker and tell whether it's really out or just a place holder.
+
+    :param vin: the vin of the car
+    :type vin: str
+    :return: error number, the PDF file or an error message, hash of the PDF file ('' if it's a place holder)
+    :rtype: int, bytes or str, str
+    """
+
+    # try fetching the window sticker
+    payload = {'vin': vin}
+    err, r = get_requests('http://www.windowsticker.forddirect.com/windowsticker.pdf', payload)
+    if err:
+        return -1, r, ''
+
+    # read the title of the new PDF file straight from the response, only the trailer
+    # and the /Info dictionary are looked at, the file is only parsed (in a worker
+    # process in batch mode) if it's unusual
+    pdf_title = read_pdf_title(r.content)
+    if pdf_title is None:
+        # A file that crashed the worker processes is taken as a place holder.
+        pdf_title = cpu_pool.run('pdf', parse_pdf_title, r.content) or ''
+    pdf_title = pdf_title.lower().replace('\r', '').replace('\n', '').replace(' ', '')
+
+    # if the title of the new PDF file says "windowsticker" after removing all other characters,
+    # it means it's actually a window sticker, otherwise it's just a place holder
+    if pdf_title == 'windowsticker':
+        return 0, r.content, hashlib.sha256(r.content).hexdigest()
+    else:
+        return 0, r.content, ''
+
+
+def fetch_once(func):
+    """
+    Wrap a function so it only runs once for each argument, later calls get the same result,
+    calls from other threads with the same argument wait for the first one to finish.
+
+    :param func: the function, it takes one argument
+    :type func: callable
+    :return: the wrapped function
+    :rtype: callable
+    """
+
+    lock = threading.Lock()
+    results = {}
+
+    def wrapper(arg):
+        with lock:
+            if arg not in results:
+                results[arg] = [threading.Lock(), None]
+            entry = results[arg]
+        with entry[0]:
+            if entry[1] is None:
+                entry[1] = func(arg)
+            return entry[1]
+
+    return wrapper
+
+
+@metrics.timed('window_sticker')
+def get_window_sticker(vin, email_addr, sha256_old=None, fetch_ws=None):
     """
     Try to fetch the window sticker.
 
@@ -123,8 +394,12 @@ def get_window_sticker(vin, email_addr):
     :type vin: str
     :param email_addr: email address is appended to the file name to distinguish files
     :type email_addr: str
-    :return: error number and a message
-    :rtype: int, str
+    :param sha256_old: hash of the window sticker we already have, '' if there's none, None if we don't know
+    :type sha256_old: str
+    :param fetch_ws: used instead of fetch_window_sticker(), so orders with the same VIN can share one download
+    :type fetch_ws: callable
+    :return: error number, a message and the hash of the window sticker we have now ('' if there's none)
+    :rtype: int, str, str
     """
 
     # email address is appended to the file name if there is one
@@ -133,81 +408,66 @@ def get_window_sticker(vin, email_addr):
     else:
         file_name = os.path.join(DIR_WINDOW_STICKER, '{0}.pdf'.format(vin))
 
-    # get the hash of the old window sticker file if there is one
-    hash_old = hashlib.sha256()
-    sha256_old = ''
-    if os.path.isfile(file_name):
-        hash_old.update(open(file_name, 'rb').read())
-        sha256_old = hash_old.hexdigest()
+    # The hash of the old window sticker file is kept in the state of the order,
+    # only hash the file itself if we don't know it.
+    if not os.path.isfile(file_name):
+        sha256_old = ''
+    elif sha256_old is None:
+        sha256_old = hashlib.sha256(open(file_name, 'rb').read()).hexdigest()
 
     # try fetching the window sticker
-    payload = {'vin': vin}
-    err, r = get_requests('http://www.windowsticker.forddirect.com/windowsticker.pdf', payload)
+    err, content, sha256_new = (fetch_ws or fetch_window_sticker)(vin)
 
     # if returned error and there is NO old window sticker, return error with the response
     # if returned error and there IS an old window sticker, return success and say "FOUND BEFORE"
     if err:
         if not sha256_old:
-            return -1, r
+            return -1, content, sha256_old
         else:
-            return 0, '{0}FOUND BEFORE{1}'.format(YELLOW, RESET)
+            return 0, '{0}FOUND BEFORE{1}'.format(YELLOW, RESET), sha256_old
 
-    # get a temporary name for the new window sticker and write to it
-    temp_name = os.path.join(DIR_WINDOW_STICKER, '{0}.pdf'.format(next(tempfile._get_candidate_names())))
-    open(temp_name, 'wb').write(r.content)
-
-    # read the new window sticker file to and get the title of the PDF file
-    with open(temp_name, 'rb') as in_file:
-        pdf_reader = PyPDF2.PdfFileReader(in_file)
-        pdf_title = pdf_reader.getDocumentInfo().title.lower().replace('\r', '').replace('\n', '').replace(' ', '')
-
-    # if the title of the new PDF file says "windowsticker" after removing all other characters,
-    # it means it's actually a window sticker, otherwise it's just a place holder, return "NOT FOUND"
-    if pdf_title == 'windowsticker':
+    # if there's a hash it's actually a window sticker, otherwise it's just a place holder, return "NOT FOUND"
+    if sha256_new:
 
         # check the hash of the new window sticker
         # if it's different than the old one, then return "UPDATED"
         # if it's the same, then return "FOUND BEFORE"
         # if there is no old window sticker, then return "RELEASED"
-        hash_new = hashlib.sha256()
-        hash_new.update(r.content)
-        sha256_new = hash_new.hexdigest()
+        if sha256_new == sha256_old:
+            return 0, '{0}FOUND BEFORE{1}'.format(YELLOW, RESET), sha256_old
+
+        # Only write the file when it changed, write to a temporary file first
+        # then rename it, so there's never a half written window sticker.
+        fd, temp_name = tempfile.mkstemp(dir=DIR_WINDOW_STICKER, suffix='.pdf')
+        with os.fdopen(fd, 'wb') as out_file:
+            out_file.write(content)
+        os.replace(temp_name, file_name)
+
         if sha256_old:
-            if sha256_new != sha256_old:
-                os.remove(file_name)
-                os.rename(temp_name, file_name)
-                return 2, '{0}UPDATED{1}'.format(GREEN, RESET)
-            else:
-                os.remove(temp_name)
-                return 0, '{0}FOUND BEFORE{1}'.format(YELLOW, RESET)
+            return 2, '{0}UPDATED{1}'.format(GREEN, RESET), sha256_new
         else:
-            os.rename(temp_name, file_name)
-            return 1, '{0}RELEASED{1}'.format(GREEN, RESET)
+            return 1, '{0}RELEASED{1}'.format(GREEN, RESET), sha256_new
     else:
-        os.remove(temp_name)
-        return -1, '{0}NOT FOUND{1}'.format(RED, RESET)
+        return -1, '{0}NOT FOUND{1}'.format(RED, RESET), sha256_old
 
 
-def get_orders(file_name, new_orders=None):
+def get_orders(registry, new_orders=None):
     """
     Get orders from the file, combine with new orders from Google Sheet.
 
-    :param file_name: the file name of the orders
-    :type file_name: str
+    :param registry: the orders in the order file
+    :type registry: OrderRegistry
     :param new_orders: a list of strings of order info from Google Sheet
     :type new_orders: list[str]
     :return: a list of list of strings of the order information
     :rtype: list[list[str]]
     """
 
-    # read the order file and put it into a list
-    lines = open(file_name, 'r').readlines()
-
-    orders = []
+    from google_sheets_api import send_email_invalid_order, send_email_new_order
 
     # parse the order file
-    for l in lines:
-        o = l.replace('\n', '').replace(' ', '').split(',')
+    for l in registry.read():
+        o = l.replace(' ', '').split(',')
         o = list(map(str.strip, o))
 
         # If order uses VIN, it needs to have either 2 or 3 fields (optional email address),
@@ -237,20 +497,14 @@ def get_orders(file_name, new_orders=None):
             print_to_screen('Invalid Order.\n')
             continue
 
-        # Make it loop pretty then put it in the order list, also makes sure no duplicates here.
-        for i in range(1, len(o) - 1):
-            o[i] = o[i].upper()
-        o[-1] = o[-1].lower()
-        o = ','.join(o)
-        if o not in orders:
-            orders.append(o)
+        # Make it loop pretty then put it in the registry, which drops the duplicates.
+        registry.add(normalize(l))
 
     # New orders comes from google sheets, so they are already formatted,
     # just need to make sure no duplicates. Also, we print new order info to the screen.
     if new_orders is not None:
         for o in new_orders:
-            if o not in orders:
-                orders.append(o)
+            if registry.add(o):
                 o = o.split(',')
                 if o[0] == 'vin':
                     info = 'VIN, {0}'.format(', '.join(o[1:]))
@@ -260,17 +514,53 @@ def get_orders(file_name, new_orders=None):
                 print_to_screen('New Order.\n')
                 send_email_new_order(info, o[-1])
 
-    # Write the new orders to the order file, overwrite the old one.
-    # This will guarantee the order file has no duplicates orders.
-    with open(file_name, 'w') as out_file:
-        for i in range(len(orders)):
-            out_file.write('{0}\n'.format(orders[i]))
-            orders[i] = orders[i].split(',')
+    # Save the cleaned up orders right away so new orders from google sheets are never lost,
+    # the order file is only written if something changed.
+    registry.save()
+
+    return registry.orders()
+
+
+def get_payload(args, which_one=''):
+    """
+    Build the query sent to COTUS.
+
+    :param args: the args from argparse
+    :type args: args
+    :param which_one: what type of order this is
+    :type which_one: str
+    :return: the payload
+    :rtype: dict
+    """
+
+    payload = {'freshLoaded': 'true'}
+    if which_one == 'vin':
+        payload['orderTrackingInputType'] = 'vin'
+        payload['vin'] = args.vin
+    else:
+        payload['orderTrackingInputType'] = 'orderNumberInput'
+        payload['orderNumber'] = args.order_number
+        payload['dealerCode'] = args.dealer_code
+        payload['customerLastName'] = args.last_name
+    return payload
+
+
+def get_new_parser(args):
+    """
+    Get what get_requests() needs to stream the COTUS page, if it's enabled.
+
+    :param args: the args from argparse
+    :type args: args
+    :return: creates a parser from the encoding of the response, or None to download the whole page
+    :rtype: callable
+    """
 
-    return orders
+    if not args.stream:
+        return None
+    return functools.partial(OrderPageParser, need_summary=args.vehicle_summary)
 
 
-def get_data(args, which_one='', url=COTUS_URL[0]):
+def get_data(args, which_one='', url=COTUS_URL[0], timing=None):
     """
     Get the data we need from COTUS.
 
@@ -280,229 +570,301 @@ def get_data(args, which_one='', url=COTUS_URL[0]):
     :type which_one: str
     :param url: url to COTUS
     :type url: str
-    :return: the response text
-    :rtype: str
+    :param timing: gets the seconds the last request to COTUS took ("latency")
+    :type timing: dict
+    :return: the response body, the page already parsed if it's streamed, or an error message
+    :rtype: bytes or OrderPageParser or str
     """
     try:
-        payload = {'freshLoaded': 'true'}
-        if which_one == 'vin':
-            payload['orderTrackingInputType'] = 'vin'
-            payload['vin'] = args.vin
-        else:
-            payload['orderTrackingInputType'] = 'orderNumberInput'
-            payload['orderNumber'] = args.order_number
-            payload['dealerCode'] = args.dealer_code
-            payload['customerLastName'] = args.last_name
-
-        err, r = get_requests(url, payload)
-        if err:
+        new_parser = get_new_parser(args)
+        err, r = get_requests(url, get_payload(args, which_one), new_parser, timing=timing)
+        if err or new_parser is not None:
             return r
         else:
-            return r.text.replace('\n', '').replace('\r', '')
+            return r.content
 
     except KeyboardInterrupt:
         exit(2)
 
 
+async def get_data_async(session, args, which_one='', url=COTUS_URL[0], validators=None, timing=None):
+    """
+    The asyncio version of get_data().
+
+    :param session: the session shared by all the checks
+    :type session: aiohttp.ClientSession
+    :param args: the args from argparse
+    :type args: args
+    :param which_one: what type of order this is
+    :type which_one: str
+    :param url: url to COTUS
+    :type url: str
+    :param validators: ETag and Last-Modified from last time, updated with the ones of the response
+    :type validators: dict
+    :param timing: gets the seconds the last request to COTUS took ("latency")
+    :type timing: dict
+    :return: the response body, the page already parsed if it's streamed, or an error message,
+             None if the page didn't change since last time
+    :rtype: bytes or OrderPageParser or str
+    """
+
+    err, r = await get_requests_async(session, url, get_payload(args, which_one), get_new_parser(args), validators, timing)
+    return r
+
+
 def get_order_info(data):
     """
     Search in the response data to find useful information.
 
     :param data: data returned from COTUS.
-    :type data: str
+    :type data: str or bytes
     :return: order_info or error number
     :rtype: dict or int
     """
 
-    try:
+    return parse_order_page(data).order_info()
 
-        # Use regex to search the data and put them into a dictionary
-        order_info = {
-            'vehicle_name': re.search(u'class="vehicleName">(.*?)</span>', data).group(1).strip(),
-            'order_date': re.search(u'class="orderDate">(.*?)</span>', data).group(1).strip(),
-            'order_num': re.search(u'class="orderNumber">(.*?)</span>', data).group(1).strip(),
-            'dealer_code': re.search(u'"dealerInfo": { "dealerCode":(.*?)}', data).group(1).replace('"', '').strip(),
-            'order_vin': re.search(u'class="vin">(.*?)</span>', data).group(1).strip(),
-            'order_edd': re.search(u'id="hidden-estimated-delivery-date" data-part="(.*?)"', data).group(1).strip(),
-            'current_state': re.search(u'"selectedStepName":(.*?)"surveyOn"', data).group(1).replace(',', '').replace('"', '').strip().title(),
-            'email_sent': False,
-            'window_sticker_sent': False,
-            'initial_check_sent': False,
-            'edd_changed': False,
-            'state_changed': False
-        }
-
-        # some times the dealer name might not be available
-        try:
-            order_info['dealer_name'] = re.search(u'class="dealerName">(.*?)</span>', data).group(1).replace(',', '').replace('"', '').strip()
-            if not order_info['dealer_name']:
-                order_info['dealer_name'] = 'N/A'
-        except AttributeError:
-            order_info['dealer_name'] = 'N/A'
-
-        # format the dates
-        state_dates = [d.replace('.', '/').strip() for d in re.findall(u'Completed On : </span>(.*?)</span>', data)]
-        for i in range(len(state_dates)):
-            state_dates[i] = '{0}20{1}'.format(state_dates[i][:6], state_dates[i][6:])
-        order_info['state_dates'] = state_dates
-
-        # get vehicle summary
-        temp = [each.strip() for each in re.findall(u'class="part-detail-description.*?>(.*?)</div>', data)]
-        order_info['vehicle_summary'] = []
-        for each in temp:
-            if each not in order_info['vehicle_summary']:
-                order_info['vehicle_summary'].append(each)
-
-        # get the link to the rendered image of the car
-        order_info['car_pic_link'] = re.search(u'http://build\.ford\.com/(?:(?!http://build\.ford\.com/|/EXT/4/vehicle\.png).)*?/EXT/4/vehicle\.png', data).group().strip()
-
-        return order_info
 
-    except KeyboardInterrupt:
-        exit(2)
+def get_image_cache():
+    """
+    Open the cache of car pictures, only the runs that draw pictures pay for reading it
+    and removing what's too old.
 
-    except AttributeError:
-        return -1
+    :return: the cache
+    :rtype: ImageCache
+    """
 
+    global image_cache
+    with image_cache_lock:
+        if image_cache is None:
+            image_cache = ImageCache(os.path.join(DIR_CACHE, 'images'), get_requests, IMAGE_CACHE_SIZE * 1024 * 1024)
+        return image_cache
 
-def get_car_image(order_info):
+
+@metrics.timed('image')
+def get_car_image(order_info, pre_data=None):
     """
-    Generate a simple summary image using the order information.
+    Generate a simple summary image using the order information, the image is only
+    rendered again if what's on it changed since the last one.
 
-    :param order_info: order information
+    :param order_info: order information, the digest and hash of the image are put in it
     :type order_info: dict
-    :return: error number
-    :rtype: int
+    :param pre_data: the data returned from load_state(), None if it's the first time
+    :type pre_data: dict
+    :return: error number, the PNG file (None if there's an error)
+    :rtype: int, bytes
     """
 
-    # get the image from the link, then combine the image with order information and save to a new image
-    err, r = get_requests(order_info['car_pic_link'])
-    if not err:
+    # get the image from the link (or the cache), then combine the image with order information
+    # in memory, and write the new image in one step
+    source = get_image_cache().get(order_info['car_pic_link'])
+    if source is not None:
+        digest = render_digest(source, order_info)
         image_file_name = os.path.join(DIR_IMAGE, '{0}.png'.format(order_info['order_vin']))
-        open(image_file_name, 'wb').write(r.content)
-        img = Image.open(image_file_name)
-        img = img.convert('RGBA')
-        width = 850 + len(order_info['vehicle_name']) * 14
-        width = width if width > 1200 else 1200
-        img_sig = Image.new('RGBA', (width, 359), (255, 255, 255, 255))
-        img_sig.paste(img, (0, -40), img)
-
-        fnt = ImageFont.truetype('SourceCodePro-Bold.ttf', 20)
-        d = ImageDraw.Draw(img_sig)
-
-        d.text((600, 60), 'Vehicle Name:', font=fnt, fill=(0, 0, 0))
-        d.text((850, 60), order_info['vehicle_name'], font=fnt, fill=(14, 57, 201))
 
-        d.text((600, 85), 'Ordered On:', font=fnt, fill=(0, 0, 0))
-        d.text((850, 85), order_info['order_date'], font=fnt, fill=(54, 178, 8))
+        # Use the image we already have if it was made from the same things, and it's
+        # still the same file (the file is shared by every email address of the VIN).
+        if pre_data is not None and pre_data.get('image_digest') == digest and os.path.isfile(image_file_name):
+            png = open(image_file_name, 'rb').read()
+            if hashlib.sha256(png).hexdigest() == pre_data.get('image_sha256'):
+                order_info['image_digest'] = digest
+                order_info['image_sha256'] = pre_data['image_sha256']
+                return 0, png
 
-        d.text((600, 110), 'Estimated Delivery:', font=fnt, fill=(0, 0, 0))
-        d.text((850, 110), 'N/A' if not order_info['order_edd'] else order_info['order_edd'], font=fnt,
-               fill=(229, 150, 32))
+        png = cpu_pool.run('render', render_summary, source, order_info, order_states)
+        if png is None:
+            return -1, None
 
-        d.text((600, 135), 'Current State:', font=fnt, fill=(0, 0, 0))
-        d.text((850, 135), order_info['current_state'], font=fnt, fill=(209, 6, 40))
+        fd, temp_name = tempfile.mkstemp(dir=DIR_IMAGE, suffix='.png')
+        with os.fdopen(fd, 'wb') as out_file:
+            out_file.write(png)
+        os.replace(temp_name, image_file_name)
 
-        for i in range(5):
-            d.text((600, 160 + i * 25), order_states[i], font=fnt, fill=(0, 0, 0))
-            try:
-                d.text((850, 160 + i * 25), 'Completed On {0}'.format(order_info['state_dates'][i]), font=fnt,
-                       fill=(133, 17, 216))
-            except IndexError:
-                d.text((850, 160 + i * 25), 'N/A', font=fnt, fill=(133, 17, 216))
-
-        img_sig.save(image_file_name, 'PNG')
-
-        return 0
+        order_info['image_digest'] = digest
+        order_info['image_sha256'] = hashlib.sha256(png).hexdigest()
+        return 0, png
 
-    return -1
+    return -1, None
 
 
-def format_order_info(data, args, url):
+@metrics.timed('format')
+def format_order_info(data, args, url, key=None, validators=None, fetch_ws=None):
     """
     Format the order info data into a readable string.
 
-    :param data: the raw string data returned from get_data()
-    :type data: str
+    :param data: the raw data returned from get_data(), or the page already parsed
+    :type data: bytes or str or OrderPageParser
     :param args: args parsed from argparse
     :type args: args
     :param url: the url used to get the data in get_data()
     :type url: str
+    :param key: the order as it is in the order file, used to skip the orders that didn't change since last time
+    :type key: str
+    :param validators: ETag and Last-Modified of the response
+    :type validators: dict
+    :param fetch_ws: downloads the window sticker, shared by the orders with the same VIN
+    :type fetch_ws: callable
     :return: error code, formatted str if there is no error or an error message
     :rtype: int, str
     """
 
-    try:
+    # What the order looked like last time, if it was taken care of.
+    record = None
+    if key and state_store is not None:
+        record = state_store.fingerprint(key)
+
+    if data is None and record is not None:
+        # COTUS says the page didn't change, no need to parse anything.
+        order_info = dict.fromkeys(FLAGS, False)
+        order_info.update(record['order_info'])
+    else:
+        # Parse the page once, unless it was already parsed while it was downloaded.
+        page = data if isinstance(data, OrderPageParser) else parse_order_page(data if data is not None else b'')
+
         # Check if there is an error message in the data, if there is one
         # then it means the data has nothing useful (invalid order or order not found).
-        error_msg = re.search(u'class="top-level-error enabled">(.*?)</p>', data).group(1).strip() + '\n'
-        return -1, error_msg
-    except KeyboardInterrupt:
-        exit(2)
-    except AttributeError:
+        if page.error_msg is not None:
+            return -1, page.error_msg
+
         # If we got to here it means there is no error message in the data,
         # so we need to parse the str and put them into useful format.
         # COTUS might be unavailable from time to time, so even if there's
         # no error messages, it might just because there's nothing at all.
-        order_info = get_order_info(data)
+        order_info = page.order_info()
         if order_info == -1:
             return -2, 'COTUS down!'
 
-        # Get the window sticker if needed.
-        ws_err = -1
-        ws_str = '{0}N/A{1}'.format(RED, RESET)
-        if args.window_sticker:
-            ws_err, ws_str = get_window_sticker(order_info['order_vin'], args.send_email)
+    # Nothing needs to be done if the order is the same as last time, and the state we
+    # keep for the email address still says so, otherwise check_state() puts it right.
+    unchanged = record is not None and record['digest'] == order_fingerprint(order_info)
+    pre_data = None
+    if unchanged and args.send_email:
+        pre_data = load_state(order_info['order_vin'], args.send_email)
+        unchanged = pre_data is not None and pre_data.get('email_sent') and order_fingerprint(pre_data) == record['digest']
+
+    ws_err = -1
+    ws_str = '{0}N/A{1}'.format(RED, RESET)
+    email_sent = '{0}N/A{1}'.format(RED, RESET)
+
+    # Get the window sticker if needed, it's always downloaded so a new one is never missed,
+    # the hash of the one we have is in the record of the order, or in its state.
+    fast_path = unchanged
+    if args.window_sticker:
+        if args.send_email and pre_data is None:
+            pre_data = load_state(order_info['order_vin'], args.send_email)
+        if pre_data is not None:
+            sha256_old = pre_data.get('window_sticker_sha256')
+        else:
+            sha256_old = record.get('ws_sha256') if record is not None else None
+        ws_err, ws_str, order_info['window_sticker_sha256'] = get_window_sticker(
+            order_info['order_vin'], args.send_email, sha256_old, fetch_ws)
+
+        # Still nothing to do if the window sticker isn't out yet, or it's the one we had last time.
+        fast_path = unchanged and (ws_err < 0 or (ws_err == 0 and record['ws_found']))
+
+    if fast_path:
+        metrics.count('orders_unchanged_total')
+        if args.send_email:
+            email_sent = '{0}STATUS NOT CHANGED{1}'.format(YELLOW, RESET)
+        if validators and (validators.get('etag'), validators.get('last_modified')) != (record['etag'], record['last_modified']):
+            state_store.put_fingerprint(key, record['digest'], validators.get('etag'), validators.get('last_modified'),
+                                        record['ws_found'], record['ws_sha256'], record['order_info'])
+    else:
+        fresh_info = page_info(order_info)
 
         # Send email if needed.
-        email_sent = '{0}N/A{1}'.format(RED, RESET)
         if args.send_email:
-            email_sent = check_state(order_info, args.send_email, ws_err, args.generate_image)
-
-        # Put the parsed data into string format so it can be printed out nicely.
-        order_str = 'Order Information:\n'
-        order_str += '  {0: <21}{1}{2}{3}\n'.format('Vehicle Name:', GREEN, order_info['vehicle_name'], RESET)
-        order_str += '  {0: <21}{1}{2}{3}\n'.format('Ordered On:', WHITE, order_info['order_date'], RESET)
-        order_str += '  {0: <21}{1}{2}{3}\n'.format('Order Number:', WHITE, order_info['order_num'], RESET)
-        order_str += '  {0: <21}{1}{2}{3}\n'.format('Dealer Code:', WHITE, order_info['dealer_code'], RESET)
-        order_str += '  {0: <21}{1}{2}{3}\n'.format('VIN:', WHITE, order_info['order_vin'], RESET)
-        order_str += '  {0: <21}{1}{2}{3}\n'.format('Dealer Name:', BLUE, order_info['dealer_name'], RESET)
-        order_str += '  {0: <21}{1}{2}{3}\n'.format('Estimated Delivery:', CYAN, 'N/A' if not order_info['order_edd'] else order_info['order_edd'], RESET)
-        order_str += '  {0: <21}{1}{2}{3}\n'.format('Current State:', RED, order_info['current_state'], RESET)
-
-        # Format the dates if there are any.
-        for i in range(5):
-            try:
-                order_str += '  {0: <21}{1}Completed On {2}{3}{4}\n'.format(order_states[i], PURPLE, GREEN, order_info['state_dates'][i], RESET)
-            except IndexError:
-                order_str += '  {0: <21}{1}{2}{3}\n'.format(order_states[i], PURPLE, 'N/A', RESET)
+            if pre_data is None:
+                pre_data = load_state(order_info['order_vin'], args.send_email)
+            email_sent = check_state(order_info, args.send_email, ws_err, args.generate_image, pre_data)
+
+        # Remember the order once everything went through.
+        if key and state_store is not None and (not args.send_email or order_info['email_sent']):
+            if args.window_sticker:
+                ws_found, ws_sha256 = ws_err >= 0, order_info['window_sticker_sha256']
+            elif record is not None:
+                ws_found, ws_sha256 = record['ws_found'], record['ws_sha256']
+            else:
+                ws_found, ws_sha256 = False, None
+            validators = validators or {}
+            state_store.put_fingerprint(key, order_fingerprint(fresh_info), validators.get('etag'), validators.get('last_modified'),
+                                        ws_found, ws_sha256, fresh_info)
+
+    # Put the parsed data into string format so it can be printed out nicely.
+    order_str = 'Order Information:\n'
+    order_str += '  {0: <21}{1}{2}{3}\n'.format('Vehicle Name:', GREEN, order_info['vehicle_name'], RESET)
+    order_str += '  {0: <21}{1}{2}{3}\n'.format('Ordered On:', WHITE, order_info['order_date'], RESET)
+    order_str += '  {0: <21}{1}{2}{3}\n'.format('Order Number:', WHITE, order_info['order_num'], RESET)
+    order_str += '  {0: <21}{1}{2}{3}\n'.format('Dealer Code:', WHITE, order_info['dealer_code'], RESET)
+    order_str += '  {0: <21}{1}{2}{3}\n'.format('VIN:', WHITE, order_info['order_vin'], RESET)
+    order_str += '  {0: <21}{1}{2}{3}\n'.format('Dealer Name:', BLUE, order_info['dealer_name'], RESET)
+    order_str += '  {0: <21}{1}{2}{3}\n'.format('Estimated Delivery:', CYAN, 'N/A' if not order_info['order_edd'] else order_info['order_edd'], RESET)
+    order_str += '  {0: <21}{1}{2}{3}\n'.format('Current State:', RED, order_info['current_state'], RESET)
+
+    # Format the dates if there are any.
+    for i in range(5):
+        try:
+            order_str += '  {0: <21}{1}Completed On {2}{3}{4}\n'.format(order_states[i], PURPLE, GREEN, order_info['state_dates'][i], RESET)
+        except IndexError:
+            order_str += '  {0: <21}{1}{2}{3}\n'.format(order_states[i], PURPLE, 'N/A', RESET)
+
+    # Where we got the information.
+    order_str += '  {0: <21}{1}{2}{3}\n'.format('Source:', YELLOW, url, RESET)
+
+    # What happened to the window sticker.
+    if args.window_sticker:
+        order_str += '  {0: <21}{1}\n'.format('Window Sticker:', ws_str)
+
+    # What happened to the email.
+    if args.send_email:
+        order_str += '  {0: <21}{1}\n'.format('Email Sent:', email_sent)
+
+    # Everything about the car.
+    if args.vehicle_summary:
+        order_str += '  Vehicle Summary:\n'
+        for each in order_info['vehicle_summary']:
+            order_str += '    {0}\n'.format(each)
+
+    # Return 1 if the status say "delivered" so we can remove this order from future checks.
+    # Otherwise return 0 to say everything is fine.
+    if 'delivered' in order_info['current_state'].lower():
+        return 1, order_str
+    else:
+        return 0, order_str
 
-        # Where we got the information.
-        order_str += '  {0: <21}{1}{2}{3}\n'.format('Source:', YELLOW, url, RESET)
 
-        # What happened to the window sticker.
-        if args.window_sticker:
-            order_str += '  {0: <21}{1}\n'.format('Window Sticker:', ws_str)
+@metrics.timed('state')
+def load_state(vin, send_email):
+    """
+    Read the state of the order saved by the previous check.
 
-        # What happened to the email.
-        if args.send_email:
-            order_str += '  {0: <21}{1}\n'.format('Email Sent:', email_sent)
-
-        # Everything about the car.
-        if args.vehicle_summary:
-            order_str += '  Vehicle Summary:\n'
-            for each in order_info['vehicle_summary']:
-                order_str += '    {0}\n'.format(each)
-
-        # Return 1 if the status say "delivered" so we can remove this order from future checks.
-        # Otherwise return 0 to say everything is fine.
-        if 'delivered' in order_info['current_state'].lower():
-            return 1, order_str
-        else:
-            return 0, order_str
+    :param vin: the VIN
+    :type vin: str
+    :param send_email: email address
+    :type send_email: str
+    :return: the state, None if there isn't one
+    :rtype: dict
+    """
+
+    return state_store.get(vin, send_email)
+
+
+@metrics.timed('state')
+def save_state(cur_data, send_email):
+    """
+    Save the state of the order, overwriting the old one. It's committed with the rest of the batch.
+
+    :param cur_data: the state
+    :type cur_data: dict
+    :param send_email: email address
+    :type send_email: str
+    """
+
+    state_store.put(cur_data['order_vin'], send_email, cur_data)
 
 
-def check_state(cur_data, send_email, ws_err, generate_image):
+@metrics.timed('check_state')
+def check_state(cur_data, send_email, ws_err, generate_image, pre_data):
     """
     Check the previous state of the order and decide what needs to be done.
 
@@ -514,12 +876,13 @@ def check_state(cur_data, send_email, ws_err, generate_image):
     :type ws_err: int
     :param generate_image: whether to generate an image
     :type generate_image: bool
+    :param pre_data: the data returned from load_state(), None if it's the first time
+    :type pre_data: dict
     :return: what happened
     :rtype: str
     """
 
     # File names we will be using.
-    file_name = os.path.join(DIR_INFO, '{0}_{1}.json'.format(cur_data['order_vin'], send_email))
     ws_name = os.path.join(DIR_WINDOW_STICKER, '{0}_{1}.pdf'.format(cur_data['order_vin'], send_email))
 
     initial_check = True
@@ -531,14 +894,6 @@ def check_state(cur_data, send_email, ws_err, generate_image):
     cur_edd = cur_data['order_edd']
     cur_state = cur_data['current_state']
 
-    # Try to read the data from previous checks if there is one.
-    pre_data = None
-    if os.path.isfile(file_name):
-        try:
-            pre_data = json.load(open(file_name, 'r'))
-        except json.decoder.JSONDecodeError:
-            pre_data = None
-
     if pre_data is not None:
         # If we found previous data it means this is not the first time,
         # so we need to do a few compares to see what we need to do.
@@ -584,6 +939,9 @@ def check_state(cur_data, send_email, ws_err, generate_image):
         cur_data['email_sent'] = pre_data['email_sent']
         cur_data['initial_check_sent'] = pre_data['initial_check_sent']
         cur_data['window_sticker_sent'] = pre_data['window_sticker_sent']
+        cur_data.setdefault('window_sticker_sha256', pre_data.get('window_sticker_sha256'))
+        cur_data.setdefault('image_digest', pre_data.get('image_digest'))
+        cur_data.setdefault('image_sha256', pre_data.get('image_sha256'))
     else:
         # If it's the first time, everything needs to be sent.
         if cur_edd:
@@ -601,9 +959,9 @@ def check_state(cur_data, send_email, ws_err, generate_image):
     if edd_changed or state_changed or send_ws or not email_sent:
 
         # Generate the image if needed.
-        img_err = -1
+        img_err, img = -1, None
         if generate_image:
-            img_err = get_car_image(cur_data)
+            img_err, img = get_car_image(cur_data, pre_data)
 
         # What happened to the EDD.
         if edd_changed:
@@ -623,7 +981,8 @@ def check_state(cur_data, send_email, ws_err, generate_image):
             initial_check,
             send_ws,
             ws_err,
-            img_err
+            img_err,
+            img
         )
 
     # Update a few flags if everything went through.
@@ -633,13 +992,14 @@ def check_state(cur_data, send_email, ws_err, generate_image):
         if send_ws:
             cur_data['window_sticker_sent'] = True
 
-    # Save the new status of the order to the file, overwriting the old one.
-    json.dump(cur_data, open(file_name, 'w'), indent=2)
+    # Save the new status of the order, overwriting the old one.
+    save_state(cur_data, send_email)
 
     return ret_msg
 
 
-def report_with_email(email_to, edd='', state='', vin='', initial_check=False, send_ws=False, ws_err=0, img_err=-1):
+@metrics.timed('email')
+def report_with_email(email_to, edd='', state='', vin='', initial_check=False, send_ws=False, ws_err=0, img_err=-1, img=None):
     """
     Send the email.
 
@@ -659,6 +1019,8 @@ def report_with_email(email_to, edd='', state='', vin='', initial_check=False, s
     :type ws_err: int
     :param img_err: error code returned by get_car_image()
     :type img_err: int
+    :param img: the image returned by get_car_image(), read from the file if it's not given
+    :type img: bytes
     :return: error code, error message
     :rtype: int, str
     """
@@ -667,6 +1029,13 @@ def report_with_email(email_to, edd='', state='', vin='', initial_check=False, s
         # We need user name and password to send emails.
         return -1, '{0}Empty Gmail Username or Password{1}'.format(RED, RESET)
     else:
+        # The email modules are only loaded when there's an email to send.
+        from email.mime.application import MIMEApplication
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        from email.utils import formatdate, make_msgid
+        smtplib = _smtplib()
+
         email_from = gmail_user
         email_body = ''
 
@@ -689,6 +1058,7 @@ def report_with_email(email_to, edd='', state='', vin='', initial_check=False, s
         email_msg['From'] = gmail_user
         email_msg['To'] = email_to
         email_msg['Date'] = formatdate(localtime=True)
+        email_msg['Message-ID'] = make_msgid(domain='cotus-checker')
         email_msg.attach(MIMEText(email_body))
 
         # Attach the window sticker file to the email if needed.
@@ -702,18 +1072,23 @@ def report_with_email(email_to, edd='', state='', vin='', initial_check=False, s
         # Attach the image file to the email if needed.
         if not img_err:
             attachment_name = '{0}.png'.format(vin)
-            file_name = os.path.join(DIR_IMAGE, attachment_name)
-            attachment = MIMEApplication(open(file_name, 'rb').read())
+            if img is None:
+                img = open(os.path.join(DIR_IMAGE, attachment_name), 'rb').read()
+            attachment = MIMEApplication(img)
             attachment.add_header('Content-Disposition', 'attachment; filename="{0}"'.format(attachment_name))
             email_msg.attach(attachment)
 
+        # Put the email in the outbox, it's sent in the background and retried there if it fails.
+        if outbox is not None:
+            try:
+                outbox.put(email_msg['Message-ID'], email_from, email_to, email_msg.as_string())
+                return 0, '{0}QUEUED{1}'.format(GREEN, RESET)
+            except OSError:
+                return -1, '{0}FAIL{1}'.format(RED, RESET)
+
         # Try to send the email, return 0 on success, -1 on fail.
         try:
-            gmail_server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-            gmail_server.ehlo()
-            gmail_server.login(gmail_user, gmail_pswd)
-            gmail_server.sendmail(email_from, email_to, email_msg.as_string())
-            gmail_server.close()
+            smtp_pool.send(email_from, email_to, email_msg.as_string())
             return 0, '{0}SUCCESS{1}'.format(GREEN, RESET)
         except KeyboardInterrupt:
             exit(2)
@@ -723,55 +1098,288 @@ def report_with_email(email_to, edd='', state='', vin='', initial_check=False, s
             return -1, '{0}FAIL{1}'.format(RED, RESET)
 
 
-def check_order(q_in, q_out, q_count):
+def lookup_key(order):
+    """
+    What COTUS is asked for an order, orders with the same key get the same page.
+
+    :param order: the order information
+    :type order: list[str]
+    :return: the key
+    :rtype: tuple
+    """
+
+    if order[0] == 'vin':
+        return tuple(order[:2])
+    else:
+        return tuple(order[:3])
+
+
+@metrics.timed('parse')
+def parse_data(data):
+    """
+    Parse the page once for every order that shares it.
+
+    :param data: the raw data returned from get_data(), or the page already parsed
+    :type data: bytes or str or OrderPageParser
+    :return: the page, None if COTUS said it didn't change
+    :rtype: OrderPageParser
+    """
+
+    if data is None or isinstance(data, OrderPageParser):
+        return data
+    return parse_order_page(data)
+
+
+def group_validators(group):
+    """
+    Only ask COTUS whether the page changed if every order in the group has a record from
+    the same response, otherwise some of them would have nothing to work with.
+
+    :param group: the orders sharing one page
+    :type group: list[tuple]
+    :return: ETag and Last-Modified to send
+    :rtype: dict
+    """
+
+    if state_store is None:
+        return {}
+    validators = None
+    for args, order, list_id in group:
+        record = state_store.fingerprint(','.join(order))
+        if record is None:
+            return {}
+        cur = {'etag': record['etag'], 'last_modified': record['last_modified']}
+        if validators is not None and cur != validators:
+            return {}
+        validators = cur
+    return validators
+
+
+async def fetch_page(session, executor, args, order, url, validators):
+    """
+    Fetch and parse the page of an order from one mirror, and report how the mirror did.
+
+    :param session: the session shared by all the checks
+    :type session: aiohttp.ClientSession
+    :param executor: threads used to parse the page
+    :type executor: ThreadPoolExecutor
+    :param args: args of the order
+    :type args: args
+    :param order: the order information
+    :type order: list[str]
+    :param url: the mirror
+    :type url: str
+    :param validators: ETag and Last-Modified from last time, updated with the ones of the response
+    :type validators: dict
+    :return: the page (None if it didn't change since last time), what went wrong (None if nothing did)
+    :rtype: OrderPageParser, str
+    """
+
+    # Only the request itself counts as the mirror's latency, not the time it waited for
+    # the rate limit of the host or for another try.
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    timing = {}
+    data = await get_data_async(session, args, order[0], url=url, validators=validators, timing=timing)
+    latency = timing.get('latency', loop.time() - start)
+    page = await loop.run_in_executor(executor, parse_data, data)
+
+    # The mirror did its job unless it timed out or sent a page with nothing on it,
+    # an order COTUS doesn't know about isn't the mirror's fault.
+    kind = classify(data, page)
+    mirrors.record(url, kind not in TRANSIENT, latency)
+    metrics.observe(STAGE_SECONDS, latency, stage='fetch')
+    metrics.count('lookups_total', mirror=url, result=kind or 'ok')
+    return page, kind
+
+
+async def fetch_hedged(session, executor, args, order, url, validators):
+    """
+    Fetch and parse the page of an order, if the mirror takes longer than most of its
+    requests do, ask a second mirror too (if the budget allows), the first usable page wins.
+
+    :param session: the session shared by all the checks
+    :type session: aiohttp.ClientSession
+    :param executor: threads used to parse the page
+    :type executor: ThreadPoolExecutor
+    :param args: args of the order
+    :type args: args
+    :param order: the order information
+    :type order: list[str]
+    :param url: the mirror to ask first
+    :type url: str
+    :param validators: ETag and Last-Modified from last time, updated with the ones of the winning response
+    :type validators: dict
+    :return: the mirror that answered, the page (None if it didn't change since last time),
+             what went wrong (None if nothing did)
+    :rtype: str, OrderPageParser, str
+    """
+
+    # Every request gets its own validators, only the winner's are kept.
+    tasks = {}
+    task_validators = dict(validators)
+    task = asyncio.ensure_future(fetch_page(session, executor, args, order, url, task_validators))
+    tasks[task] = (url, task_validators)
+    hedge_budget.count_request()
+
+    threshold = mirrors.percentile(url, args.hedge_percentile)
+    if threshold is not None:
+        done, pending = await asyncio.wait([task], timeout=threshold)
+        if pending:
+            hedge_url = mirrors.choose(exclude=[url])
+            if hedge_url != url and hedge_budget.take():
+                task_validators = dict(validators)
+                hedge = asyncio.ensure_future(fetch_page(session, executor, args, order, hedge_url, task_validators))
+                tasks[hedge] = (hedge_url, task_validators)
+
+    while True:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task_url, task_validators = tasks.pop(task)
+            page, kind = task.result()
+            if kind not in TRANSIENT or not tasks:
+                # Cancel the loser, if there's one.
+                for other in tasks:
+                    other.cancel()
+                if task_url != url:
+                    hedge_budget.count_win()
+                validators.clear()
+                validators.update(task_validators)
+                return task_url, page, kind
+
+
+async def check_order(session, executor, q_in, q_out, q_count):
+    """
+    Worker coroutine, many of them share one event loop in batch mode.
+
+    Each item in the input queue is a group of orders that look up the same thing,
+    the page is fetched and parsed once, then every order in the group is
+    formatted (and gets its emails) on its own. A lookup that failed for a reason
+    that might go away is put back into the queue after a while, and the worker
+    moves on to the next group in the meantime. A group that fails with an
+    exception is logged and counted as an error, the worker keeps going.
+
+    :param session: the session shared by all the checks
+    :type session: aiohttp.ClientSession
+    :param executor: threads used to run the blocking part of a check
+    :type executor: ThreadPoolExecutor
+    :param q_in: groups of input data from the order file, how many times they were retried, the mirrors tried,
+                 and when they were (or will be) put into the queue
+    :type q_in: asyncio.Queue
+    :param q_out: keep track of which orders needs to be removed from the order file
+    :type q_out: list[int]
+    :param q_count: keep track of how many orders of each group were checked successfully
+    :type q_count: list[int]
     """
-    Thread.
 
-    :param q_in: input data from the order file, and other related info
-    :type q_in: Queue
+    logger = logging.getLogger('COTUS Checker')
+
+    # Keep checking until check_orders() stops the workers, once every group is done.
+    while True:
+
+        # Get the orders sharing one page.
+        item = await q_in.get()
+        finished = True
+        try:
+            finished = await check_group(session, executor, q_in, q_out, q_count, item)
+        except Exception:
+            # Only this group is lost, not the rest of the batch.
+            group = item[0]
+            logger.exception('Check failed: {0}'.format(','.join(group[0][1])))
+            metrics.count('check_errors_total', len(group))
+            store_results(group, [(-1, '{0}CHECK FAILED{1}'.format(RED, RESET))] * len(group), q_out)
+        finally:
+            # A group put back to be retried isn't done yet.
+            if finished:
+                q_in.task_done()
+
+
+async def check_group(session, executor, q_in, q_out, q_count, item):
+    """
+    Check a group of orders that look up the same thing.
+
+    :param session: the session shared by all the checks
+    :type session: aiohttp.ClientSession
+    :param executor: threads used to run the blocking part of a check
+    :type executor: ThreadPoolExecutor
+    :param q_in: the input queue, the group is put back into it to be retried
+    :type q_in: asyncio.Queue
     :param q_out: keep track of which orders needs to be removed from the order file
-    :type q_out: Queue
-    :param q_count: keep track of how many orders each thread checked successfully
-    :type q_count: Queue
+    :type q_out: list[int]
+    :param q_count: keep track of how many orders of each group were checked successfully
+    :type q_count: list[int]
+    :param item: the group, how many times it was retried, the mirrors tried, and when it was put into the queue
+    :type item: tuple
+    :return: False if the group was put back into the queue to be retried later
+    :rtype: bool
     """
 
-    global order_str_list
+    loop = asyncio.get_running_loop()
+    group, attempt, tried, ready_at = item
+    args, order, list_id = group[0]
+    metrics.observe('queue_wait_seconds', loop.time() - ready_at)
+
+    # Send what we got from COTUS last time, so it can tell us the page didn't change.
+    validators = group_validators(group)
+
+    # Every try goes to the mirror doing best right now, a different one than last time if there is one.
+    url = mirrors.choose(exclude=tried[-1:])
+    tried.append(url)
+    if args.hedge:
+        url, page, kind = await fetch_hedged(session, executor, args, order, url, validators)
+    else:
+        page, kind = await fetch_page(session, executor, args, order, url, validators)
+
+    # Try again later if it's worth it and the budget allows, the group stays
+    # in the queue (without holding this worker) until then.
+    if kind is not None:
+        last = attempt + 1 >= len(COTUS_URL) * COTUS_RETRY
+        if retry_budget.take(kind, last):
+            delay = backoff(attempt)
+            requeue_later(q_in, (group, attempt + 1, tried, loop.time() + delay), delay)
+            metrics.count('retries_total', mirror=url, kind=kind)
+            return False
+
+    # The window sticker is downloaded at most once for the whole group.
+    fetch_ws = fetch_once(fetch_window_sticker)
+
+    # Format the data, formatting might fetch the window sticker, generate the
+    # image and send emails, so it's done in the thread pool. The first order
+    # tells whether the page is any good, if it is the rest of the group are
+    # formatted at the same time.
+    results = [await loop.run_in_executor(executor, format_order_info, page, args, url,
+                                          ','.join(order), dict(validators), fetch_ws)]
+    if results[0][0] >= 0:
+        results += await asyncio.gather(*[
+            loop.run_in_executor(executor, format_order_info, page, each_args, url,
+                                 ','.join(each_order), dict(validators), fetch_ws)
+            for each_args, each_order, each_id in group[1:]])
+        q_count.append(len(group))
+    else:
+        results *= len(group)
 
-    # Keep track of how many orders each thread checked successfully.
-    count = 0
+    store_results(group, results, q_out)
+    return True
 
-    # Keep checking until the input queue is empty.
-    while not q_in.empty():
 
-        # Get the info needed to check an order, and reset the stop flag.
-        args, order, list_id = q_in.get()
-        err = -1
-        msg = ''
-        stop_flag = False
+def store_results(group, results, q_out):
+    """
+    Keep the result of every order in a group, so they're printed in the order of the order file.
 
-        # Keep retrying until hitting the retry limit, or until one check succeeds.
-        for i in range(len(COTUS_URL)):
-            if stop_flag:
-                break
-            url = COTUS_URL[i]
-            for j in range(COTUS_RETRY):
-                if stop_flag:
-                    break
-
-                # Get the data then format it.
-                data = get_data(args, order[0], url=url)
-                err, msg = format_order_info(data, args, url)
-
-                # Stop trying if nothing went wrong.
-                if err >= 0:
-                    stop_flag = True
-                    count += 1
-                else:
-                    time.sleep(COTUS_WAIT)
+    :param group: the orders
+    :type group: list[tuple]
+    :param results: error number and message of every order
+    :type results: list[tuple]
+    :param q_out: keep track of which orders needs to be removed from the order file
+    :type q_out: list[int]
+    """
+
+    global order_str_list, order_err_list
 
+    for (args, order, list_id), (err, msg) in zip(group, results):
         if err == 1:
-            # Put the index of the current order into the out queue so it'll be removed.
-            q_out.put(list_id)
+            # Put the index of the current order into the out list so it'll be removed.
+            q_out.append(list_id)
         elif err == -1:
             # Format the error message.
             if order[0] == 'vin':
@@ -787,12 +1395,288 @@ def check_order(q_in, q_out, q_count):
 
         # Put the message into the global list using the index so
         # it can be printed out in the same order of the order file.
-        the_lock.acquire()
         order_str_list[list_id] = msg
-        the_lock.release()
+        order_err_list[list_id] = err
 
-    # Put the total number of orders checked by this thread in the queue.
-    q_count.put(count)
+
+async def log_concurrency(interval):
+    """
+    Log how many requests every host gets at the same time, until cancelled.
+
+    :param interval: seconds between two logs
+    :type interval: float
+    """
+
+    logger = logging.getLogger('COTUS Checker')
+    while True:
+        await asyncio.sleep(interval)
+        for host, stats in rate_limits.stats().items():
+            logger.info('Rate Limit: {0}, Concurrency: {1}, In Flight: {2}, Requests: {3}, Waited: {4}'.format(
+                host, stats['concurrency'], stats['in_flight'], stats['requests'], stats['waits']))
+
+
+async def check_orders(jobs, concurrency, workers):
+    """
+    Check all the orders, at most "concurrency" pages are fetched at the same time.
+    Orders looking up the same VIN, or the same order number and dealer code,
+    are checked together so COTUS is only asked once.
+
+    :param jobs: input data from the order file, and other related info
+    :type jobs: list[tuple]
+    :param concurrency: how many orders can be checked at the same time
+    :type concurrency: int
+    :param workers: how many threads are used for the blocking part of a check
+    :type workers: int
+    :return: indexes of the orders that needs to be removed, number of orders checked successfully
+    :rtype: list[int], int
+    """
+
+    groups = {}
+    for job in jobs:
+        groups.setdefault(lookup_key(job[1]), []).append(job)
+    retry_budget.start(len(groups))
+
+    q_in = asyncio.Queue()
+    now = asyncio.get_running_loop().time()
+    for group in groups.values():
+        q_in.put_nowait((group, 0, [], now))
+    q_out = []
+    q_count = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        async with http_pool.async_session(concurrency) as session:
+            # The queue can be empty while lookups are waiting to be retried, so the workers
+            # keep waiting for more until every group is done, or one of them fails.
+            tasks = [asyncio.ensure_future(check_order(session, executor, q_in, q_out, q_count)) for i in range(concurrency)]
+            tasks.append(asyncio.ensure_future(log_concurrency(CONCURRENCY_LOG_INTERVAL)))
+            try:
+                await q_in.join()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    return q_out, sum(q_count)
+
+
+def check_batch(args, orders):
+    """
+    Check a batch of orders and print the results.
+
+    :param args: args parsed from argparse
+    :type args: args
+    :param orders: the orders to check
+    :type orders: list[list[str]]
+    :return: indexes of the orders that needs to be removed, number of orders checked successfully,
+             error number of every order
+    :rtype: list[int], int, list[int]
+    """
+
+    global order_str_list, order_err_list
+
+    # Everything the workers need to check the orders.
+    jobs = []
+    order_str_list = []
+    order_err_list = []
+
+    # Different order types needs different data.
+    # Just being lazy here, using existing args variable since we don't need the other parts of it.
+    for o in orders:
+        if o[0] == 'vin':
+            if len(o) == 2:
+                args.order_number = ''
+                args.dealer_code = ''
+                args.vin = o[1]
+                args.send_email = ''
+            else:
+                args.order_number = ''
+                args.dealer_code = ''
+                args.vin = o[1]
+                args.send_email = o[2]
+        else:
+            if len(o) == 3:
+                args.order_number = o[1]
+                args.dealer_code = o[2]
+                args.vin = ''
+                args.send_email = ''
+            else:
+                args.order_number = o[1]
+                args.dealer_code = o[2]
+                args.vin = ''
+                args.send_email = o[3]
+
+        # Must make copy so we can have put them into different workers without messing up.
+        # The length of the order_str_list will be the index to write to it.
+        jobs.append((copy.deepcopy(args), o, len(order_str_list)))
+        order_str_list.append('')
+        order_err_list.append(-1)
+
+    # Check all of them, and wait for them to finish.
+    remove_list, q_count = asyncio.run(check_orders(jobs, args.concurrency, args.workers))
+
+    # Print out all the query results.
+    for s in order_str_list:
+        print_to_screen(s)
+
+    metrics.count('orders_total', len(orders))
+    metrics.count('orders_succeeded_total', q_count)
+    return remove_list, q_count, order_err_list
+
+
+def log_stats(logger, total, q_count):
+    """
+    Log what we did, the numbers after the first line are since the start.
+
+    :param logger: the logger
+    :type logger: logging.Logger
+    :param total: number of orders checked
+    :type total: int
+    :param q_count: number of orders checked successfully
+    :type q_count: int
+    """
+
+    logger.info('Total Orders: {0}, Query Success: {1}, Not Changed: {2}'.format(total, q_count, metrics.value('orders_unchanged_total')))
+    for url, stats in mirrors.stats().items():
+        logger.info('Mirror: {0}, State: {1}, Latency: {2:.3f}s, Error Rate: {3:.1%}, Requests: {4}, Failures: {5}, Opened: {6}'.format(
+            url, stats['state'], stats['latency'], stats['error_rate'], stats['requests'], stats['failures'], stats['opened']))
+    stats = retry_budget.stats()
+    if stats['retries'] or any(stats['errors'].values()):
+        logger.info('Lookup Errors: Timeout: {0}, COTUS Down: {1}, Permanent: {2}, Retried: {3}, Out of Budget: {4}'.format(
+            stats['errors'][TIMEOUT], stats['errors'][DOWN], stats['errors'][PERMANENT], stats['retries'], stats['exhausted']))
+    stats = hedge_budget.stats()
+    if stats['hedges']:
+        logger.info('Hedged Requests: {0} of {1}, Answered First: {2}'.format(stats['hedges'], stats['requests'], stats['wins']))
+    for host, stats in http_pool.stats().items():
+        logger.info('Connection Pool: {0}, Hits: {1}, Misses: {2}'.format(host, stats['hits'], stats['misses']))
+    for host, stats in rate_limits.stats().items():
+        logger.info('Rate Limit: {0}, Concurrency: {1} (lowest {2}, highest {3}), Requests: {4}, Waited: {5}, Backed Off: {6}'.format(
+            host, stats['concurrency'], stats['lowest'], stats['peak'], stats['requests'], stats['waits'], stats['decreases']))
+    if outbox is not None:
+        outbox.flush()
+        stats = outbox.stats()
+        logger.info('Outbox: Queued: {0}, Sent: {1}, Retried: {2}, Failed: {3}, Errors: {4}, Not Sent Again: {5}, Pending: {6}'.format(
+            stats['queued'], stats['sent'], stats['retried'], stats['failed'], stats['errors'], stats['duplicates'], stats['pending']))
+    for stage, stats in cpu_pool.stats().items():
+        logger.info('CPU Stage: {0}, Jobs: {1}, Max Queue Depth: {2}, Wait: {3:.3f}s, Run: {4:.3f}s, Restarts: {5}, Failed: {6}'.format(
+            stage, stats['jobs'], stats['max_depth'], stats['wait'], stats['run'], stats['restarts'], stats['failed']))
+    if image_cache is not None:
+        stats = image_cache.stats()
+        logger.info('Image Cache: Hits: {0}, Revalidated: {1}, Misses: {2}, Hit Ratio: {3:.1%}, Evictions: {4}, Size: {5}'.format(
+            stats['hits'], stats['revalidated'], stats['misses'], stats['hit_ratio'], stats['evictions'], stats['size']))
+    stats = smtp_pool.stats()
+    logger.info('SMTP Pool: Sent: {0}, Failed: {1}, Connections: {2}, Reconnects: {3}, Latency: {4:.3f}s avg, {5:.3f}s max'.format(
+        stats['sent'], stats['failed'], stats['connections'], stats['reconnects'], stats['avg_latency'], stats['max_latency']))
+
+
+def save_batch(registry, orders, remove_list):
+    """
+    Remove the delivered orders and save everything for next time.
+
+    :param registry: the orders in the order file
+    :type registry: OrderRegistry
+    :param orders: the orders that were checked
+    :type orders: list[list[str]]
+    :param remove_list: indexes of the orders that needs to be removed
+    :type remove_list: list[int]
+    """
+
+    # Remove orders that are marked "Delivered" from the order file,
+    # the file is only written if something changed.
+    for i in remove_list:
+        registry.remove(','.join(orders[i]))
+    registry.save()
+
+    # Forget the orders that are gone, and save the rest for next time, the states
+    # and the fingerprints saying the orders were taken care of go in together.
+    state_store.prune_fingerprints(set(registry))
+    state_store.commit()
+    if image_cache is not None:
+        image_cache.save()
+
+
+def order_status(key):
+    """
+    :param key: the order, as it is in the order file
+    :type key: str
+    :return: the EDD and the current state the last time the order was taken care of, None if it never was
+    :rtype: tuple
+    """
+
+    record = state_store.fingerprint(key)
+    if record is None:
+        return None
+    return record['order_info']['order_edd'], record['order_info']['current_state']
+
+
+def run_daemon(args, my_dirname, registry, logger):
+    """
+    Keep running, checking every order when it's due instead of all of them at once.
+    The order file and the google sheet are read again every few minutes.
+
+    :param args: args parsed from argparse
+    :type args: args
+    :param my_dirname: the directory of this file
+    :type my_dirname: str
+    :param registry: the orders in the order file
+    :type registry: OrderRegistry
+    :param logger: the logger
+    :type logger: logging.Logger
+    """
+
+    from google_sheets_api import get_data_from_sheet
+
+    scheduler = Scheduler(state_store)
+    scheduler.sync(registry)
+    reload_at = time.time() + DAEMON_RELOAD
+
+    # Orders looking up the same thing are checked together, so COTUS is only asked once.
+    groups = {}
+    for key in registry:
+        groups.setdefault(lookup_key(key.split(',')), []).append(key)
+
+    try:
+        while True:
+            now = time.time()
+            if now >= reload_at:
+                # The registry is built again from the order file and the sheet, and the
+                # orders that are gone from the file are taken off the schedule.
+                get_orders(registry, get_data_from_sheet(args, my_dirname))
+                scheduler.sync(registry)
+                reload_at = now + DAEMON_RELOAD
+                groups = {}
+                for key in registry:
+                    groups.setdefault(lookup_key(key.split(',')), []).append(key)
+
+            due = scheduler.due(now)
+            if due:
+                # Orders looking up the same thing as a due order are checked with it.
+                keys = dict.fromkeys(lookup_key(k.split(',')) for k in due)
+                due = [k for each in keys for k in groups.get(each, []) if k in registry]
+                before = dict((k, order_status(k)) for k in due)
+
+                orders = [k.split(',') for k in due]
+                remove_list, q_count, err_list = check_batch(args, orders)
+                log_stats(logger, len(orders), q_count)
+
+                # The next check depends on what the order looks like now, and whether it changed.
+                for key, err in zip(due, err_list):
+                    after = order_status(key) if err >= 0 else None
+                    changed = after is not None and after != before[key]
+                    scheduler.reschedule(key, after[1] if after is not None else None, changed)
+                for i in remove_list:
+                    scheduler.remove(due[i])
+                save_batch(registry, orders, remove_list)
+
+                # Orders deleted from the order file by hand since it was read are gone from the registry now.
+                scheduler.sync(registry)
+                metrics.write(args.metrics_dir)
+
+            # Sleep until the next order is due, or it's time to read the order file again.
+            next_time = scheduler.next_time()
+            wake_at = reload_at if next_time is None else min(next_time, reload_at)
+            time.sleep(min(max(wake_at - time.time(), DAEMON_MIN_SLEEP), DAEMON_RELOAD))
+    except KeyboardInterrupt:
+        logger.info('Daemon stopped.')
 
 
 def main():
@@ -802,7 +1686,7 @@ def main():
     :return: error number
     :rtype: int
     """
-    global order_str_list, DIR_INFO, DIR_IMAGE, DIR_WINDOW_STICKER, PRINT_TO_SCREEN
+    global state_store, outbox, cpu_pool, IMAGE_CACHE_SIZE, DIR_INFO, DIR_IMAGE, DIR_WINDOW_STICKER, DIR_CACHE, DIR_OUTBOX, DIR_METRICS, PRINT_TO_SCREEN
 
     # Get the path of the file, extract the directory path from it, and set the work directory to it.
     my_abspath = os.path.abspath(__file__)
@@ -813,6 +1697,9 @@ def main():
     DIR_INFO = os.path.join(my_dirname, DIR_INFO)
     DIR_IMAGE = os.path.join(my_dirname, DIR_IMAGE)
     DIR_WINDOW_STICKER = os.path.join(my_dirname, DIR_WINDOW_STICKER)
+    DIR_CACHE = os.path.join(my_dirname, DIR_CACHE)
+    DIR_OUTBOX = os.path.join(my_dirname, DIR_OUTBOX)
+    DIR_METRICS = os.path.join(my_dirname, DIR_METRICS)
     if not os.path.isdir(DIR_INFO):
         shutil.rmtree(DIR_INFO, ignore_errors=True)
         os.mkdir(DIR_INFO)
@@ -822,9 +1709,12 @@ def main():
     if not os.path.isdir(DIR_WINDOW_STICKER):
         shutil.rmtree(DIR_WINDOW_STICKER, ignore_errors=True)
         os.mkdir(DIR_WINDOW_STICKER)
+    if not os.path.isdir(DIR_CACHE):
+        shutil.rmtree(DIR_CACHE, ignore_errors=True)
+        os.mkdir(DIR_CACHE)
 
     # setup the arguments
-    parser = argparse.ArgumentParser(parents=[tools.argparser])
+    parser = argparse.ArgumentParser(add_help=False)
     parser.add_argument('-o', '--order-number', type=str, help='order number of the car', dest='order_number')
     parser.add_argument('-d', '--dealer-code', type=str, help='dealer code of the order', dest='dealer_code')
     parser.add_argument('-l', '--last-name', type=str, help='customer\'s last name (not used for now)', dest='last_name', default='xxx')
@@ -835,10 +1725,92 @@ def main():
     parser.add_argument('-w', '--window-sticker', help='obtain the window sticker', dest='window_sticker', action='store_true', default=False)
     parser.add_argument('-i', '--generate-image', help='generate an image with the dates and the car on it', dest='generate_image', action='store_true', default=False)
     parser.add_argument('-n', '--no-print', help='print stuff to the screen', dest='no_print', action='store_true', default=False)
-    args = parser.parse_args()
+    parser.add_argument('--daemon', help='keep running and check every order in the order file when it\'s due', dest='daemon', action='store_true', default=False)
+    parser.add_argument('--hedge', help='ask a second mirror if the first one is slower than usual in batch mode', dest='hedge', action='store_true', default=False)
+    parser.add_argument('--hedge-percentile', type=float, help='latency percentile of a mirror that counts as slow', dest='hedge_percentile', default=HEDGE_PERCENTILE)
+    parser.add_argument('--hedge-budget', type=float, help='most extra requests sent by hedging, as a share of all requests', dest='hedge_budget', default=hedge_budget.ratio)
+    parser.add_argument('--stream', help='stop downloading a COTUS page once everything needed seems to be found, faster but may miss values further down the page', dest='stream', action='store_true', default=False)
+    parser.add_argument('-c', '--concurrency', type=int, help='how many orders to check at the same time in batch mode', dest='concurrency', default=CONCURRENCY)
+    parser.add_argument('-t', '--workers', type=int, help='threads for window stickers, images and emails in batch mode', dest='workers', default=WORKERS)
+    parser.add_argument('--render-workers', type=int, help='processes rendering images and parsing PDF files in batch mode, 0 to use the threads', dest='render_workers', default=RENDER_WORKERS)
+    parser.add_argument('--pool-size', type=int, help='pooled connections per host', dest='pool_size', default=http_pool.pool_size)
+    parser.add_argument('--host-pool-size', type=str, help='pooled connections of one host, HOST=SIZE, can be repeated', dest='host_pool_size', action='append', default=[])
+    parser.add_argument('--rate', type=str, help='most requests per second to one host, HOST=RATE, can be repeated', dest='rate', action='append', default=[])
+    parser.add_argument('--max-concurrency', type=int, help='most requests at the same time to one host, the limit adapts below it', dest='max_concurrency', default=rate_limits.max_concurrency)
+    parser.add_argument('--host-max-concurrency', type=str, help='most requests at the same time to one host, HOST=COUNT, can be repeated', dest='host_max_concurrency', action='append', default=[])
+    parser.add_argument('--keep-alive', type=int, help='seconds to keep idle connections, 0 to disable', dest='keep_alive', default=http_pool.keep_alive)
+    parser.add_argument('--trust-env', help='use the proxies from HTTP_PROXY and the like in batch mode too, the other requests always do', dest='trust_env', action='store_true', default=http_pool.trust_env)
+    parser.add_argument('--smtp-host', type=str, help='SMTP server to send emails through', dest='smtp_host', default=smtp_pool.host)
+    parser.add_argument('--smtp-port', type=int, help='port of the SMTP server, 465 is SSL', dest='smtp_port', default=smtp_pool.port)
+    parser.add_argument('--smtp-pool-size', type=int, help='SMTP connections kept open', dest='smtp_pool_size', default=smtp_pool.size)
+    parser.add_argument('--image-cache-size', type=int, help='megabytes of car pictures kept in the cache', dest='image_cache_size', default=IMAGE_CACHE_SIZE)
+    parser.add_argument('--metrics-dir', type=str, help='where the Prometheus textfile and JSON summary of the metrics are written', dest='metrics_dir', default=DIR_METRICS)
+    parser.add_argument('--profile', type=str, help='profile the run and write the results to this directory', dest='profile')
+    parser.add_argument('--profile-interval', type=float, help='seconds between two wall clock samples when profiling', dest='profile_interval', default=PROFILE_INTERVAL)
+    parser.add_argument('--email-workers', type=int, help='emails sent from the outbox at the same time', dest='email_workers', default=EMAIL_WORKERS)
+
+    # The flags of the Google sheet login are only needed with an order file, the
+    # sheet (and the OAuth client) is only loaded then.
+    args = parser.parse_known_args()[0]
+    parents = [parser]
+    if args.file:
+        from oauth2client import tools
+        parents.append(tools.argparser)
+    args = argparse.ArgumentParser(parents=parents).parse_args()
 
     PRINT_TO_SCREEN = not args.no_print
 
+    # The profiler is only imported when it's asked for, so it costs nothing otherwise.
+    profiler = None
+    if args.profile:
+        from profiler import Profiler
+        profiler = Profiler(args.profile, args.profile_interval)
+        profiler.start()
+
+    host_pool_sizes = {}
+    for each in args.host_pool_size:
+        host, _, size = each.partition('=')
+        if not size.isdigit():
+            print_to_screen('Invalid host pool size: {0}'.format(each))
+            exit(1)
+        host_pool_sizes[host.strip()] = int(size)
+    http_pool.configure(args.pool_size, host_pool_sizes, args.keep_alive, args.trust_env)
+
+    # The concurrency of a host adapts to how it's doing, up to its own ceiling.
+    rates = dict(HOST_RATES)
+    for each in args.rate:
+        host, _, rate = each.partition('=')
+        try:
+            rates[host.strip()] = float(rate)
+        except ValueError:
+            print_to_screen('Invalid rate: {0}'.format(each))
+            exit(1)
+    host_max_concurrency = {}
+    for each in args.host_max_concurrency:
+        host, _, count = each.partition('=')
+        if not count.isdigit():
+            print_to_screen('Invalid host max concurrency: {0}'.format(each))
+            exit(1)
+        host_max_concurrency[host.strip()] = int(count)
+    rate_limits.configure(rates, args.max_concurrency, host_max_concurrency)
+    hedge_budget.ratio = args.hedge_budget
+    smtp_pool.configure(args.smtp_host, args.smtp_port, gmail_user, gmail_pswd, args.smtp_pool_size)
+
+    # Pictures of the cars are shared by all the orders with the same configuration,
+    # the cache is only opened when the first one is needed.
+    IMAGE_CACHE_SIZE = args.image_cache_size
+
+    # The state of every order, only opened by the runs that keep states (or a schedule) and
+    # send emails, the JSON files they used to be kept in are imported the first time.
+    if args.file or args.send_email:
+        state_store = StateStore(os.path.join(DIR_INFO, 'states.db'))
+        state_store.migrate(DIR_INFO)
+
+        # Start sending the emails in the outbox, including the ones left from last time.
+        from outbox import Outbox
+        outbox = Outbox(DIR_OUTBOX, smtp_pool, args.email_workers)
+        outbox.start()
+
     if args.file:
         if not os.path.isfile(args.file):
             print_to_screen('Invalid VIN file.')
@@ -856,95 +1828,66 @@ def main():
             log_handler.setFormatter(log_formatter)
             logger.addHandler(log_handler)
 
-            # create queues for passing data between threads
-            q_in = Queue()
-            q_out = Queue()
-            q_count = Queue()
-
-            # Create 10 threads, don't want to stress the server too much, it's not a DDoS.
-            threads = [threading.Thread(target=check_order, args=(q_in, q_out, q_count)) for i in range(10)]
+            # Rendering and PDF parsing go to worker processes.
+            cpu_pool = CpuPool(args.render_workers)
 
             # Fetch new orders from google sheets, and read in from the order file.
-            orders = get_orders(args.file, get_data_from_sheet(args, my_dirname))
+            from google_sheets_api import get_data_from_sheet
+            registry = OrderRegistry(args.file)
+            orders = get_orders(registry, get_data_from_sheet(args, my_dirname))
 
-            # Different order types needs different data.
-            # Just being lazy here, using existing args variable since we don't need the other parts of it.
-            for o in orders:
-                if o[0] == 'vin':
-                    if len(o) == 2:
-                        args.order_number = ''
-                        args.dealer_code = ''
-                        args.vin = o[1]
-                        args.send_email = ''
-                    else:
-                        args.order_number = ''
-                        args.dealer_code = ''
-                        args.vin = o[1]
-                        args.send_email = o[2]
-                else:
-                    if len(o) == 3:
-                        args.order_number = o[1]
-                        args.dealer_code = o[2]
-                        args.vin = ''
-                        args.send_email = ''
-                    else:
-                        args.order_number = o[1]
-                        args.dealer_code = o[2]
-                        args.vin = ''
-                        args.send_email = o[3]
-
-                # Must make copy so we can have put them into different threads without messing up.
-                # The length of the order_str_list will be the index to write to it.
-                q_in.put((copy.deepcopy(args), o, len(order_str_list)))
-                order_str_list.append('')
-
-            # Start all threads and wait for them to finish.
-            for t in threads:
-                t.start()
-            for t in threads:
-                t.join()
-
-            # Print out all the query results.
-            for s in order_str_list:
-                print_to_screen(s)
-
-            # Log what we did just now.
-            logger.info('Total Orders: {0}, Query Success: {1}'.format(len(orders), sum(list(q_count.queue))))
-
-            # Remove orders that are marked "Delivered" from the order file.
-            remove_list = list(q_out.queue)
-            with open(args.file, 'w') as out_file:
-                for i in range(len(orders)):
-                    if i not in remove_list:
-                        out_file.write('{0}\n'.format(','.join(orders[i])))
+            if args.daemon:
+                run_daemon(args, my_dirname, registry, logger)
+            else:
+                # Check all of them, and wait for them to finish.
+                remove_list, q_count, _ = check_batch(args, orders)
+                log_stats(logger, len(orders), q_count)
+                save_batch(registry, orders, remove_list)
+                metrics.write(args.metrics_dir)
 
     else:
 
         # if we're not using a order file
         data = None
         msg = ''
-        stop_flag = False
-        for i in range(len(COTUS_URL)):
-            if stop_flag:
+        tried = []
+        for i in range(len(COTUS_URL) * COTUS_RETRY):
+            url = mirrors.choose(exclude=tried[-1:])
+            tried.append(url)
+            start = time.monotonic()
+            timing = {}
+            if args.vin:
+                data = get_data(args, 'vin', url=url, timing=timing)
+            elif args.order_number and args.dealer_code and args.last_name:
+                data = get_data(args, url=url, timing=timing)
+            else:
+                print_to_screen('Invalid input!')
+                exit(1)
+            latency = timing.get('latency', time.monotonic() - start)
+            page = parse_data(data)
+            kind = classify(data, page)
+            mirrors.record(url, kind not in TRANSIENT, latency)
+            err, msg = format_order_info(page, args, url)
+
+            # An error page won't change by asking again, otherwise wait a bit longer every time.
+            if kind not in TRANSIENT:
                 break
-            url = COTUS_URL[i]
-            for j in range(COTUS_RETRY):
-                if stop_flag:
-                    break
-                if args.vin:
-                    data = get_data(args, 'vin', url=url)
-                elif args.order_number and args.dealer_code and args.last_name:
-                    data = get_data(args, url=url)
-                else:
-                    print_to_screen('Invalid input!')
-                    exit(1)
-                err, msg = format_order_info(data, args, url)
-                if err >= 0:
-                    stop_flag = True
-                else:
-                    time.sleep(COTUS_WAIT)
+            if i < len(COTUS_URL) * COTUS_RETRY - 1:
+                time.sleep(backoff(i))
         print_to_screen(msg)
 
+    cpu_pool.close()
+    if image_cache is not None:
+        image_cache.save()
+    if outbox is not None:
+        outbox.close()
+    smtp_pool.close()
+    if state_store is not None:
+        state_store.close()
+
+    if profiler is not None:
+        profiler.stop()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# name, the text in front of the value, the text right after it, and whether we want
+# the first value or all of them. The value is what re.search() and re.findall() got
+# out of "<before>(.*?)<after>" when the whole page was searched.
+FIELDS = [
+    ('error', 'class="top-level-error enabled">', '</p>', False),
+    ('vehicle_name', 'class="vehicleName">', '</span>', False),
+    ('order_date', 'class="orderDate">', '</span>', False),
+    ('order_num', 'class="orderNumber">', '</span>', False),
+    ('dealer_code', '"dealerInfo": { "dealerCode":', '}', False),
+    ('order_vin', 'class="vin">', '</span>', False),
+    ('order_edd', 'id="hidden-estimated-delivery-date" data-part="', '"', False),
+    ('current_state', '"selectedStepName":', '"surveyOn"', False),
+    ('dealer_name', 'class="dealerName">', '</span>', False),
+    ('state_dates', 'Completed On : </span>', '</span>', True),
+    ('vehicle_summary', 'class="part-detail-description', '</div>', True),
+    ('car_pic_link', 'http://build.ford.com/', '"', False),
+]
+
+# Fields that must be on the page, otherwise COTUS is probably down.
+REQUIRED = ['vehicle_name', 'order_date', 'order_num', 'dealer_code', 'order_vin', 'order_edd', 'current_state',
+            'car_pic_link']
+
+# What the checker keeps track of for every order, not something on the page.
+FLAGS = ['email_sent', 'window_sticker_sent', 'initial_check_sent', 'edd_changed', 'state_changed']
+
+# Fields that can show up many times on the page.
+LISTS = [name for name, before, after, find_all in FIELDS if find_all]
+
+
+def _both(text):
+    """
+    :param text: the text to look for
+    :type text: str
+    :return: {str: the text, bytes: the text encoded}, so the response can be searched without being decoded first
+    :rtype: dict
+    """
+
+    return {str: text, bytes: text.encode()}
+
+
+_BEFORE = {name: _both(before) for name, before, after, find_all in FIELDS}
+_AFTER = {name: _both(after) for name, before, after, find_all in FIELDS}
+_FIND_ALL = {name: find_all for name, before, after, find_all in FIELDS}
+
+# The rest of the tag, the value of the vehicle summary starts after it.
+_SKIP = {'vehicle_summary': _both('>')}
+
+# The link to the car is the whole quoted address, up to the end of the picture's name.
+_LINK = {'car_pic_link': _both('/EXT/4/vehicle.png')}
+
+
+class OrderPageParser(object):
+    """
+    Extract the order information from a COTUS page.
+
+    Every field is found with str.find()/bytes.find() on the text in front of it and
+    the text after it, the page isn't copied or searched with regular expressions.
+    Line breaks are removed from the values, the text around them must be on one line.
+    The page can be fed while it's being downloaded, each field is only looked for
+    again from where it could still be found.
+    """
+
+    def __init__(self, encoding='utf-8', need_summary=True):
+        """
+        :param encoding: encoding of the page if it's fed as bytes
+        :type encoding: str
+        :param need_summary: whether "done" waits for the whole vehicle summary
+        :type need_summary: bool
+        """
+
+        self.encoding = encoding
+        self.need_summary = need_summary
+        self.error_msg = None
+
+        self._data = None
+        self._closed = False
+        self._values = {name: [] for name in _BEFORE}
+        self._ends = {name: [] for name in _BEFORE}
+        self._next_pos = {name: 0 for name in _BEFORE}
+
+    def feed(self, data):
+        """
+        Add the page, or a part of it, to the parser.
+
+        :param data: the page
+        :type data: str or bytes
+        """
+
+        if self._data is None:
+            # Kept as it is, a whole page is never copied.
+            self._data = data
+        elif isinstance(self._data, str):
+            self._data += data
+        else:
+            if not isinstance(self._data, bytearray):
+                self._data = bytearray(self._data)
+            self._data += data
+        self._scan()
+
+    def close(self):
+        """
+        Finish searching the page once everything is fed, or once we stopped feeding it.
+
+        :return: the parser itself
+        :rtype: OrderPageParser
+        """
+
+        self._closed = True
+        return self
+
+    @property
+    def done(self):
+        """
+        Whether everything needed has been found, or the page has an error message.
+
+        This is a guess from how COTUS lays out its pages, the rest of the page is not
+        looked at: the error message comes before the order, and the lists (the dates
+        and the vehicle summary) each sit in one part of the page, so a list is complete
+        once a value of a required field is found after it. On a page laid out some
+        other way, an error message or list values further down are lost, which is why
+        stopping early is left to --stream.
+
+        :return: True if the rest of the page is not needed
+        :rtype: bool
+        """
+
+        if self.error_msg is not None:
+            return True
+        if not self._values['dealer_name']:
+            return False
+        for name in REQUIRED:
+            if not self._values[name]:
+                return False
+        last = max(self._ends[name][0] for name in REQUIRED)
+        for name in LISTS:
+            if name == 'vehicle_summary' and not self.need_summary:
+                continue
+            if not self._ends[name] or self._ends[name][-1] > last or self._next_pos[name] < last:
+                return False
+        return True
+
+    def _decode(self, value):
+        """
+        :param value: a value found on the page
+        :type value: str or bytes
+        :return: the value as str, without line breaks
+        :rtype: str
+        """
+
+        if not isinstance(value, str):
+            value = value.decode(self.encoding, 'replace')
+        return value.replace('\n', '').replace('\r', '')
+
+    def _scan(self):
+        """
+        Look for every field not found yet, and for more values of the lists.
+        """
+
+        data = self._data
+        kind = str if isinstance(data, str) else bytes
+        for name, before in _BEFORE.items():
+            values = self._values[name]
+            if values and not _FIND_ALL[name]:
+                continue
+
+            before = before[kind]
+            after = _AFTER[name][kind]
+            skip = _SKIP[name][kind] if name in _SKIP else None
+            link = _LINK[name][kind] if name in _LINK else None
+            pos = self._next_pos[name]
+            while True:
+                start = data.find(before, pos)
+                if start < 0:
+                    # A marker can still start in the last few characters.
+                    pos = max(pos, len(data) - len(before) + 1)
+                    break
+                value_start = start + len(before)
+                if skip is not None:
+                    value_start = data.find(skip, value_start)
+                    if value_start < 0:
+                        pos = start
+                        break
+                    value_start += len(skip)
+                value_end = data.find(after, value_start)
+                if value_end < 0:
+                    # Not all here yet.
+                    pos = start
+                    break
+                pos = value_end + len(after)
+
+                if link is not None:
+                    # The whole address, only if it's a picture of the car.
+                    value_end = data.find(link, start, value_end)
+                    if value_end < 0:
+                        continue
+                    value_start = start
+                    value_end += len(link)
+
+                values.append(self._decode(data[value_start:value_end]))
+                self._ends[name].append(pos)
+                if name == 'error':
+                    self.error_msg = values[0].strip() + '\n'
+                if not _FIND_ALL[name]:
+                    break
+            self._next_pos[name] = pos
+
+    def order_info(self):
+        """
+        Put the values found into a dictionary, same as what get_order_info() returns.
+
+        :return: order_info or error number
+        :rtype: dict or int
+        """
+
+        values = self._values
+        for name in REQUIRED:
+            if not values[name]:
+                return -1
+
+        order_info = {
+            'vehicle_name': values['vehicle_name'][0].strip(),
+            'order_date': values['order_date'][0].strip(),
+            'order_num': values['order_num'][0].strip(),
+            'dealer_code': values['dealer_code'][0].replace('"', '').strip(),
+            'order_vin': values['order_vin'][0].strip(),
+            'order_edd': values['order_edd'][0].strip(),
+            'current_state': values['current_state'][0].replace(',', '').replace('"', '').strip().title()
+        }
+        order_info.update(dict.fromkeys(FLAGS, False))
+
+        # some times the dealer name might not be available
+        order_info['dealer_name'] = 'N/A'
+        if values['dealer_name']:
+            order_info['dealer_name'] = values['dealer_name'][0].replace(',', '').replace('"', '').strip() or 'N/A'
+
+        # format the dates
+        state_dates = [d.replace('.', '/').strip() for d in values['state_dates']]
+        order_info['state_dates'] = ['{0}20{1}'.format(d[:6], d[6:]) for d in state_dates]
+
+        # get vehicle summary, dict keeps the order and drops the duplicates
+        order_info['vehicle_summary'] = list(dict.fromkeys(each.strip() for each in values['vehicle_summary']))
+
+        # get the link to the rendered image of the car
+        order_info['car_pic_link'] = values['car_pic_link'][0].strip()
+
+        return order_info
+
+
+def parse_order_page(data, encoding='utf-8'):
+    """
+    Parse a whole COTUS page.
+
+    :param data: the page
+    :type data: str or bytes
+    :param encoding: encoding of the page if it's bytes
+    :type encoding: str
+    :return: the parser with everything extracted
+    :rtype: OrderPageParser
+    """
+
+    parser = OrderPageParser(encoding)
+    parser.feed(data)
+    return parser.close()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import threading
+import time
+
+# Same logger as cotus-checker.py.
+logger = logging.getLogger('COTUS Checker')
+
+
+def _timed(func, args):
+    """
+    Run a function in a worker process, and time it.
+
+    :param func: the function, must be defined at the top level of a module
+    :type func: callable
+    :param args: the arguments
+    :type args: tuple
+    :return: what the function returned, seconds it took
+    :rtype: object, float
+    """
+
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class CpuPool(object):
+    """
+    Worker processes for the CPU bound work (rendering images, parsing PDF files),
+    so it doesn't hold the GIL while the threads are waiting on the network.
+
+    The work is grouped into stages, and each stage counts how many jobs are
+    waiting or running right now (its queue depth), the deepest it got, how
+    long the jobs waited for a process and how long they ran.
+
+    A worker killed by the OOM killer or a signal breaks the whole executor, it's
+    replaced by a new one and the job is tried once more, so one crash doesn't fail
+    every job after it. A job that breaks the new executor too is given up on.
+    """
+
+    def __init__(self, workers):
+        """
+        :param workers: number of worker processes, 0 to run everything in the calling thread
+        :type workers: int
+        """
+
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = defaultdict(lambda: {'jobs': 0, 'depth': 0, 'max_depth': 0, 'wait': 0.0, 'run': 0.0,
+                                                  'restarts': 0, 'failed': 0})
+
+    def _get_executor(self):
+        """
+        Start the worker processes on first use. They are started by a fork server (or spawned)
+        instead of forking this process, which has threads running by then.
+
+        :return: the executor
+        :rtype: ProcessPoolExecutor
+        """
+
+        with self._lock:
+            if self._executor is None:
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                else:
+                    context = multiprocessing.get_context('spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def _restart(self, broken):
+        """
+        Drop a broken executor, the next job starts a new one.
+
+        :param broken: the executor a job failed in
+        :type broken: ProcessPoolExecutor
+        :return: True if it was still in use, False if another thread already dropped it
+        :rtype: bool
+        """
+
+        with self._lock:
+            if self._executor is not broken:
+                return False
+            self._executor = None
+        broken.shutdown(wait=False)
+        return True
+
+    def run(self, stage, func, *args):
+        """
+        Run a function in a worker process and wait for it, blocks the calling thread only.
+
+        :param stage: name of the stage, for the stats
+        :type stage: str
+        :param func: the function, must be defined at the top level of a module
+        :type func: callable
+        :return: what the function returned, None if the job killed the worker process twice
+        :rtype: object
+        """
+
+        start = time.perf_counter()
+        with self._lock:
+            stats = self._stats[stage]
+            stats['depth'] += 1
+            stats['max_depth'] = max(stats['max_depth'], stats['depth'])
+
+        run = 0.0
+        try:
+            if not self.workers:
+                result, run = _timed(func, args)
+            else:
+                for i in range(2):
+                    executor = self._get_executor()
+                    try:
+                        result, run = executor.submit(_timed, func, args).result()
+                        break
+                    except BrokenProcessPool:
+                        if self._restart(executor):
+                            with self._lock:
+                                stats['restarts'] += 1
+                else:
+                    # The job broke a new executor too, it would take this process down with it.
+                    logger.error('CPU Stage: {0}: {1} killed the worker process twice, given up'.format(stage, func.__name__))
+                    with self._lock:
+                        stats['failed'] += 1
+                    return None
+            return result
+        finally:
+            with self._lock:
+                stats['depth'] -= 1
+                stats['jobs'] += 1
+                stats['run'] += run
+                stats['wait'] += time.perf_counter() - start - run
+
+    def stats(self):
+        """
+        :return: {stage: {'jobs', 'depth', 'max_depth', 'wait', 'run', 'restarts', 'failed'}}, times are in seconds
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {stage: dict(stats) for stage, stats in sorted(self._stats.items())}
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
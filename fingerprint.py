@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+
+# The fields that decide whether anything needs to be done for an order,
+# the vehicle summary is only printed so it's not part of the fingerprint.
+FINGERPRINT_FIELDS = ['vehicle_name', 'order_date', 'order_num', 'dealer_code', 'order_vin', 'order_edd',
+                      'current_state', 'dealer_name', 'state_dates', 'car_pic_link']
+
+# What's kept of the order so it can be printed (and taken care of) without the page,
+# only what the page says, not what the checker added to it.
+PAGE_FIELDS = FINGERPRINT_FIELDS + ['vehicle_summary']
+
+
+def order_fingerprint(order_info):
+    """
+    A short digest of the order information.
+
+    :param order_info: the data returned from get_order_info()
+    :type order_info: dict
+    :return: the digest
+    :rtype: str
+    """
+
+    fields = [order_info.get(name) for name in FINGERPRINT_FIELDS]
+    return hashlib.sha1(json.dumps(fields).encode()).hexdigest()
+
+
+def page_info(order_info):
+    """
+    :param order_info: the data returned from get_order_info()
+    :type order_info: dict
+    :return: only the fields that came from the page
+    :rtype: dict
+    """
+
+    return dict((name, order_info.get(name)) for name in PAGE_FIELDS)
@@ -24,10 +24,10 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate
 from gmail_secret import gmail_user, gmail_pswd
+from smtp_pool import _smtplib, shared_pool as smtp_pool
 import httplib2
 import os
 import re
-import smtplib
 import oauth2client
 import json
 
@@ -139,12 +139,9 @@ def send_email_invalid_order(info, email_addr):
         email_msg['Date'] = formatdate(localtime=True)
         email_msg.attach(MIMEText(email_body))
 
+        smtplib = _smtplib()
         try:
-            gmail_server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-            gmail_server.ehlo()
-            gmail_server.login(gmail_user, gmail_pswd)
-            gmail_server.sendmail(email_from, email_addr, email_msg.as_string())
-            gmail_server.close()
+            smtp_pool.send(email_from, email_addr, email_msg.as_string())
             return 0, 'SUCCESS'
         except KeyboardInterrupt:
             exit(2)
@@ -174,12 +171,9 @@ def send_email_new_order(info, email_addr):
         email_msg['Date'] = formatdate(localtime=True)
         email_msg.attach(MIMEText(email_body))
 
+        smtplib = _smtplib()
         try:
-            gmail_server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-            gmail_server.ehlo()
-            gmail_server.login(gmail_user, gmail_pswd)
-            gmail_server.sendmail(email_from, email_addr, email_msg.as_string())
-            gmail_server.close()
+            smtp_pool.send(email_from, email_addr, email_msg.as_string())
             return 0, 'SUCCESS'
         except KeyboardInterrupt:
             exit(2)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import Counter
+from requests.adapters import HTTPAdapter
+import requests
+import threading
+
+# Default number of pooled connections per host, and how long (in seconds)
+# an idle connection is kept around, 0 means no keep-alive at all.
+POOL_SIZE = 10
+KEEP_ALIVE = 30
+
+
+class HttpPool(object):
+    """
+    Persistent, keep-alive connection pools shared by every outbound request.
+
+    The blocking fetches (window sticker, car image, single lookups) share one
+    requests.Session, the batch mode uses aiohttp sessions created here, both
+    of them count how many requests reused a pooled connection (hits) and how
+    many had to open a new one (misses).
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, host_pool_sizes=None, keep_alive=KEEP_ALIVE, trust_env=False):
+        """
+        :param pool_size: number of pooled connections per host
+        :type pool_size: int
+        :param host_pool_sizes: pool sizes of specific hosts, overriding pool_size
+        :type host_pool_sizes: dict[str, int]
+        :param keep_alive: seconds to keep an idle connection, 0 to disable keep-alive
+        :type keep_alive: int
+        :param trust_env: whether the aiohttp sessions use the proxies from HTTP_PROXY and the like
+        :type trust_env: bool
+        """
+
+        self.pool_size = pool_size
+        self.host_pool_sizes = dict(host_pool_sizes or {})
+        self.keep_alive = keep_alive
+        self.trust_env = trust_env
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._async_hits = Counter()
+        self._async_misses = Counter()
+
+    def configure(self, pool_size=None, host_pool_sizes=None, keep_alive=None, trust_env=None):
+        """
+        Change the settings, must be done before the first request.
+
+        :param pool_size: number of pooled connections per host
+        :type pool_size: int
+        :param host_pool_sizes: pool sizes of specific hosts, overriding pool_size
+        :type host_pool_sizes: dict[str, int]
+        :param keep_alive: seconds to keep an idle connection, 0 to disable keep-alive
+        :type keep_alive: int
+        :param trust_env: whether the aiohttp sessions use the proxies from HTTP_PROXY and the like
+        :type trust_env: bool
+        """
+
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if host_pool_sizes is not None:
+            self.host_pool_sizes.update(host_pool_sizes)
+        if keep_alive is not None:
+            self.keep_alive = keep_alive
+        if trust_env is not None:
+            self.trust_env = trust_env
+
+    def get_pool_size(self, host):
+        """
+        :param host: the host name
+        :type host: str
+        :return: number of pooled connections for the host
+        :rtype: int
+        """
+
+        return self.host_pool_sizes.get(host, self.pool_size)
+
+    def session(self):
+        """
+        Get the shared requests.Session, create it on first use.
+
+        :return: the session
+        :rtype: requests.Session
+        """
+
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+
+                # requests picks the adapter with the longest matching prefix,
+                # so every host with its own pool size gets its own adapter.
+                for host, size in self.host_pool_sizes.items():
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+                    session.mount('http://{0}'.format(host), adapter)
+                    session.mount('https://{0}'.format(host), adapter)
+
+                if not self.keep_alive:
+                    session.headers['Connection'] = 'close'
+                self._session = session
+            return self._session
+
+    def get(self, url, **kwargs):
+        """
+        A pooled requests.get().
+
+        :param url: the url to send the request to
+        :type url: str
+        :return: the response
+        :rtype: requests.Response
+        """
+
+        return self.session().get(url, **kwargs)
+
+    def async_session(self, limit):
+        """
+        Create an aiohttp session that reports its connection reuse to this pool.
+
+        :param limit: total number of connections the session can open
+        :type limit: int
+        :return: the session, to be used with "async with"
+        :rtype: aiohttp.ClientSession
+        """
+
+        import aiohttp
+
+        async def on_request_start(session, trace_config_ctx, params):
+            trace_config_ctx.host = params.url.host
+
+        async def on_connection_reuseconn(session, trace_config_ctx, params):
+            self._async_hits[trace_config_ctx.host] += 1
+
+        async def on_connection_create_end(session, trace_config_ctx, params):
+            self._async_misses[trace_config_ctx.host] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+
+        if self.keep_alive:
+            connector = aiohttp.TCPConnector(limit=limit, keepalive_timeout=self.keep_alive)
+        else:
+            connector = aiohttp.TCPConnector(limit=limit, force_close=True)
+
+        return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config], trust_env=self.trust_env)
+
+    def stats(self):
+        """
+        Number of requests that reused a pooled connection (hits) and that opened a new one (misses).
+
+        :return: {host: {'hits': int, 'misses': int}}
+        :rtype: dict
+        """
+
+        hits = Counter(self._async_hits)
+        misses = Counter(self._async_misses)
+
+        with self._lock:
+            if self._session is not None:
+                seen = set()
+                for adapter in self._session.adapters.values():
+                    if id(adapter) in seen:
+                        continue
+                    seen.add(id(adapter))
+                    pools = adapter.poolmanager.pools
+                    for key in pools.keys():
+                        pool = pools.get(key)
+                        if pool is None:
+                            continue
+                        hits[pool.host] += max(pool.num_requests - pool.num_connections, 0)
+                        misses[pool.host] += pool.num_connections
+
+        return {host: {'hits': hits[host], 'misses': misses[host]} for host in sorted(set(hits) | set(misses))}
+
+    def close(self):
+        """
+        Close every pooled connection.
+        """
+
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Most bytes kept in the cache, the least recently used pictures are removed first.
+MAX_SIZE = 256 * 1024 * 1024
+
+# A picture is used without asking the server for this many seconds after it was
+# downloaded or revalidated, then the server is asked whether it changed.
+MAX_AGE = 24 * 60 * 60
+
+# The first bytes of the picture formats the server sends (PNG, JPEG, GIF, WebP), anything
+# else that comes with a 200 (an HTML error page, an empty body) isn't cached.
+IMAGE_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a')
+
+
+def is_image(content):
+    """
+    :param content: the body of a response
+    :type content: bytes
+    :return: whether it's a picture
+    :rtype: bool
+    """
+
+    return content.startswith(IMAGE_SIGNATURES) or (content[:4] == b'RIFF' and content[8:12] == b'WEBP')
+
+
+class ImageCache(object):
+    """
+    Pictures of the cars, kept on disk by the hash of their url.
+
+    The same configuration is ordered many times, so many orders share a
+    picture. A cached picture is used as it is until it's MAX_AGE old, then it's
+    revalidated with the ETag or Last-Modified the server sent with it.
+    """
+
+    def __init__(self, dir_name, fetch, max_size=MAX_SIZE, max_age=MAX_AGE):
+        """
+        :param dir_name: the directory of the cache
+        :type dir_name: str
+        :param fetch: called as fetch(url, headers=headers), returns an error number and the response
+        :type fetch: callable
+        :param max_size: most bytes kept in the cache
+        :type max_size: int
+        :param max_age: seconds a picture is used without revalidating it
+        :type max_age: float
+        """
+
+        self.dir_name = dir_name
+        self.fetch = fetch
+        self.max_size = max_size
+        self.max_age = max_age
+
+        self._index_name = os.path.join(dir_name, 'index.json')
+        self._lock = threading.Lock()
+        self._index = {}
+        self._size = 0
+        self._dirty = False
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(dir_name, exist_ok=True)
+        if os.path.isfile(self._index_name):
+            try:
+                self._index = json.load(open(self._index_name, 'r'))
+            except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+                self._index = {}
+
+        # Forget what's not on disk, and remove what's not in the index.
+        files = set(name for name in os.listdir(dir_name) if name.endswith('.png'))
+        for key in [k for k in self._index if '{0}.png'.format(k) not in files]:
+            del self._index[key]
+            self._dirty = True
+        for name in files - set('{0}.png'.format(k) for k in self._index):
+            os.remove(os.path.join(dir_name, name))
+        self._size = sum(entry['size'] for entry in self._index.values())
+
+    def _file_name(self, key):
+        """
+        :param key: the hash of the url
+        :type key: str
+        :return: where the picture is kept
+        :rtype: str
+        """
+
+        return os.path.join(self.dir_name, '{0}.png'.format(key))
+
+    def _read(self, key):
+        """
+        :param key: the hash of the url
+        :type key: str
+        :return: the picture, None if it's gone
+        :rtype: bytes
+        """
+
+        try:
+            return open(self._file_name(key), 'rb').read()
+        except OSError:
+            with self._lock:
+                if self._index.pop(key, None) is not None:
+                    self._dirty = True
+            return None
+
+    def _store(self, key, url, content, headers):
+        """
+        Keep a picture, then remove the least recently used ones until the cache is small enough.
+
+        :param key: the hash of the url
+        :type key: str
+        :param url: the url of the picture
+        :type url: str
+        :param content: the picture
+        :type content: bytes
+        :param headers: the headers of the response
+        :type headers: dict
+        """
+
+        fd, temp_name = tempfile.mkstemp(dir=self.dir_name, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as out_file:
+            out_file.write(content)
+        os.replace(temp_name, self._file_name(key))
+
+        now = time.time()
+        evicted = []
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._size -= old['size']
+            self._index[key] = {
+                'url': url,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'size': len(content),
+                'atime': now,
+                'validated': now
+            }
+            self._size += len(content)
+            self._dirty = True
+
+            if self._size > self.max_size:
+                for k in sorted(self._index, key=lambda k: self._index[k]['atime']):
+                    if self._size <= self.max_size:
+                        break
+                    if k == key:
+                        continue
+                    self._size -= self._index.pop(k)['size']
+                    self.evictions += 1
+                    evicted.append(k)
+
+        for k in evicted:
+            try:
+                os.remove(self._file_name(k))
+            except OSError:
+                pass
+
+    def get(self, url):
+        """
+        Get a picture, from the cache if we have it.
+
+        :param url: the url of the picture
+        :type url: str
+        :return: the picture, None if it can't be downloaded
+        :rtype: bytes
+        """
+
+        key = hashlib.sha1(url.encode()).hexdigest()
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                entry = dict(entry)
+                self._index[key]['atime'] = now
+                self._dirty = True
+
+        headers = {}
+        if entry is not None:
+            if now - entry['validated'] < self.max_age:
+                # Something that isn't a picture, cached before it was checked, is downloaded again.
+                content = self._read(key)
+                if content is not None and is_image(content):
+                    with self._lock:
+                        self.hits += 1
+                    return content
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        err, r = self.fetch(url, headers=headers)
+        if err:
+            # Better an old picture than no picture.
+            return self._read(key) if entry is not None else None
+
+        if r.status_code == 304 and entry is not None:
+            content = self._read(key)
+            if content is not None:
+                with self._lock:
+                    self.revalidated += 1
+                    if key in self._index:
+                        self._index[key]['validated'] = now
+                return content
+            err, r = self.fetch(url, headers={})
+            if err:
+                return None
+
+        if r.status_code != 200:
+            return None
+        if not is_image(r.content):
+            # Better an old picture than no picture here too.
+            return self._read(key) if entry is not None else None
+        with self._lock:
+            self.misses += 1
+        self._store(key, url, r.content, r.headers)
+        return r.content
+
+    def stats(self):
+        """
+        :return: pictures found fresh, found after asking the server, and downloaded, the hit ratio,
+                 pictures evicted, and bytes in the cache
+        :rtype: dict
+        """
+
+        with self._lock:
+            total = self.hits + self.revalidated + self.misses
+            return {
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.revalidated) / total if total else 0.0,
+                'evictions': self.evictions,
+                'size': self._size
+            }
+
+    def save(self):
+        """
+        Write the index if anything changed, replacing the old one in one step.
+        """
+
+        with self._lock:
+            if not self._dirty:
+                return
+            fd, temp_name = tempfile.mkstemp(dir=self.dir_name, suffix='.tmp')
+            with os.fdopen(fd, 'w') as out_file:
+                json.dump(self._index, out_file)
+            os.replace(temp_name, self._index_name)
+            self._dirty = False
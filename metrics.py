@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from bisect import bisect_left
+import contextlib
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Every metric name gets this in front of it in the Prometheus textfile.
+PREFIX = 'cotus_'
+
+# Upper bounds (in seconds) of the histogram buckets, anything slower goes into +Inf.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# How long each stage of a check took, the stage is a label.
+STAGE_SECONDS = 'stage_seconds'
+
+# Names of the files written by Metrics.write().
+TEXTFILE = 'cotus_checker.prom'
+SUMMARY_FILE = 'metrics.json'
+
+
+def _label_str(labels):
+    """
+    :param labels: sorted (name, value) pairs
+    :type labels: tuple
+    :return: the labels the way Prometheus writes them, '' if there are none
+    :rtype: str
+    """
+
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for k, v in labels) + '}'
+
+
+class Metrics(object):
+    """
+    Counters, gauges and latency histograms of everything a check does, shared by all the threads.
+
+    Recording a value only takes the lock for a dict lookup and an addition, so it
+    can be done on every request. The metrics add up for as long as the process runs,
+    the way Prometheus expects counters to.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: upper bounds of the histogram buckets, in seconds
+        :type buckets: tuple[float]
+        """
+
+        self.buckets = tuple(buckets)
+
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def count(self, name, value=1, **labels):
+        """
+        :param name: name of the counter
+        :type name: str
+        :param value: how much to add
+        :type value: float
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def value(self, name, **labels):
+        """
+        :param name: name of the counter
+        :type name: str
+        :return: the counter now, 0 if nothing was counted yet
+        :rtype: float
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def set(self, name, value, **labels):
+        """
+        :param name: name of the gauge
+        :type name: str
+        :param value: the value now
+        :type value: float
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """
+        :param name: name of the histogram
+        :type name: str
+        :param value: the value, usually seconds something took
+        :type value: float
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0, 'max': 0.0}
+            histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+            histogram['max'] = max(histogram['max'], value)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """
+        Time a stage of a check, it's recorded even if the stage raised.
+
+        :param stage: the stage
+        :type stage: str
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(STAGE_SECONDS, time.perf_counter() - start, stage=stage)
+
+    def timed(self, stage):
+        """
+        Decorator version of timer().
+
+        :param stage: the stage
+        :type stage: str
+        :return: the decorator
+        :rtype: callable
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    def _percentile(self, histogram, p):
+        """
+        :param histogram: a histogram
+        :type histogram: dict
+        :param p: the percentile, 0 to 100
+        :type p: float
+        :return: upper bound of the bucket the percentile falls in, never more than the slowest value
+        :rtype: float
+        """
+
+        rank = histogram['count'] * p / 100
+        seen = 0
+        for bound, n in zip(self.buckets, histogram['buckets']):
+            seen += n
+            if seen >= rank:
+                return min(bound, histogram['max'])
+        return histogram['max']
+
+    def summary(self):
+        """
+        :return: every counter and gauge, and count, sum, mean, p50, p95, p99 and max of every histogram
+        :rtype: dict
+        """
+
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = dict((key, dict(h, buckets=list(h['buckets']))) for key, h in self._histograms.items())
+
+        out = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        for (name, labels), value in sorted(counters.items()):
+            out['counters'].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for (name, labels), value in sorted(gauges.items()):
+            out['gauges'].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for (name, labels), h in sorted(histograms.items()):
+            out['histograms'].setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': h['count'],
+                'sum': h['sum'],
+                'mean': h['sum'] / h['count'] if h['count'] else 0.0,
+                'p50': self._percentile(h, 50),
+                'p95': self._percentile(h, 95),
+                'p99': self._percentile(h, 99),
+                'max': h['max']
+            })
+        return out
+
+    def textfile(self):
+        """
+        :return: the metrics in the Prometheus text format
+        :rtype: str
+        """
+
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = dict((key, dict(h, buckets=list(h['buckets']))) for key, h in self._histograms.items())
+
+        lines = []
+        for kind, values in (('counter', counters), ('gauge', gauges)):
+            last_name = None
+            for (name, labels), value in sorted(values.items()):
+                if name != last_name:
+                    lines.append('# TYPE {0}{1} {2}'.format(PREFIX, name, kind))
+                    last_name = name
+                lines.append('{0}{1}{2} {3}'.format(PREFIX, name, _label_str(labels), value))
+
+        last_name = None
+        for (name, labels), h in sorted(histograms.items()):
+            if name != last_name:
+                lines.append('# TYPE {0}{1} histogram'.format(PREFIX, name))
+                last_name = name
+            seen = 0
+            for bound, n in zip(self.buckets + ('+Inf',), h['buckets']):
+                seen += n
+                lines.append('{0}{1}_bucket{2} {3}'.format(PREFIX, name, _label_str(labels + (('le', bound),)), seen))
+            lines.append('{0}{1}_sum{2} {3}'.format(PREFIX, name, _label_str(labels), h['sum']))
+            lines.append('{0}{1}_count{2} {3}'.format(PREFIX, name, _label_str(labels), h['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, dir_name):
+        """
+        Write the Prometheus textfile and the JSON summary, each file is replaced in one
+        step so the node exporter (or anyone else) never reads a half written one.
+
+        :param dir_name: where to write the files
+        :type dir_name: str
+        """
+
+        self.set('last_write_timestamp_seconds', time.time())
+        os.makedirs(dir_name, exist_ok=True)
+        for file_name, content in ((TEXTFILE, self.textfile()), (SUMMARY_FILE, json.dumps(self.summary(), indent=2))):
+            fd, temp_name = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
+            with os.fdopen(fd, 'w') as out_file:
+                out_file.write(content)
+            os.chmod(temp_name, 0o644)
+            os.replace(temp_name, os.path.join(dir_name, file_name))
+
+
+# Shared by cotus-checker.py and smtp_pool.py.
+shared_metrics = Metrics()
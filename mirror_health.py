@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+import threading
+import time
+
+# How much the newest request counts in the rolling latency and error rate.
+ALPHA = 0.2
+
+# The circuit breaker of a mirror opens after this many failures in a row, no request
+# goes there until it has been open for OPEN_SECONDS (doubled every time a probe
+# fails, up to MAX_OPEN_SECONDS), then one probe request is let through (half open).
+FAILURE_THRESHOLD = 5
+OPEN_SECONDS = 30
+MAX_OPEN_SECONDS = 300
+
+# A probe that didn't report back in this many seconds doesn't block the next one.
+PROBE_TIMEOUT = 60
+
+# How much a failing mirror is penalized when picking the fastest one.
+ERROR_PENALTY = 4
+
+# Latency percentiles come from the last WINDOW successful requests of a mirror,
+# and aren't trusted until there are MIN_SAMPLES of them.
+WINDOW = 200
+MIN_SAMPLES = 20
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class MirrorHealth(object):
+    """
+    How well each COTUS mirror is doing, shared by all the workers.
+
+    Every request reports its latency and whether it worked, they are kept as
+    rolling averages. Requests go to the mirror with the best mix of latency
+    and error rate, mirrors that keep failing are skipped by their circuit breaker.
+    """
+
+    def __init__(self, urls):
+        """
+        :param urls: the mirrors, in the order they are preferred when nothing is known about them
+        :type urls: list[str]
+        """
+
+        self.urls = list(urls)
+
+        self._lock = threading.Lock()
+        self._mirrors = dict((url, {
+            'state': CLOSED,
+            'latency': None,
+            'error_rate': 0.0,
+            'failures_in_row': 0,
+            'open_seconds': OPEN_SECONDS,
+            'opened_at': 0.0,
+            'probe_at': None,
+            'requests': 0,
+            'failures': 0,
+            'opened': 0,
+            'samples': deque(maxlen=WINDOW)
+        }) for url in self.urls)
+
+    def _score(self, mirror):
+        """
+        :param mirror: the health of a mirror
+        :type mirror: dict
+        :return: lower is better, mirrors never used score 0 so each gets a try
+        :rtype: float
+        """
+
+        return (mirror['latency'] or 0.0) * (1 + ERROR_PENALTY * mirror['error_rate'])
+
+    def choose(self, exclude=()):
+        """
+        Pick the mirror for the next request.
+
+        :param exclude: mirrors not to pick unless there's nothing else
+        :type exclude: collection[str]
+        :return: the url of the mirror
+        :rtype: str
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for i, url in enumerate(self.urls):
+                mirror = self._mirrors[url]
+                if mirror['state'] == OPEN and now - mirror['opened_at'] >= mirror['open_seconds']:
+                    mirror['state'] = HALF_OPEN
+                if mirror['state'] == OPEN:
+                    continue
+                if mirror['state'] == HALF_OPEN and mirror['probe_at'] is not None and now - mirror['probe_at'] < PROBE_TIMEOUT:
+                    continue
+                candidates.append((url in exclude, self._score(mirror), i, url))
+
+            if not candidates:
+                # Everything is open, try the one that has been open the longest.
+                url = min(self.urls, key=lambda u: self._mirrors[u]['opened_at'])
+            else:
+                url = min(candidates)[3]
+
+            mirror = self._mirrors[url]
+            if mirror['state'] != CLOSED:
+                mirror['state'] = HALF_OPEN
+                mirror['probe_at'] = now
+            return url
+
+    def record(self, url, ok, latency):
+        """
+        Report how a request went.
+
+        :param url: the url of the mirror
+        :type url: str
+        :param ok: whether the mirror sent a usable page
+        :type ok: bool
+        :param latency: seconds the request took
+        :type latency: float
+        """
+
+        with self._lock:
+            mirror = self._mirrors[url]
+            mirror['requests'] += 1
+            mirror['latency'] = latency if mirror['latency'] is None else ALPHA * latency + (1 - ALPHA) * mirror['latency']
+            mirror['error_rate'] = ALPHA * (0.0 if ok else 1.0) + (1 - ALPHA) * mirror['error_rate']
+
+            if ok:
+                mirror['samples'].append(latency)
+                mirror['failures_in_row'] = 0
+                if mirror['state'] != CLOSED:
+                    mirror['state'] = CLOSED
+                    mirror['open_seconds'] = OPEN_SECONDS
+                    mirror['probe_at'] = None
+                return
+
+            mirror['failures'] += 1
+            mirror['failures_in_row'] += 1
+            if mirror['state'] == HALF_OPEN:
+                # The probe failed, stay away for longer this time.
+                mirror['open_seconds'] = min(mirror['open_seconds'] * 2, MAX_OPEN_SECONDS)
+                self._open(mirror)
+            elif mirror['state'] == CLOSED and mirror['failures_in_row'] >= FAILURE_THRESHOLD:
+                self._open(mirror)
+
+    def percentile(self, url, p):
+        """
+        :param url: the url of the mirror
+        :type url: str
+        :param p: the percentile, 0 to 100
+        :type p: float
+        :return: seconds the p-th percentile of the recent successful requests took, None if there aren't enough
+        :rtype: float
+        """
+
+        with self._lock:
+            samples = sorted(self._mirrors[url]['samples'])
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
+
+    @staticmethod
+    def _open(mirror):
+        """
+        Open the circuit breaker of a mirror, the lock must be held.
+
+        :param mirror: the health of a mirror
+        :type mirror: dict
+        """
+
+        mirror['state'] = OPEN
+        mirror['opened_at'] = time.monotonic()
+        mirror['probe_at'] = None
+        mirror['opened'] += 1
+
+    def stats(self):
+        """
+        :return: {url: {'state', 'latency', 'error_rate', 'requests', 'failures', 'opened'}}
+        :rtype: dict
+        """
+
+        with self._lock:
+            return dict((url, {
+                'state': mirror['state'],
+                'latency': mirror['latency'] or 0.0,
+                'error_rate': mirror['error_rate'],
+                'requests': mirror['requests'],
+                'failures': mirror['failures'],
+                'opened': mirror['opened']
+            }) for url, mirror in self._mirrors.items())
+
+
+class HedgeBudget(object):
+    """
+    Keeps the hedged requests (the same lookup sent to a second mirror because
+    the first one is slow) under a share of all the requests.
+    """
+
+    def __init__(self, ratio):
+        """
+        :param ratio: most hedged requests per request, e.g. 0.05 for 5% extra requests
+        :type ratio: float
+        """
+
+        self.ratio = ratio
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+
+    def count_request(self):
+        """
+        Count a request that could be hedged.
+        """
+
+        with self._lock:
+            self.requests += 1
+
+    def take(self):
+        """
+        :return: whether there's budget left for one more hedged request, it's used if there is
+        :rtype: bool
+        """
+
+        with self._lock:
+            if self.hedges + 1 > self.ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def count_win(self):
+        """
+        Count a hedged request that answered first.
+        """
+
+        with self._lock:
+            self.wins += 1
+
+    def stats(self):
+        """
+        :return: requests, hedged requests, and hedged requests that answered first
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {'requests': self.requests, 'hedges': self.hedges, 'wins': self.wins}
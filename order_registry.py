@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+
+def normalize(line):
+    """
+    :param line: a line of the order file
+    :type line: str
+    :return: the order the way it's kept in the registry, no spaces, the fields in
+             upper case and the email address in lower case
+    :rtype: str
+    """
+
+    o = [f.strip() for f in line.replace(' ', '').split(',')]
+    for i in range(1, len(o) - 1):
+        o[i] = o[i].upper()
+    o[-1] = o[-1].lower()
+    return ','.join(o)
+
+
+class OrderRegistry(object):
+    """
+    The orders in the order file, one order per line.
+
+    The orders are kept in a dict, so finding, adding and removing an order doesn't
+    depend on how many there are, and they stay in the same order as in the file.
+    """
+
+    def __init__(self, file_name):
+        """
+        :param file_name: the order file
+        :type file_name: str
+        """
+
+        self.file_name = file_name
+        self._orders = {}
+        self._lines = []
+
+    def _read_lines(self):
+        """
+        :return: the lines of the order file, empty if there's no file
+        :rtype: list[str]
+        """
+
+        if not os.path.isfile(self.file_name):
+            return []
+        with open(self.file_name, 'r') as in_file:
+            return [l.rstrip('\r\n') for l in in_file]
+
+    def read(self):
+        """
+        Read the order file and start over, the lines are not added until they are checked,
+        so orders that are gone from the file are gone from the registry too.
+
+        :return: the lines of the file
+        :rtype: list[str]
+        """
+
+        self._lines = self._read_lines()
+        self._orders = {}
+        return self._lines
+
+    def add(self, order):
+        """
+        Add an order to the end, unless it's already here.
+
+        :param order: the order, fields separated by commas
+        :type order: str
+        :return: True if it's a new order
+        :rtype: bool
+        """
+
+        if order in self._orders:
+            return False
+        self._orders[order] = None
+        return True
+
+    def remove(self, order):
+        """
+        :param order: the order, fields separated by commas
+        :type order: str
+        """
+
+        self._orders.pop(order, None)
+
+    def __contains__(self, order):
+        return order in self._orders
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __iter__(self):
+        return iter(self._orders)
+
+    def orders(self):
+        """
+        :return: a list of list of strings of the order information
+        :rtype: list[list[str]]
+        """
+
+        return [o.split(',') for o in self._orders]
+
+    def save(self):
+        """
+        Write the orders back to the order file if anything changed. The orders are written
+        to a temporary file first then renamed, so the order file is never half written.
+
+        The file may have been edited since it was last read: orders deleted from it are
+        removed here too, and lines added to it are kept as they are for the next read().
+
+        :return: True if the file was written
+        :rtype: bool
+        """
+
+        # The orders are kept normalized, the lines are compared the same way.
+        current = self._read_lines()
+        on_file = set(normalize(l) for l in current)
+        known = set(normalize(l) for l in self._lines)
+        for order in known - on_file:
+            self._orders.pop(order, None)
+        lines = list(self._orders) + [l for l in current if normalize(l) not in known and normalize(l) not in self._orders]
+        if lines == current:
+            self._lines = current
+            return False
+
+        dir_name = os.path.dirname(os.path.abspath(self.file_name))
+        fd, temp_name = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as out_file:
+                for each in lines:
+                    out_file.write('{0}\n'.format(each))
+            if os.path.isfile(self.file_name):
+                os.chmod(temp_name, os.stat(self.file_name).st_mode & 0o7777)
+            os.replace(temp_name, self.file_name)
+        except OSError:
+            if os.path.isfile(temp_name):
+                os.remove(temp_name)
+            raise
+
+        self._lines = lines
+        return True
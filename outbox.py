@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from smtp_pool import _smtplib
+import heapq
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+# How many emails are sent at the same time.
+CONCURRENCY = 4
+
+# Failed sends are retried after BASE_DELAY, 2 * BASE_DELAY, 4 * BASE_DELAY ... seconds,
+# at most MAX_DELAY apart, and given up after MAX_ATTEMPTS tries.
+BASE_DELAY = 5
+MAX_DELAY = 600
+MAX_ATTEMPTS = 12
+
+# The server said no to these, trying again won't help. They're named here, smtplib is
+# only loaded when the first email is sent.
+PERMANENT_ERRORS = ('SMTPRecipientsRefused', 'SMTPSenderRefused', 'SMTPAuthenticationError', 'SMTPNotSupportedError')
+
+# Emails given up on are tried again by the next run, unless the server won't take them at all.
+REFUSED_ERRORS = ('SMTPRecipientsRefused', 'SMTPSenderRefused')
+
+# Same logger as cotus-checker.py.
+logger = logging.getLogger('COTUS Checker')
+
+
+def _is_error(e, names):
+    """
+    :param e: what sending an email raised
+    :type e: smtplib.SMTPException
+    :param names: names of smtplib exceptions
+    :type names: tuple[str]
+    :return: whether it's one of them
+    :rtype: bool
+    """
+
+    return isinstance(e, tuple(getattr(_smtplib(), name) for name in names))
+
+
+class Outbox(object):
+    """
+    Emails waiting to be sent, one JSON file per email, sent by background threads.
+
+    An email is written to "new" when it's put in the outbox, a sender moves it to
+    "cur" while sending it (so two senders never send the same email). Once the
+    server took it a marker is written to "sent" before the email is removed, an
+    email with a marker is never sent again, even if removing it failed or the run
+    stopped before it could. A failed email goes back to "new" to be tried again
+    later, or to "failed" when there's no point trying again in this run, the next
+    run tries it again unless the server refused it. Emails left in "cur" without
+    a marker by a run that didn't finish are sent again with the same Message-ID,
+    so an email is never lost, and the mail server or client can tell it's a
+    duplicate in the rare case the last run stopped between the server taking it
+    and the marker being written.
+    """
+
+    def __init__(self, dir_name, pool, concurrency=CONCURRENCY, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 max_attempts=MAX_ATTEMPTS):
+        """
+        :param dir_name: the directory of the outbox
+        :type dir_name: str
+        :param pool: the SMTP connections used to send the emails
+        :type pool: smtp_pool.SmtpPool
+        :param concurrency: how many emails are sent at the same time
+        :type concurrency: int
+        :param base_delay: seconds to wait before the first retry
+        :type base_delay: float
+        :param max_delay: most seconds to wait between retries
+        :type max_delay: float
+        :param max_attempts: give up after this many tries
+        :type max_attempts: int
+        """
+
+        self.dir_name = dir_name
+        self.pool = pool
+        self.concurrency = concurrency
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+        self._dir_tmp = os.path.join(dir_name, 'tmp')
+        self._dir_new = os.path.join(dir_name, 'new')
+        self._dir_cur = os.path.join(dir_name, 'cur')
+        self._dir_failed = os.path.join(dir_name, 'failed')
+        self._dir_sent = os.path.join(dir_name, 'sent')
+        for each in (self._dir_tmp, self._dir_new, self._dir_cur, self._dir_failed, self._dir_sent):
+            os.makedirs(each, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._busy = 0
+        self._stopping = False
+        self._threads = []
+
+        self.queued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.errors = 0
+        self.duplicates = 0
+
+        # Whatever was being sent when the last run stopped goes back in line, unless the
+        # server already took it, and so does what the last run gave up on, then everything
+        # waiting is picked up.
+        for name in os.listdir(self._dir_cur):
+            if os.path.isfile(os.path.join(self._dir_sent, name)):
+                os.remove(os.path.join(self._dir_cur, name))
+                self.duplicates += 1
+            else:
+                os.replace(os.path.join(self._dir_cur, name), os.path.join(self._dir_new, name))
+        for name in os.listdir(self._dir_failed):
+            entry = self._read(os.path.join(self._dir_failed, name))
+            if entry is None or entry.get('refused'):
+                continue
+            entry['attempts'] = 0
+            entry['next_try'] = time.time()
+            self._write(entry, self._dir_failed, name)
+            os.replace(os.path.join(self._dir_failed, name), os.path.join(self._dir_new, name))
+        for name in sorted(os.listdir(self._dir_new)):
+            entry = self._read(os.path.join(self._dir_new, name))
+            if entry is not None:
+                heapq.heappush(self._heap, (entry['next_try'], name))
+
+        # A marker is only needed while its email is still around.
+        waiting = set(name for next_try, name in self._heap)
+        for name in os.listdir(self._dir_sent):
+            if name not in waiting:
+                os.remove(os.path.join(self._dir_sent, name))
+
+    @staticmethod
+    def _read(file_name):
+        """
+        :param file_name: the file of an email
+        :type file_name: str
+        :return: the email, None if the file is broken
+        :rtype: dict
+        """
+
+        try:
+            return json.load(open(file_name, 'r'))
+        except (json.decoder.JSONDecodeError, UnicodeDecodeError, OSError):
+            return None
+
+    def _write(self, entry, dir_name, name):
+        """
+        Write the file of an email, it shows up in the directory in one step.
+
+        :param entry: the email
+        :type entry: dict
+        :param dir_name: where it goes
+        :type dir_name: str
+        :param name: the file name
+        :type name: str
+        """
+
+        fd, temp_name = tempfile.mkstemp(dir=self._dir_tmp, suffix='.json')
+        with os.fdopen(fd, 'w') as out_file:
+            json.dump(entry, out_file)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+        os.replace(temp_name, os.path.join(dir_name, name))
+
+    def put(self, message_id, email_from, email_to, message):
+        """
+        Put an email in the outbox, it's on disk when this returns.
+
+        :param message_id: the Message-ID header of the email, also used to name its file
+        :type message_id: str
+        :param email_from: the sender
+        :type email_from: str
+        :param email_to: the recipient
+        :type email_to: str
+        :param message: the whole message
+        :type message: str
+        """
+
+        now = time.time()
+        name = '{0:.6f}_{1}.json'.format(now, ''.join(c if c.isalnum() else '_' for c in message_id))
+        entry = {
+            'message_id': message_id,
+            'from': email_from,
+            'to': email_to,
+            'message': message,
+            'attempts': 0,
+            'next_try': now,
+            'error': ''
+        }
+        self._write(entry, self._dir_new, name)
+        with self._cond:
+            self.queued += 1
+            heapq.heappush(self._heap, (now, name))
+            self._cond.notify()
+
+    def _next(self):
+        """
+        Wait for an email that's due.
+
+        :return: the file name, None when it's time to stop
+        :rtype: str
+        """
+
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    self._busy += 1
+                    return heapq.heappop(self._heap)[1]
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _send(self, name):
+        """
+        Send one email, or put it back to be tried later.
+
+        :param name: the file name
+        :type name: str
+        """
+
+        # Claim the email, if it's gone another sender already took it.
+        file_name = os.path.join(self._dir_cur, name)
+        try:
+            os.replace(os.path.join(self._dir_new, name), file_name)
+        except FileNotFoundError:
+            return
+
+        # The server took it already, only removing it went wrong.
+        sent_name = os.path.join(self._dir_sent, name)
+        if os.path.isfile(sent_name):
+            os.remove(file_name)
+            os.remove(sent_name)
+            with self._cond:
+                self.duplicates += 1
+            return
+
+        entry = self._read(file_name)
+        if entry is None:
+            os.replace(file_name, os.path.join(self._dir_failed, name))
+            return
+
+        try:
+            self.pool.send(entry['from'], entry['to'], entry['message'])
+        except _smtplib().SMTPException as e:
+            entry['attempts'] += 1
+            entry['error'] = '{0}: {1}'.format(type(e).__name__, e)
+            if _is_error(e, PERMANENT_ERRORS) or entry['attempts'] >= self.max_attempts:
+                entry['refused'] = _is_error(e, REFUSED_ERRORS)
+                self._write(entry, self._dir_failed, name)
+                os.remove(file_name)
+                with self._cond:
+                    self.failed += 1
+                return
+
+            # Wait longer after every failure, with some jitter so the
+            # emails that failed together don't all retry together.
+            delay = min(self.base_delay * 2 ** (entry['attempts'] - 1), self.max_delay)
+            entry['next_try'] = time.time() + delay * random.uniform(0.5, 1.0)
+            self._write(entry, self._dir_new, name)
+            os.remove(file_name)
+            with self._cond:
+                self.retried += 1
+                heapq.heappush(self._heap, (entry['next_try'], name))
+            return
+
+        # Record the send before anything else can go wrong.
+        self._write({'message_id': entry['message_id'], 'sent': time.time()}, self._dir_sent, name)
+        with self._cond:
+            self.sent += 1
+        os.remove(file_name)
+        os.remove(sent_name)
+
+    def _requeue(self, name):
+        """
+        Put an email back in line after something went wrong with its file.
+
+        :param name: the file name
+        :type name: str
+        """
+
+        try:
+            os.replace(os.path.join(self._dir_cur, name), os.path.join(self._dir_new, name))
+        except OSError:
+            # Still in "new", or the next run moves it back from "cur".
+            pass
+        with self._cond:
+            self.errors += 1
+            heapq.heappush(self._heap, (time.time() + self.base_delay, name))
+
+    def _run(self):
+        """
+        A sender thread.
+        """
+
+        while True:
+            name = self._next()
+            if name is None:
+                return
+            try:
+                self._send(name)
+            except OSError as e:
+                # The outbox couldn't be written (disk full, permissions), the sender keeps
+                # going and the email is tried again later.
+                logger.error('Outbox: {0}: {1}'.format(name, e))
+                self._requeue(name)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self._cond.notify_all()
+
+    def start(self):
+        """
+        Start the sender threads.
+        """
+
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name='outbox-{0}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every email that's due has been tried, the ones waiting
+        to be retried later stay in the outbox for the next run.
+
+        :param timeout: most seconds to wait, None to wait as long as it takes
+        :type timeout: float
+        :return: True if nothing due is left
+        :rtype: bool
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._busy or (self._heap and self._heap[0][0] <= time.time()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """
+        Send what's due then stop the sender threads.
+
+        :param timeout: most seconds to wait for the emails that are due
+        :type timeout: float
+        """
+
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def stats(self):
+        """
+        :return: emails queued, sent, retried and given up on in this run, errors writing the outbox,
+                 emails found already sent and not sent again, and how many are still waiting
+        :rtype: dict
+        """
+
+        with self._cond:
+            return {
+                'queued': self.queued,
+                'sent': self.sent,
+                'retried': self.retried,
+                'failed': self.failed,
+                'errors': self.errors,
+                'duplicates': self.duplicates,
+                'pending': len(self._heap) + self._busy
+            }
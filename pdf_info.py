@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import re
+import zlib
+
+# How far from the end of the file "startxref" is looked for.
+TAIL_SIZE = 2048
+
+# How many older cross-reference sections (/Prev) are followed at most.
+MAX_PREV = 32
+
+_STARTXREF = re.compile(rb'startxref\s+(\d+)')
+_XREF = re.compile(rb'xref\s*')
+_SUBSECTION = re.compile(rb'(\d+)\s+(\d+)[ \t]*(?:\r\n|\r|\n)')
+_ENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+_TRAILER = re.compile(rb'trailer\s*<<')
+_OBJ = re.compile(rb'(\d+)\s+(\d+)\s+obj\s*')
+_INFO = re.compile(rb'/Info\s+(\d+)\s+(\d+)\s+R')
+_PREV = re.compile(rb'/Prev\s+(\d+)')
+_TITLE = re.compile(rb'/Title\s*')
+_REF = re.compile(rb'(\d+)\s+(\d+)\s+R')
+_INT = re.compile(rb'(/(?:W|Index|Size|Length|Columns|Predictor))\s*(\[[^\]]*\]|\d+)')
+
+# Which of the values above are arrays, the others are numbers.
+_ARRAYS = (b'/W', b'/Index')
+_STREAM = re.compile(rb'stream(?:\r\n|\n)')
+
+_ESCAPES = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f',
+            ord('('): b'(', ord(')'): b')', ord('\\'): b'\\'}
+
+
+def _numbers(value):
+    """
+    :param value: a number or an array of numbers in a PDF dictionary
+    :type value: bytes
+    :return: the numbers
+    :rtype: list[int]
+    """
+
+    return [int(each) for each in re.findall(rb'\d+', value)]
+
+
+def _unpredict(data, columns):
+    """
+    Undo the PNG predictor of a cross-reference stream, only None, Sub and Up are used there.
+
+    :param data: the decompressed stream
+    :type data: bytes
+    :param columns: bytes per row
+    :type columns: int
+    :return: the rows, None if a predictor we don't handle is used
+    :rtype: bytes
+    """
+
+    out = bytearray()
+    prev = bytearray(columns)
+    for i in range(0, len(data) - columns, columns + 1):
+        kind = data[i]
+        row = bytearray(data[i + 1:i + 1 + columns])
+        if kind == 1:
+            for j in range(1, columns):
+                row[j] = (row[j] + row[j - 1]) & 0xff
+        elif kind == 2:
+            for j in range(columns):
+                row[j] = (row[j] + prev[j]) & 0xff
+        elif kind != 0:
+            return None
+        out += row
+        prev = row
+    return bytes(out)
+
+
+def _xref_table(data, pos, num):
+    """
+    Read a cross-reference table and its trailer.
+
+    :param data: the PDF file
+    :type data: bytes
+    :param pos: where the table starts
+    :type pos: int
+    :param num: the object we are looking for
+    :type num: int
+    :return: offset of the object (None if it's not in this table), and the trailer
+    :rtype: int, bytes
+    """
+
+    m = _XREF.match(data, pos)
+    pos = m.end()
+    offset = None
+    while True:
+        m = _SUBSECTION.match(data, pos)
+        if m is None:
+            break
+        start, count = int(m.group(1)), int(m.group(2))
+        pos = m.end()
+
+        # Every entry is exactly 20 bytes, so we can jump straight to the one we want.
+        if num is not None and start <= num < start + count:
+            entry = _ENTRY.match(data, pos + (num - start) * 20)
+            if entry is not None and entry.group(3) == b'n':
+                offset = int(entry.group(1))
+        pos += count * 20
+
+    m = _TRAILER.match(data, pos)
+    if m is None:
+        m = _TRAILER.search(data, pos)
+    if m is None:
+        return offset, None
+    end = data.find(b'startxref', m.end())
+    return offset, data[m.start():end if end >= 0 else len(data)]
+
+
+def _xref_stream(data, pos, num):
+    """
+    Read a cross-reference stream, the dictionary of the stream is its trailer.
+
+    :param data: the PDF file
+    :type data: bytes
+    :param pos: where the stream object starts
+    :type pos: int
+    :param num: the object we are looking for
+    :type num: int
+    :return: offset of the object (None if it's not there, -1 if it's in an object stream), and the trailer
+    :rtype: int, bytes
+    """
+
+    m = _STREAM.search(data, pos)
+    if m is None:
+        return None, None
+    trailer = data[pos:m.start()]
+    values = dict((k, v) for k, v in _INT.findall(trailer))
+    if num is None:
+        return None, trailer
+
+    if b'/Length' not in values or _REF.search(trailer[trailer.find(b'/Length'):][:32]):
+        # The length of the stream is somewhere else.
+        return -1, trailer
+    if b'/W' not in values or (b'/Filter' in trailer and b'/FlateDecode' not in trailer):
+        return -1, trailer
+    for key, value in values.items():
+        if (key in _ARRAYS) != value.startswith(b'['):
+            # A number where an array should be, or the other way around.
+            return -1, trailer
+
+    raw = data[m.end():m.end() + int(values[b'/Length'])]
+    try:
+        raw = zlib.decompress(raw) if b'/FlateDecode' in trailer else raw
+    except zlib.error:
+        return -1, trailer
+
+    widths = _numbers(values[b'/W'])
+    if len(widths) != 3:
+        return -1, trailer
+    row_size = sum(widths)
+    if b'/Predictor' in values and int(values[b'/Predictor']) >= 10:
+        raw = _unpredict(raw, int(values.get(b'/Columns', str(row_size).encode())))
+        if raw is None:
+            return -1, trailer
+
+    index = _numbers(values[b'/Index']) if b'/Index' in values else [0, int(values.get(b'/Size', b'0'))]
+    row = 0
+    for start, count in zip(index[0::2], index[1::2]):
+        if start <= num < start + count:
+            at = (row + num - start) * row_size
+            fields = []
+            for width in widths:
+                fields.append(int.from_bytes(raw[at:at + width], 'big') if width else None)
+                at += width
+            kind = 1 if fields[0] is None else fields[0]
+            if kind == 1:
+                return fields[1], trailer
+            if kind == 2:
+                return -1, trailer
+            return None, trailer
+        row += count
+    return None, trailer
+
+
+def _find_object(data, num):
+    """
+    Find where an object is, and the /Info reference of the newest trailer.
+
+    :param data: the PDF file
+    :type data: bytes
+    :param num: the object we are looking for, None if we only want the /Info reference
+    :type num: int
+    :return: offset of the object (None if it's not found, -1 if we can't tell), the /Info reference
+    :rtype: int, tuple
+    """
+
+    tail_start = max(len(data) - TAIL_SIZE, 0)
+    pos = data.rfind(b'startxref', tail_start)
+    if pos < 0:
+        return -1, None
+    m = _STARTXREF.match(data, pos)
+    if m is None:
+        return -1, None
+    pos = int(m.group(1))
+
+    info = None
+    for i in range(MAX_PREV):
+        if _XREF.match(data, pos):
+            offset, trailer = _xref_table(data, pos, num)
+        elif _OBJ.match(data, pos):
+            offset, trailer = _xref_stream(data, pos, num)
+        else:
+            return -1, info
+        if trailer is None:
+            return -1, info
+        if b'/Encrypt' in trailer:
+            return -1, None
+
+        if info is None:
+            m = _INFO.search(trailer)
+            if m is not None:
+                info = (int(m.group(1)), int(m.group(2)))
+        if offset is not None or (num is None and info is not None):
+            return offset, info
+
+        m = _PREV.search(trailer)
+        if m is None:
+            return None, info
+        pos = int(m.group(1))
+    return -1, info
+
+
+def _read_object(data, ref):
+    """
+    Get the content of an object.
+
+    :param data: the PDF file
+    :type data: bytes
+    :param ref: object number and generation
+    :type ref: tuple
+    :return: what's between "obj" and "endobj", None if it can't be found
+    :rtype: bytes
+    """
+
+    offset, info = _find_object(data, ref[0])
+    if offset is None or offset < 0:
+        return None
+    m = _OBJ.match(data, offset)
+    if m is None or (int(m.group(1)), int(m.group(2))) != ref:
+        return None
+    end = data.find(b'endobj', m.end())
+    if end < 0:
+        return None
+    return data[m.end():end]
+
+
+def _read_string(data, pos):
+    """
+    Read a literal or hexadecimal string.
+
+    :param data: where the string is
+    :type data: bytes
+    :param pos: where the string starts
+    :type pos: int
+    :return: the bytes of the string, None if there isn't a string here
+    :rtype: bytes
+    """
+
+    if data[pos:pos + 1] == b'<' and data[pos:pos + 2] != b'<<':
+        end = data.find(b'>', pos)
+        if end < 0:
+            return None
+        digits = re.sub(rb'\s', b'', data[pos + 1:end])
+        if len(digits) % 2:
+            digits += b'0'
+        try:
+            return bytes.fromhex(digits.decode('ascii'))
+        except ValueError:
+            return None
+
+    if data[pos:pos + 1] != b'(':
+        return None
+
+    out = bytearray()
+    depth = 0
+    i = pos
+    while i < len(data):
+        c = data[i]
+        if c == 0x5c:  # backslash
+            i += 1
+            if i >= len(data):
+                break
+            c = data[i]
+            if c in _ESCAPES:
+                out += _ESCAPES[c]
+            elif 0x30 <= c <= 0x37:
+                octal = data[i:i + 3]
+                n = 0
+                while n < len(octal) and 0x30 <= octal[n] <= 0x37:
+                    n += 1
+                out.append(int(octal[:n], 8) & 0xff)
+                i += n - 1
+            elif c == 0x0d:
+                if data[i + 1:i + 2] == b'\n':
+                    i += 1
+            elif c != 0x0a:
+                out.append(c)
+        elif c == 0x28:  # (
+            if depth:
+                out.append(c)
+            depth += 1
+        elif c == 0x29:  # )
+            depth -= 1
+            if not depth:
+                return bytes(out)
+            out.append(c)
+        else:
+            out.append(c)
+        i += 1
+    return None
+
+
+def _decode(value):
+    """
+    :param value: the bytes of a PDF text string
+    :type value: bytes
+    :return: the text
+    :rtype: str
+    """
+
+    if value.startswith(b'\xfe\xff'):
+        return value[2:].decode('utf-16-be', 'replace')
+    if value.startswith(b'\xef\xbb\xbf'):
+        return value[3:].decode('utf-8', 'replace')
+    return value.decode('latin-1')
+
+
+def read_pdf_title(data):
+    """
+    Read the title of a PDF file from its trailer and /Info dictionary only, without parsing the whole file.
+
+    :param data: the PDF file
+    :type data: bytes
+    :return: the title, '' if there's no title, None if the file is unusual and this can't tell
+    :rtype: str
+    """
+
+    offset, info = _find_object(data, None)
+    if offset == -1:
+        return None
+    if info is None:
+        return ''
+
+    obj = _read_object(data, info)
+    if obj is None:
+        return None
+
+    m = _TITLE.search(obj)
+    if m is None:
+        return ''
+
+    # The title might be an object of its own.
+    ref = _REF.match(obj, m.end())
+    if ref is not None:
+        obj = _read_object(data, (int(ref.group(1)), int(ref.group(2))))
+        if obj is None:
+            return None
+        value = _read_string(obj.strip(), 0)
+    else:
+        value = _read_string(obj, m.end())
+    if value is None:
+        return None
+    return _decode(value)
+
+
+def parse_pdf_title(data):
+    """
+    Get the title of a PDF file by parsing it with PyPDF2, for the files read_pdf_title() can't tell.
+
+    :param data: the PDF file
+    :type data: bytes
+    :return: the title, '' if there's no title or the file can't be read
+    :rtype: str
+    """
+
+    import PyPDF2
+    try:
+        return PyPDF2.PdfFileReader(io.BytesIO(data)).getDocumentInfo().title or ''
+    except (PyPDF2.utils.PdfReadError, AttributeError, ValueError):
+        return ''
+
+
+def get_pdf_title(data):
+    """
+    Get the title of a PDF file, PyPDF2 is only used when read_pdf_title() can't tell.
+
+    :param data: the PDF file
+    :type data: bytes
+    :return: the title, '' if there's no title or the file can't be read
+    :rtype: str
+    """
+
+    title = read_pdf_title(data)
+    if title is not None:
+        return title
+    return parse_pdf_title(data)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import Counter
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+# Seconds between two wall clock samples.
+INTERVAL = 0.01
+
+# Rows in the tables of hot functions.
+TOP = 30
+
+# Most seconds stop() waits for the profiled threads to end, the ones still running
+# after that are left out of the CPU profile.
+JOIN_TIMEOUT = 5
+
+# Threads of the same pool are put together, e.g. "ThreadPoolExecutor-0_3" is "ThreadPoolExecutor-0".
+_THREAD_NUMBER = re.compile(r'_\d+$')
+
+
+def _thread_group(name):
+    """
+    :param name: name of a thread
+    :type name: str
+    :return: name of the group of threads it belongs to
+    :rtype: str
+    """
+
+    return _THREAD_NUMBER.sub('', name)
+
+
+def _frame_label(code):
+    """
+    :param code: code object of a frame
+    :type code: code
+    :return: the function and where it is, without ";" so it can be used in collapsed stacks
+    :rtype: str
+    """
+
+    return '{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno).replace(';', ':')
+
+
+class Profiler(object):
+    """
+    Profile a whole run, two ways at once:
+
+    - CPU: every thread gets its own cProfile profiler, threads started later get
+      theirs through threading.setprofile(). The coroutines of the batch mode all
+      run in the main thread, so they are in its profile. A profiler is only read
+      once its thread stopped using it.
+    - Wall clock: another thread samples the stack of every thread at a fixed interval,
+      so time spent waiting (for COTUS, a lock, a worker process) shows up too. It's
+      started before threading.setprofile(), so it's not in the CPU profile.
+
+    Worker processes of the CPU pool are not profiled, their queue and run times are in the log.
+    """
+
+    def __init__(self, dir_name, interval=INTERVAL, top=TOP):
+        """
+        :param dir_name: where the results are written
+        :type dir_name: str
+        :param interval: seconds between two wall clock samples
+        :type interval: float
+        :param top: rows in the tables of hot functions
+        :type top: int
+        """
+
+        self.dir_name = dir_name
+        self.interval = interval
+        self.top = top
+
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._samples = Counter()
+        self._sample_count = 0
+        self._stopping = threading.Event()
+        self._sampler = None
+        self._started = 0.0
+
+    def _profile_thread(self, frame, event, arg):
+        """
+        Runs once in every thread started after start(), and gives the thread its own profiler.
+        """
+
+        sys.setprofile(None)
+        self._enable()
+
+    def _enable(self):
+        """
+        Start profiling the current thread.
+        """
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Since Python 3.12 one profiler sees every thread, and a second one can't be started.
+            return
+        with self._lock:
+            self._profiles.append((threading.current_thread(), profile))
+
+    def _sample(self):
+        """
+        Take wall clock samples until stop() is called.
+        """
+
+        me = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(_thread_group(names.get(ident, 'thread-{0}'.format(ident))).replace(';', ':'))
+                stacks.append(';'.join(reversed(stack)))
+            with self._lock:
+                self._samples.update(stacks)
+                self._sample_count += 1
+
+    def start(self):
+        """
+        Start profiling the current thread and every thread started from now on, and start sampling.
+        """
+
+        self._started = time.monotonic()
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+        threading.setprofile(self._profile_thread)
+        self._enable()
+
+    def stop(self):
+        """
+        Stop profiling and write the results:
+
+        - cpu.pstats: the CPU profile of every thread together, for pstats or snakeviz
+        - cpu.txt: hot functions by CPU time, of every thread together and of each group of threads
+        - wall.collapsed: collapsed stacks of the wall clock samples, for flamegraph.pl or speedscope
+        - wall.txt: hot functions by wall clock samples, by themselves (self) and with what they call (total)
+        """
+
+        threading.setprofile(None)
+        self._stopping.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        elapsed = time.monotonic() - self._started
+
+        with self._lock:
+            profiles = list(self._profiles)
+            samples = Counter(self._samples)
+            sample_count = self._sample_count
+
+        # A profiler can't be read while its thread still uses it, and only that thread can
+        # stop it: this thread's own is stopped first, the other threads are waited for.
+        me = threading.current_thread()
+        for thread, profile in profiles:
+            if thread is me:
+                profile.create_stats()
+        deadline = time.monotonic() + JOIN_TIMEOUT
+        running = []
+        for thread, profile in profiles:
+            if thread is me:
+                continue
+            thread.join(max(0, deadline - time.monotonic()))
+            if thread.is_alive():
+                running.append(thread)
+            else:
+                profile.create_stats()
+        profiles = [(thread.name, profile) for thread, profile in profiles if thread not in running and profile.stats]
+
+        os.makedirs(self.dir_name, exist_ok=True)
+
+        groups = {}
+        for thread_name, profile in profiles:
+            groups.setdefault(_thread_group(thread_name), []).append(profile)
+        out = io.StringIO()
+        if profiles:
+            stats = pstats.Stats(*[profile for thread_name, profile in profiles], stream=out)
+            stats.dump_stats(os.path.join(self.dir_name, 'cpu.pstats'))
+            out.write('All threads ({0} profiled, {1:.1f}s run)\n'.format(len(profiles), elapsed))
+            if running:
+                out.write('Still running, not profiled: {0}\n'.format(', '.join(sorted(thread.name for thread in running))))
+            stats.sort_stats('tottime').print_stats(self.top)
+            for group, group_profiles in sorted(groups.items()):
+                out.write('\nThreads: {0} ({1})\n'.format(group, len(group_profiles)))
+                pstats.Stats(*group_profiles, stream=out).sort_stats('tottime').print_stats(self.top)
+        with open(os.path.join(self.dir_name, 'cpu.txt'), 'w') as out_file:
+            out_file.write(out.getvalue())
+
+        with open(os.path.join(self.dir_name, 'wall.collapsed'), 'w') as out_file:
+            for stack, count in sorted(samples.items()):
+                out_file.write('{0} {1}\n'.format(stack, count))
+
+        # Self is the function on top of the stack, total counts every function on the stack once.
+        own = Counter()
+        total = Counter()
+        for stack, count in samples.items():
+            frames = stack.split(';')[1:]
+            if frames:
+                own[frames[-1]] += count
+            for each in set(frames):
+                total[each] += count
+        with open(os.path.join(self.dir_name, 'wall.txt'), 'w') as out_file:
+            out_file.write('{0} samples every {1:.3f}s over {2:.1f}s, summed over all threads\n\n'.format(
+                sample_count, self.interval, elapsed))
+            for title, counter in (('Self', own), ('Total', total)):
+                out_file.write('{0: >10}{1: >9}  {2}\n'.format(title, 'Seconds', 'Function'))
+                for label, count in counter.most_common(self.top):
+                    out_file.write('{0: >10}{1: >9.2f}  {2}\n'.format(count, count * self.interval, label))
+                out_file.write('\n')
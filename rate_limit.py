@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from urllib.parse import urlsplit
+import asyncio
+import threading
+import time
+
+# How many requests a host gets at the same time before anything is known about it,
+# and the most it can get however well it does.
+INITIAL_CONCURRENCY = 10
+MAX_CONCURRENCY = 100
+
+# The concurrency goes up by about one for every "concurrency" requests that are not
+# slower than LATENCY_TOLERANCE times the usual latency, and is cut by DECREASE on a
+# timeout or a 5xx response, at most once every DECREASE_COOLDOWN seconds.
+LATENCY_TOLERANCE = 2.0
+DECREASE = 0.5
+DECREASE_COOLDOWN = 1.0
+
+# How much the newest request counts in the usual latency.
+ALPHA = 0.1
+
+
+class HostLimiter(object):
+    """
+    A token bucket and an AIMD (additive increase, multiplicative decrease)
+    concurrency limit for one host, usable from threads and from coroutines.
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=MAX_CONCURRENCY, min_concurrency=1):
+        """
+        :param rate: most requests per second, None for no limit
+        :type rate: float
+        :param burst: most requests sent at once after a quiet period, defaults to the rate
+        :type burst: float
+        :param max_concurrency: the concurrency never goes above this
+        :type max_concurrency: int
+        :param min_concurrency: the concurrency never goes below this
+        :type min_concurrency: int
+        """
+
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate or 1, 1)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._async_waiters = []
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._last_decrease = 0.0
+        self._latency = None
+
+        self.concurrency = float(min(max(INITIAL_CONCURRENCY, self.min_concurrency), self.max_concurrency))
+        self.in_flight = 0
+        self.peak_concurrency = self.concurrency
+        self.lowest_concurrency = self.concurrency
+        self.requests = 0
+        self.decreases = 0
+        self.waits = 0
+
+    def _try_acquire(self):
+        """
+        Take a token and a concurrency slot if both are there, the lock must be held.
+
+        :return: 0 if they were taken, otherwise seconds until a token shows up (None to wait for a slot)
+        :rtype: float
+        """
+
+        if self.in_flight >= int(self.concurrency):
+            return None
+        if self.rate is not None:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        self.in_flight += 1
+        self.requests += 1
+        return 0
+
+    def acquire(self):
+        """
+        Wait for a token and a slot, from a thread.
+        """
+
+        with self._cond:
+            wait = self._try_acquire()
+            if wait == 0:
+                return
+            self.waits += 1
+            while wait != 0:
+                self._cond.wait(wait)
+                wait = self._try_acquire()
+
+    async def acquire_async(self):
+        """
+        Wait for a token and a slot, from a coroutine, without blocking the event loop.
+        """
+
+        loop = asyncio.get_running_loop()
+        counted = False
+        while True:
+            with self._lock:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                if not counted:
+                    self.waits += 1
+                    counted = True
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await asyncio.wait([waiter], timeout=wait)
+            finally:
+                with self._lock:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+
+    @staticmethod
+    def _wake(waiter):
+        """
+        :param waiter: the future a coroutine is waiting on
+        :type waiter: asyncio.Future
+        """
+
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def release(self, ok, latency):
+        """
+        Give back the slot and adjust the concurrency.
+
+        :param ok: whether the request went well, None if it didn't finish for other reasons (cancelled)
+        :type ok: bool
+        :param latency: seconds the request took
+        :type latency: float
+        """
+
+        with self._cond:
+            self.in_flight -= 1
+            if ok:
+                if self._latency is None or latency <= LATENCY_TOLERANCE * self._latency:
+                    self.concurrency = min(self.concurrency + 1 / self.concurrency, self.max_concurrency)
+                    self.peak_concurrency = max(self.peak_concurrency, self.concurrency)
+                self._latency = latency if self._latency is None else ALPHA * latency + (1 - ALPHA) * self._latency
+            elif ok is not None:
+                now = time.monotonic()
+                if now - self._last_decrease >= DECREASE_COOLDOWN:
+                    self._last_decrease = now
+                    self.concurrency = max(self.concurrency * DECREASE, self.min_concurrency)
+                    self.lowest_concurrency = min(self.lowest_concurrency, self.concurrency)
+                    self.decreases += 1
+
+            self._cond.notify_all()
+            waiters = self._async_waiters
+            self._async_waiters = []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(self._wake, waiter)
+            except RuntimeError:
+                # The event loop is gone.
+                pass
+
+    def slot(self):
+        """
+        A request to the host, to be used with "with" or "async with", set "ok" of the
+        slot to False if the response says the host is struggling (5xx).
+
+        :return: the slot
+        :rtype: Slot
+        """
+
+        return Slot(self)
+
+    def stats(self):
+        """
+        :return: current, highest and lowest concurrency, requests in flight, requests sent,
+                 times the concurrency was cut, and requests that had to wait
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {
+                'concurrency': int(self.concurrency),
+                'peak': int(self.peak_concurrency),
+                'lowest': int(self.lowest_concurrency),
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'decreases': self.decreases,
+                'waits': self.waits
+            }
+
+
+class Slot(object):
+    """
+    One request holding a token and a concurrency slot of a host, the request
+    counts as failed if an exception (a timeout) gets out of the block. Once the
+    block is left, "latency" is how long the slot was held, without the wait for it.
+    """
+
+    def __init__(self, limiter):
+        """
+        :param limiter: the limiter of the host
+        :type limiter: HostLimiter
+        """
+
+        self.limiter = limiter
+        self.ok = True
+        self.latency = None
+        self._start = 0.0
+
+    def _done(self, exc_type):
+        """
+        :param exc_type: the exception that got out of the block, if any
+        :type exc_type: type
+        """
+
+        if exc_type is not None and issubclass(exc_type, (asyncio.CancelledError, GeneratorExit, KeyboardInterrupt)):
+            ok = None
+        else:
+            ok = self.ok and exc_type is None
+        self.latency = time.monotonic() - self._start
+        self.limiter.release(ok, self.latency)
+
+    def __enter__(self):
+        self.limiter.acquire()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._done(exc_type)
+        return False
+
+    async def __aenter__(self):
+        await self.limiter.acquire_async()
+        self._start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._done(exc_type)
+        return False
+
+
+class RateLimits(object):
+    """
+    The limiters of every host, created when a host is first used.
+    """
+
+    def __init__(self, rates=None, max_concurrency=MAX_CONCURRENCY, host_max_concurrency=None):
+        """
+        :param rates: requests per second of specific hosts, other hosts have no rate limit
+        :type rates: dict[str, float]
+        :param max_concurrency: most requests at the same time to a host
+        :type max_concurrency: int
+        :param host_max_concurrency: most requests at the same time to specific hosts, overriding max_concurrency
+        :type host_max_concurrency: dict[str, int]
+        """
+
+        self.rates = dict(rates or {})
+        self.max_concurrency = max_concurrency
+        self.host_max_concurrency = dict(host_max_concurrency or {})
+
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def configure(self, rates=None, max_concurrency=None, host_max_concurrency=None):
+        """
+        Change the settings, must be done before the first request.
+
+        :param rates: requests per second of specific hosts
+        :type rates: dict[str, float]
+        :param max_concurrency: most requests at the same time to a host
+        :type max_concurrency: int
+        :param host_max_concurrency: most requests at the same time to specific hosts, overriding max_concurrency
+        :type host_max_concurrency: dict[str, int]
+        """
+
+        if rates is not None:
+            self.rates.update(rates)
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+        if host_max_concurrency is not None:
+            self.host_max_concurrency.update(host_max_concurrency)
+
+    def limiter(self, url):
+        """
+        :param url: a url on the host
+        :type url: str
+        :return: the limiter of the host
+        :rtype: HostLimiter
+        """
+
+        host = urlsplit(url).hostname
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = HostLimiter(self.rates.get(host),
+                                                   max_concurrency=self.host_max_concurrency.get(host, self.max_concurrency))
+            return self._limiters[host]
+
+    def slot(self, url):
+        """
+        :param url: the url the request goes to
+        :type url: str
+        :return: a slot of the host, to be used with "with" or "async with"
+        :rtype: Slot
+        """
+
+        return self.limiter(url).slot()
+
+    def stats(self):
+        """
+        :return: {host: stats of its limiter}
+        :rtype: dict
+        """
+
+        with self._lock:
+            limiters = sorted(self._limiters.items())
+        return dict((host, limiter.stats()) for host, limiter in limiters)
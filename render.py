@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import hashlib
+import io
+import json
+import os
+
+FONT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SourceCodePro-Bold.ttf')
+FONT_SIZE = 20
+
+# Everything about the order that shows up on the summary image.
+RENDER_FIELDS = ['vehicle_name', 'order_date', 'order_edd', 'current_state', 'state_dates']
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(file_name=FONT_FILE, size=FONT_SIZE):
+    """
+    Load a font, only the first call for each file and size reads the file.
+
+    :param file_name: the TrueType font file
+    :type file_name: str
+    :param size: the font size
+    :type size: int
+    :return: the font
+    :rtype: ImageFont.FreeTypeFont
+    """
+
+    from PIL import ImageFont
+    return ImageFont.truetype(file_name, size)
+
+
+def render_digest(source, order_info):
+    """
+    A digest of everything the summary image is made of, the same digest means the same image.
+
+    :param source: the picture of the car, as downloaded
+    :type source: bytes
+    :param order_info: order information
+    :type order_info: dict
+    :return: the digest
+    :rtype: str
+    """
+
+    fields = [order_info.get(name) for name in RENDER_FIELDS]
+    fields.append(hashlib.sha256(source).hexdigest())
+    return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+def render_summary(source, order_info, state_names):
+    """
+    Put the order information next to the picture of the car, all in memory.
+
+    :param source: the picture of the car, as downloaded
+    :type source: bytes
+    :param order_info: order information
+    :type order_info: dict
+    :param state_names: names of the five states of an order
+    :type state_names: dict[int, str]
+    :return: the PNG file, None if the picture can't be read
+    :rtype: bytes
+    """
+
+    # PIL is only loaded by the runs (and the worker processes) that draw pictures.
+    from PIL import Image, ImageDraw
+    try:
+        img = Image.open(io.BytesIO(source))
+        img = img.convert('RGBA')
+    except OSError:
+        return None
+
+    width = 850 + len(order_info['vehicle_name']) * 14
+    width = width if width > 1200 else 1200
+    img_sig = Image.new('RGBA', (width, 359), (255, 255, 255, 255))
+    img_sig.paste(img, (0, -40), img)
+
+    fnt = get_font()
+    d = ImageDraw.Draw(img_sig)
+
+    d.text((600, 60), 'Vehicle Name:', font=fnt, fill=(0, 0, 0))
+    d.text((850, 60), order_info['vehicle_name'], font=fnt, fill=(14, 57, 201))
+
+    d.text((600, 85), 'Ordered On:', font=fnt, fill=(0, 0, 0))
+    d.text((850, 85), order_info['order_date'], font=fnt, fill=(54, 178, 8))
+
+    d.text((600, 110), 'Estimated Delivery:', font=fnt, fill=(0, 0, 0))
+    d.text((850, 110), 'N/A' if not order_info['order_edd'] else order_info['order_edd'], font=fnt,
+           fill=(229, 150, 32))
+
+    d.text((600, 135), 'Current State:', font=fnt, fill=(0, 0, 0))
+    d.text((850, 135), order_info['current_state'], font=fnt, fill=(209, 6, 40))
+
+    for i in range(5):
+        d.text((600, 160 + i * 25), state_names[i], font=fnt, fill=(0, 0, 0))
+        try:
+            d.text((850, 160 + i * 25), 'Completed On {0}'.format(order_info['state_dates'][i]), font=fnt,
+                   fill=(133, 17, 216))
+        except IndexError:
+            d.text((850, 160 + i * 25), 'N/A', font=fnt, fill=(133, 17, 216))
+
+    out = io.BytesIO()
+    img_sig.save(out, 'PNG')
+    return out.getvalue()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import random
+import threading
+
+# The delay before the n-th retry is picked at random between 0 and BASE_DELAY * 2^n
+# seconds, never more than MAX_DELAY, so lookups that failed together don't all
+# come back at the same time.
+BASE_DELAY = 1
+MAX_DELAY = 30
+
+# A run retries at most this share of its lookups, but always at least MIN_BUDGET of them,
+# so a COTUS outage doesn't turn every lookup into many.
+BUDGET_RATIO = 0.2
+MIN_BUDGET = 10
+
+# What went wrong with a lookup, timeouts and empty pages are worth another try,
+# an error page (invalid order or order not found) won't change by asking again.
+TIMEOUT = 'timeout'
+DOWN = 'down'
+PERMANENT = 'permanent'
+TRANSIENT = (TIMEOUT, DOWN)
+
+
+def backoff(attempt, base=BASE_DELAY, cap=MAX_DELAY):
+    """
+    :param attempt: how many retries there were before this one
+    :type attempt: int
+    :param base: the longest delay of the first retry
+    :type base: float
+    :param cap: the longest delay of any retry
+    :type cap: float
+    :return: seconds to wait before the retry
+    :rtype: float
+    """
+
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def classify(data, page):
+    """
+    Tell what went wrong with a lookup.
+
+    :param data: the raw data returned from get_data(), an error message if the request failed
+    :type data: bytes or str or OrderPageParser
+    :param page: the page parsed from the data, None if COTUS said it didn't change
+    :type page: OrderPageParser
+    :return: None if the page is usable, otherwise TIMEOUT, DOWN or PERMANENT
+    :rtype: str
+    """
+
+    if page is None:
+        return None
+    if isinstance(data, str):
+        return TIMEOUT
+    if page.error_msg is not None:
+        return PERMANENT
+    if page.order_info() == -1:
+        return DOWN
+    return None
+
+
+def requeue_later(queue, item, delay):
+    """
+    Put an item back into an asyncio queue after a while, without anyone waiting for it.
+    The queue isn't done with the item until it's back, so queue.join() waits for it.
+
+    :param queue: the queue the item was taken from, task_done() must not be called for it
+    :type queue: asyncio.Queue
+    :param item: the item
+    :type item: object
+    :param delay: seconds to wait
+    :type delay: float
+    """
+
+    def requeue():
+        queue.put_nowait(item)
+        queue.task_done()
+
+    asyncio.get_running_loop().call_later(delay, requeue)
+
+
+class RetryBudget(object):
+    """
+    How many failed lookups can still be retried in the current run, and what went wrong so far.
+    """
+
+    def __init__(self, ratio=BUDGET_RATIO, minimum=MIN_BUDGET):
+        """
+        :param ratio: most retries per lookup, e.g. 0.2 for 20% extra lookups
+        :type ratio: float
+        :param minimum: retries allowed no matter how few lookups there are
+        :type minimum: int
+        """
+
+        self.ratio = ratio
+        self.minimum = minimum
+
+        self._lock = threading.Lock()
+        self._allowed = minimum
+        self._used = 0
+        self.errors = dict((kind, 0) for kind in TRANSIENT + (PERMANENT,))
+        self.retries = 0
+        self.exhausted = 0
+
+    def start(self, lookups):
+        """
+        Start a new run, the budget left from the last one is not carried over.
+
+        :param lookups: how many lookups there are in the run
+        :type lookups: int
+        """
+
+        with self._lock:
+            self._allowed = max(self.minimum, int(self.ratio * lookups))
+            self._used = 0
+
+    def take(self, kind, last=False):
+        """
+        Count a failed lookup, and use the budget to retry it if it's worth it.
+
+        :param kind: what went wrong, from classify()
+        :type kind: str
+        :param last: whether the lookup already had all its tries
+        :type last: bool
+        :return: whether it should be retried
+        :rtype: bool
+        """
+
+        with self._lock:
+            self.errors[kind] += 1
+            if kind not in TRANSIENT or last:
+                return False
+            if self._used >= self._allowed:
+                self.exhausted += 1
+                return False
+            self._used += 1
+            self.retries += 1
+            return True
+
+    def stats(self):
+        """
+        :return: errors of each kind, retries, and lookups not retried because the budget ran out
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {'errors': dict(self.errors), 'retries': self.retries, 'exhausted': self.exhausted}
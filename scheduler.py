@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import random
+import time
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# How often an order is checked in each state, the first match in the current state wins.
+STATE_INTERVALS = [
+    ('processing', 2 * HOUR),
+    ('production', 4 * HOUR),
+    ('shipment', 1 * HOUR),
+    ('transit', 1 * HOUR)
+]
+DEFAULT_INTERVAL = 1 * HOUR
+
+# Orders COTUS never had are checked often, they show up any time after they are placed,
+# orders that were found before but are gone now are probably just COTUS acting up.
+NOT_FOUND_INTERVAL = 1 * HOUR
+LOST_INTERVAL = 2 * HOUR
+
+# Orders that just changed are likely to change again soon, orders that
+# didn't change for a long time are checked less often, up to MAX_INTERVAL.
+RECENT_CHANGE = 1 * DAY
+RECENT_INTERVAL = 30 * MINUTE
+STALE_CHANGE = 14 * DAY
+MAX_INTERVAL = 12 * HOUR
+
+# Every interval is moved by up to this much, so orders don't stay in lockstep.
+JITTER = 0.1
+
+# Orders the scheduler hasn't seen before are spread over this many seconds.
+NEW_ORDER_SPREAD = 5 * MINUTE
+
+
+def next_interval(current_state, last_change, found, now):
+    """
+    How long to wait before checking an order again.
+
+    :param current_state: the current state of the order, None if COTUS doesn't have the order
+    :type current_state: str
+    :param last_change: when the EDD or the state of the order last changed, 0 if never
+    :type last_change: float
+    :param found: whether COTUS ever had the order
+    :type found: bool
+    :param now: the current time
+    :type now: float
+    :return: seconds to wait
+    :rtype: float
+    """
+
+    if current_state is None:
+        interval = LOST_INTERVAL if found else NOT_FOUND_INTERVAL
+    else:
+        interval = DEFAULT_INTERVAL
+        state = current_state.lower()
+        for name, each in STATE_INTERVALS:
+            if name in state:
+                interval = each
+                break
+
+        since_change = now - last_change if last_change else None
+        if since_change is not None and since_change < RECENT_CHANGE:
+            interval = min(interval, RECENT_INTERVAL)
+        elif since_change is None or since_change > STALE_CHANGE:
+            interval *= 2
+
+    interval = min(interval, MAX_INTERVAL)
+    return interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+class Scheduler(object):
+    """
+    When each order is checked next, kept in a heap so the next order due is always on top.
+
+    The schedule is saved in the state store after every change, so a restarted
+    daemon picks up where it left off instead of checking everything at once.
+    """
+
+    def __init__(self, store):
+        """
+        :param store: where the schedule is saved, a StateStore
+        :type store: state_store.StateStore
+        """
+
+        self.store = store
+
+        self._heap = []
+        self._entries = {}
+        for key, next_check, last_change, found in store.schedule():
+            self._entries[key] = {'next_check': next_check, 'last_change': last_change, 'found': found}
+            heapq.heappush(self._heap, (next_check, key))
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sync(self, keys, now=None):
+        """
+        Make the schedule match the order file, new orders are spread over the next few minutes.
+
+        :param keys: the orders, as they are in the order file
+        :type keys: iterable[str]
+        :param now: the current time
+        :type now: float
+        """
+
+        now = time.time() if now is None else now
+        keys = set(keys)
+        for key in [k for k in self._entries if k not in keys]:
+            self.remove(key)
+        for key in keys:
+            if key not in self._entries:
+                self._set(key, now + random.uniform(0, NEW_ORDER_SPREAD), 0, False)
+
+    def _set(self, key, next_check, last_change, found):
+        """
+        Schedule an order and save it.
+
+        :param key: the order, as it is in the order file
+        :type key: str
+        :param next_check: when to check it
+        :type next_check: float
+        :param last_change: when it last changed, 0 if never
+        :type last_change: float
+        :param found: whether COTUS ever had the order
+        :type found: bool
+        """
+
+        self._entries[key] = {'next_check': next_check, 'last_change': last_change, 'found': found}
+        heapq.heappush(self._heap, (next_check, key))
+        self.store.put_schedule(key, next_check, last_change, found)
+
+    def remove(self, key):
+        """
+        :param key: the order, as it is in the order file
+        :type key: str
+        """
+
+        # The heap entry is skipped when it comes up.
+        if self._entries.pop(key, None) is not None:
+            self.store.delete_schedule(key)
+
+    def next_time(self):
+        """
+        :return: when the next order is due, None if there are no orders
+        :rtype: float
+        """
+
+        while self._heap:
+            next_check, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry['next_check'] == next_check:
+                return next_check
+            heapq.heappop(self._heap)
+        return None
+
+    def due(self, now=None):
+        """
+        Take every order that's due, they stay in the schedule until they are rescheduled.
+
+        :param now: the current time
+        :type now: float
+        :return: the orders, as they are in the order file
+        :rtype: list[str]
+        """
+
+        now = time.time() if now is None else now
+        keys = []
+        while True:
+            next_check = self.next_time()
+            if next_check is None or next_check > now:
+                return keys
+            keys.append(heapq.heappop(self._heap)[1])
+
+    def reschedule(self, key, current_state, changed, now=None):
+        """
+        Schedule the next check of an order that was just checked.
+
+        :param key: the order, as it is in the order file
+        :type key: str
+        :param current_state: the current state of the order, None if COTUS doesn't have the order
+        :type current_state: str
+        :param changed: whether the EDD or the state changed since the last check
+        :type changed: bool
+        :param now: the current time
+        :type now: float
+        """
+
+        now = time.time() if now is None else now
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        last_change = now if changed else entry['last_change']
+        found = entry['found'] or current_state is not None
+        self._set(key, now + next_interval(current_state, last_change, found, now), last_change, found)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from metrics import STAGE_SECONDS, shared_metrics
+import threading
+import time
+
+# Where the emails are sent, port 465 is SMTP over SSL, any other port is
+# plain SMTP with STARTTLS if the server offers it.
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 465
+SMTP_TIMEOUT = 30
+
+# Number of connections kept open, and how long (in seconds) an idle
+# connection is kept before it's closed instead of reused.
+POOL_SIZE = 4
+IDLE_TIMEOUT = 60
+
+_smtplib_module = None
+
+
+def _smtplib():
+    """
+    smtplib is only imported when the first email is sent, runs that send nothing
+    don't pay for it.
+
+    :return: the smtplib module
+    :rtype: module
+    """
+
+    global _smtplib_module
+    if _smtplib_module is None:
+        import smtplib
+        _smtplib_module = smtplib
+    return _smtplib_module
+
+
+class SmtpPool(object):
+    """
+    Logged in SMTP connections shared by everything that sends emails.
+
+    A connection is only opened and logged in when there isn't an idle one,
+    if a pooled connection was dropped by the server the message is sent
+    again on a new connection. How long sending takes and how many sends
+    failed are counted.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user='', password='', size=POOL_SIZE, idle_timeout=IDLE_TIMEOUT):
+        """
+        :param host: the SMTP server
+        :type host: str
+        :param port: the port of the SMTP server
+        :type port: int
+        :param user: user name to log in with, don't log in if it's empty
+        :type user: str
+        :param password: password to log in with
+        :type password: str
+        :param size: number of connections that can be open at the same time
+        :type size: int
+        :param idle_timeout: seconds an idle connection is kept
+        :type idle_timeout: float
+        """
+
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = size
+        self.idle_timeout = idle_timeout
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+
+        self.sent = 0
+        self.failed = 0
+        self.connections = 0
+        self.reconnects = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def configure(self, host=None, port=None, user=None, password=None, size=None):
+        """
+        Change the settings, must be done before the first email is sent.
+
+        :param host: the SMTP server
+        :type host: str
+        :param port: the port of the SMTP server
+        :type port: int
+        :param user: user name to log in with, don't log in if it's empty
+        :type user: str
+        :param password: password to log in with
+        :type password: str
+        :param size: number of connections that can be open at the same time
+        :type size: int
+        """
+
+        if host is not None:
+            self.host = host
+        if port is not None:
+            self.port = port
+        if user is not None:
+            self.user = user
+        if password is not None:
+            self.password = password
+        if size is not None:
+            self.size = size
+            self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        """
+        Open a new connection and log in, login is skipped if the server doesn't ask for it.
+
+        :return: the connection
+        :rtype: smtplib.SMTP
+        """
+
+        if self.port == 465:
+            server = _smtplib().SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT)
+        else:
+            server = _smtplib().SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        try:
+            server.ehlo()
+            if self.port != 465 and server.has_extn('starttls'):
+                server.starttls()
+                server.ehlo()
+            if self.user and server.has_extn('auth'):
+                server.login(self.user, self.password)
+        except (_smtplib().SMTPException, OSError):
+            self._discard(server)
+            raise
+
+        with self._lock:
+            self.connections += 1
+        return server
+
+    @staticmethod
+    def _discard(server):
+        """
+        Close a connection without caring whether the server is still there.
+
+        :param server: the connection
+        :type server: smtplib.SMTP
+        """
+
+        try:
+            server.close()
+        except (_smtplib().SMTPException, OSError):
+            pass
+
+    def _take(self):
+        """
+        Get an idle connection that's not too old, or open a new one.
+
+        :return: the connection, and whether it was reused
+        :rtype: smtplib.SMTP, bool
+        """
+
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+            if now - last_used < self.idle_timeout:
+                return server, True
+            self._discard(server)
+        return self._connect(), False
+
+    def _give_back(self, server):
+        """
+        :param server: the connection, put back into the pool to be reused
+        :type server: smtplib.SMTP
+        """
+
+        with self._lock:
+            self._idle.append((server, time.monotonic()))
+
+    def _send_on(self, server, email_from, email_to, message):
+        """
+        Send one email on a connection, it goes back into the pool unless it's broken.
+
+        :param server: the connection
+        :type server: smtplib.SMTP
+        :param email_from: the sender
+        :type email_from: str
+        :param email_to: the recipient
+        :type email_to: str
+        :param message: the whole message
+        :type message: str
+        """
+
+        try:
+            server.sendmail(email_from, email_to, message)
+        except _smtplib().SMTPRecipientsRefused:
+            # Nothing wrong with the connection, only this recipient.
+            self._give_back(server)
+            raise
+        except _smtplib().SMTPException:
+            self._discard(server)
+            raise
+        except OSError as e:
+            self._discard(server)
+            raise _smtplib().SMTPServerDisconnected(str(e))
+        self._give_back(server)
+
+    def send(self, email_from, email_to, message):
+        """
+        Send one email, using a pooled connection if there is one.
+
+        :param email_from: the sender
+        :type email_from: str
+        :param email_to: the recipient
+        :type email_to: str
+        :param message: the whole message
+        :type message: str
+        :raise smtplib.SMTPException: if the email can't be sent
+        """
+
+        start = time.monotonic()
+        with self._slots:
+            try:
+                server, reused = self._take()
+                try:
+                    self._send_on(server, email_from, email_to, message)
+                except _smtplib().SMTPServerDisconnected:
+                    # The server closed an idle connection, try once more on a new one.
+                    if not reused:
+                        raise
+                    with self._lock:
+                        self.reconnects += 1
+                    self._send_on(self._connect(), email_from, email_to, message)
+            except _smtplib().SMTPException:
+                # Before OSError, SMTPException is one.
+                with self._lock:
+                    self.failed += 1
+                raise
+            except OSError as e:
+                with self._lock:
+                    self.failed += 1
+                raise _smtplib().SMTPConnectError(-1, str(e))
+
+        latency = time.monotonic() - start
+        with self._lock:
+            self.sent += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        shared_metrics.observe(STAGE_SECONDS, latency, stage='smtp')
+
+    def stats(self):
+        """
+        :return: emails sent and failed, connections opened, reconnects, average and max seconds to send an email
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'failed': self.failed,
+                'connections': self.connections,
+                'reconnects': self.reconnects,
+                'avg_latency': self.total_latency / self.sent if self.sent else 0.0,
+                'max_latency': self.max_latency
+            }
+
+    def close(self):
+        """
+        Log out and close every idle connection.
+        """
+
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        if not idle:
+            return
+        for server, last_used in idle:
+            try:
+                server.quit()
+            except (_smtplib().SMTPException, OSError):
+                self._discard(server)
+
+
+# Shared by cotus-checker.py and google_sheets_api.py, set up in main().
+shared_pool = SmtpPool()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Changes are committed after this many orders, or this many seconds, whichever comes first.
+BATCH_SIZE = 500
+BATCH_SECONDS = 5
+
+
+class StateStore(object):
+    """
+    The state of every order, one row per VIN and email address in a SQLite database,
+    and the fingerprint of every order in the order file, so the orders that didn't
+    change can be skipped.
+
+    The database is in WAL mode, so reports can read it while a check is writing to it.
+    """
+
+    def __init__(self, file_name, batch_size=BATCH_SIZE, batch_seconds=BATCH_SECONDS):
+        """
+        :param file_name: the database file
+        :type file_name: str
+        :param batch_size: commit after this many changes
+        :type batch_size: int
+        :param batch_seconds: commit when the oldest change not committed is this old
+        :type batch_seconds: float
+        """
+
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._first_pending = 0
+
+        self._conn = sqlite3.connect(file_name, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS states ('
+                           'vin TEXT NOT NULL, email TEXT NOT NULL, data TEXT NOT NULL, updated REAL NOT NULL, '
+                           'PRIMARY KEY (vin, email))')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS schedule ('
+                           'order_key TEXT PRIMARY KEY, next_check REAL NOT NULL, last_change REAL NOT NULL, '
+                           'found INTEGER NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS fingerprints ('
+                           'order_key TEXT PRIMARY KEY, digest TEXT NOT NULL, etag TEXT, last_modified TEXT, '
+                           'ws_found INTEGER NOT NULL, ws_sha256 TEXT, order_info TEXT NOT NULL)')
+        self._conn.commit()
+
+    def get(self, vin, email):
+        """
+        :param vin: the VIN
+        :type vin: str
+        :param email: email address
+        :type email: str
+        :return: the state of the order, None if there isn't one
+        :rtype: dict
+        """
+
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM states WHERE vin = ? AND email = ?', (vin, email)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except json.decoder.JSONDecodeError:
+            return None
+
+    def put(self, vin, email, data):
+        """
+        Save the state of the order, it's committed with the next batch.
+
+        :param vin: the VIN
+        :type vin: str
+        :param email: email address
+        :type email: str
+        :param data: the state of the order
+        :type data: dict
+        """
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO states (vin, email, data, updated) VALUES (?, ?, ?, ?)',
+                               (vin, email, json.dumps(data), time.time()))
+            self._changed()
+
+    def _changed(self):
+        """
+        Count a change, and commit if it's time, the lock must be held.
+        """
+
+        if not self._pending:
+            self._first_pending = time.monotonic()
+        self._pending += 1
+        if self._pending >= self.batch_size or time.monotonic() - self._first_pending >= self.batch_seconds:
+            self._commit()
+
+    def schedule(self):
+        """
+        The saved schedule of the daemon mode.
+
+        :return: (order, next check, last change, found) of every order
+        :rtype: list[tuple]
+        """
+
+        with self._lock:
+            rows = self._conn.execute('SELECT order_key, next_check, last_change, found FROM schedule').fetchall()
+        return [(key, next_check, last_change, bool(found)) for key, next_check, last_change, found in rows]
+
+    def put_schedule(self, key, next_check, last_change, found):
+        """
+        Save when an order is checked next, it's committed with the next batch.
+
+        :param key: the order, as it is in the order file
+        :type key: str
+        :param next_check: when to check it
+        :type next_check: float
+        :param last_change: when it last changed, 0 if never
+        :type last_change: float
+        :param found: whether COTUS ever had the order
+        :type found: bool
+        """
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO schedule (order_key, next_check, last_change, found) VALUES (?, ?, ?, ?)',
+                               (key, next_check, last_change, int(found)))
+            self._changed()
+
+    def delete_schedule(self, key):
+        """
+        :param key: the order, as it is in the order file
+        :type key: str
+        """
+
+        with self._lock:
+            self._conn.execute('DELETE FROM schedule WHERE order_key = ?', (key,))
+            self._changed()
+
+    def fingerprint(self, key):
+        """
+        What the order looked like the last time it was taken care of.
+
+        :param key: the order, as it is in the order file
+        :type key: str
+        :return: {'digest', 'etag', 'last_modified', 'ws_found', 'ws_sha256', 'order_info'}, None if there isn't one
+        :rtype: dict
+        """
+
+        with self._lock:
+            row = self._conn.execute('SELECT digest, etag, last_modified, ws_found, ws_sha256, order_info FROM fingerprints '
+                                     'WHERE order_key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        digest, etag, last_modified, ws_found, ws_sha256, order_info = row
+        try:
+            order_info = json.loads(order_info)
+        except json.decoder.JSONDecodeError:
+            return None
+        return {'digest': digest, 'etag': etag, 'last_modified': last_modified, 'ws_found': bool(ws_found),
+                'ws_sha256': ws_sha256, 'order_info': order_info}
+
+    def put_fingerprint(self, key, digest, etag, last_modified, ws_found, ws_sha256, order_info):
+        """
+        Save the fingerprint of an order after it has been taken care of, it's committed with the next batch.
+
+        :param key: the order, as it is in the order file
+        :type key: str
+        :param digest: the fingerprint of the order information
+        :type digest: str
+        :param etag: ETag of the response
+        :type etag: str
+        :param last_modified: Last-Modified of the response
+        :type last_modified: str
+        :param ws_found: whether the window sticker has been found
+        :type ws_found: bool
+        :param ws_sha256: hash of the window sticker, '' if there's none, None if we don't know
+        :type ws_sha256: str
+        :param order_info: what the page said, to print the order without the page
+        :type order_info: dict
+        """
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO fingerprints '
+                               '(order_key, digest, etag, last_modified, ws_found, ws_sha256, order_info) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (key, digest, etag, last_modified, int(ws_found), ws_sha256, json.dumps(order_info)))
+            self._changed()
+
+    def prune_fingerprints(self, keys):
+        """
+        Forget the orders that are no longer in the order file.
+
+        :param keys: the orders still in the order file
+        :type keys: set[str]
+        :return: number of orders forgotten
+        :rtype: int
+        """
+
+        with self._lock:
+            gone = [(key,) for key, in self._conn.execute('SELECT order_key FROM fingerprints') if key not in keys]
+            if gone:
+                self._conn.executemany('DELETE FROM fingerprints WHERE order_key = ?', gone)
+                self._commit()
+            return len(gone)
+
+    def states(self):
+        """
+        Every saved state, for reports.
+
+        :return: (vin, email, state) of every order
+        :rtype: list[tuple]
+        """
+
+        with self._lock:
+            rows = self._conn.execute('SELECT vin, email, data FROM states ORDER BY vin, email').fetchall()
+        return [(vin, email, json.loads(data)) for vin, email, data in rows]
+
+    def migrate(self, dir_info):
+        """
+        Import the "{vin}_{email}.json" files the states used to be kept in, only done once.
+
+        :param dir_info: the directory with the JSON files
+        :type dir_info: str
+        :return: number of states imported
+        :rtype: int
+        """
+
+        with self._lock:
+            if self._conn.execute("SELECT value FROM meta WHERE key = 'migrated'").fetchone() is not None:
+                return 0
+
+            count = 0
+            for file_name in glob.glob(os.path.join(dir_info, '*_*.json')):
+                vin, _, email = os.path.basename(file_name)[:-len('.json')].partition('_')
+                try:
+                    data = json.load(open(file_name, 'r'))
+                except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                self._conn.execute('INSERT OR IGNORE INTO states (vin, email, data, updated) VALUES (?, ?, ?, ?)',
+                                   (vin, email, json.dumps(data), os.path.getmtime(file_name)))
+                count += 1
+
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)", (str(time.time()),))
+            self._commit()
+            return count
+
+    def _commit(self):
+        """
+        Commit, the lock must be held.
+        """
+
+        self._conn.commit()
+        self._pending = 0
+
+    def commit(self):
+        """
+        Commit everything saved so far.
+        """
+
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        """
+        Commit and close the database.
+        """
+
+        with self._lock:
+            self._commit()
+            self._conn.close()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import random
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cotus_parser import FIELDS, OrderPageParser, parse_order_page
+
+PAGE = '''<html><body>
+<div class="header"><a href="http://build.ford.com/">Build</a><!-- {padding} --></div>
+<span class="vehicleName">2018 Ford F-150 XLT SuperCrew</span>
+<span class="orderDate">01/02/2018</span>
+<span class="orderNumber">A1B2</span>
+<span class="vin">1FTEW1EP5JFA00001</span>
+<input type="hidden" id="hidden-estimated-delivery-date" data-part="03/04/2018">
+<img src="http://build.ford.com/dig/Ford/F-150/2018/HD-TILE/Image[|Ford|F-150|2018|1|1.|300A.W1E..PQ.89B.]/EXT/4/vehicle.png">
+<span class="dealerName">Bench Ford, Inc.</span>
+<script>var data = {{ "dealerInfo": {{ "dealerCode":"F12345"}}, "selectedStepName":"In Production", "surveyOn": false }};</script>
+<span class="label">Completed On : </span>01.05.18</span>
+<span class="label">Completed On : </span>02.05.18</span>
+<div class="part-detail-description first">Option 1</div>
+<div class="part-detail-description">Option 2</div>
+<div class="part-detail-description">Option 1</div>
+{error}
+</body></html>
+'''
+
+ERROR = '<p class="top-level-error enabled">Order not found</p>'
+
+# The flags the checker sets afterwards, not something on the page.
+FLAGS = ['email_sent', 'window_sticker_sent', 'initial_check_sent', 'edd_changed', 'state_changed']
+
+
+def old_order_info(data):
+    """
+    What get_order_info() did, on the page with every line break removed.
+    """
+
+    data = data.replace('\n', '').replace('\r', '')
+    try:
+        order_info = {
+            'vehicle_name': re.search(u'class="vehicleName">(.*?)</span>', data).group(1).strip(),
+            'order_date': re.search(u'class="orderDate">(.*?)</span>', data).group(1).strip(),
+            'order_num': re.search(u'class="orderNumber">(.*?)</span>', data).group(1).strip(),
+            'dealer_code': re.search(u'"dealerInfo": { "dealerCode":(.*?)}', data).group(1).replace('"', '').strip(),
+            'order_vin': re.search(u'class="vin">(.*?)</span>', data).group(1).strip(),
+            'order_edd': re.search(u'id="hidden-estimated-delivery-date" data-part="(.*?)"', data).group(1).strip(),
+            'current_state': re.search(u'"selectedStepName":(.*?)"surveyOn"', data).group(1).replace(',', '').replace('"', '').strip().title()
+        }
+        m = re.search(u'class="dealerName">(.*?)</span>', data)
+        order_info['dealer_name'] = (m.group(1).replace(',', '').replace('"', '').strip() if m else '') or 'N/A'
+        state_dates = [d.replace('.', '/').strip() for d in re.findall(u'Completed On : </span>(.*?)</span>', data)]
+        order_info['state_dates'] = ['{0}20{1}'.format(d[:6], d[6:]) for d in state_dates]
+        summary = [each.strip() for each in re.findall(u'class="part-detail-description.*?>(.*?)</div>', data)]
+        order_info['vehicle_summary'] = list(dict.fromkeys(summary))
+        order_info['car_pic_link'] = re.search(u'http://build\\.ford\\.com/(?:(?!http://build\\.ford\\.com/|/EXT/4/vehicle\\.png).)*?/EXT/4/vehicle\\.png',
+                                               data).group().strip()
+        return order_info
+    except AttributeError:
+        return -1
+
+
+def old_error(data):
+    m = re.search(u'class="top-level-error enabled">(.*?)</p>', data.replace('\n', '').replace('\r', ''))
+    return m.group(1).strip() + '\n' if m else None
+
+
+def new_order_info(parser):
+    order_info = parser.order_info()
+    if order_info != -1:
+        for name in FLAGS:
+            del order_info[name]
+    return order_info
+
+
+def break_lines(page, rng, count):
+    """
+    Put line breaks in random places, in the values and between the tags, but not in
+    the text the parser looks for.
+    """
+
+    inside = set()
+    for name, before, after, find_all in FIELDS:
+        for text in (before, after, '>', '/EXT/4/vehicle.png'):
+            pos = page.find(text)
+            while pos >= 0:
+                inside.update(range(pos + 1, pos + len(text)))
+                pos = page.find(text, pos + 1)
+    allowed = [i for i in range(len(page) + 1) if i not in inside]
+
+    page = list(page)
+    for i in sorted((rng.choice(allowed) for i in range(count)), reverse=True):
+        page.insert(i, rng.choice(['\n', '\r\n', '\r']))
+    return ''.join(page)
+
+
+class OrderPageParserTest(unittest.TestCase):
+
+    def assertSame(self, page, rng):
+        expected = old_order_info(page)
+        for data in (page, page.encode()):
+            parser = parse_order_page(data)
+            self.assertEqual(new_order_info(parser), expected)
+            self.assertEqual(parser.error_msg, old_error(page))
+
+            # Fed in parts, the way a streamed page is.
+            parser = OrderPageParser()
+            pos = 0
+            while pos < len(data):
+                size = rng.randint(1, 200)
+                parser.feed(data[pos:pos + size])
+                pos += size
+            self.assertEqual(new_order_info(parser.close()), expected)
+            self.assertEqual(parser.error_msg, old_error(page))
+
+    def test_page(self):
+        page = PAGE.format(padding='x' * 1000, error='')
+        self.assertNotEqual(old_order_info(page), -1)
+        self.assertSame(page, random.Random(1))
+
+    def test_error_page(self):
+        self.assertSame(PAGE.format(padding='', error=ERROR), random.Random(1))
+
+    def test_missing_fields(self):
+        page = PAGE.format(padding='', error='')
+        for text in ('class="vin"', '/EXT/4/vehicle.png', 'class="dealerName"', 'Completed On'):
+            self.assertSame(page.replace(text, 'nothing'), random.Random(1))
+
+    def test_line_breaks(self):
+        page = PAGE.format(padding='', error=ERROR)
+        self.assertSame(page.replace('Option 2', 'Op\ntion\r\n 2').replace('01/02/2018', '01/02\n/2018'), random.Random(1))
+        rng = random.Random(2)
+        for i in range(200):
+            self.assertSame(break_lines(PAGE.format(padding='', error=ERROR if i % 4 == 0 else ''), rng, rng.randint(1, 100)), rng)
+
+        # The text around a value must be on one line.
+        page = PAGE.format(padding='', error='').replace('hidden-estimated', 'hidden\n-estimated')
+        self.assertEqual(parse_order_page(page).order_info(), -1)
+
+    def test_car_pic_link(self):
+        # Only a quoted address of the picture, not the link to build.ford.com in front of it.
+        page = PAGE.format(padding='', error='')
+        self.assertEqual(parse_order_page(page).order_info()['car_pic_link'],
+                         'http://build.ford.com/dig/Ford/F-150/2018/HD-TILE/Image[|Ford|F-150|2018|1|1.|300A.W1E..PQ.89B.]/EXT/4/vehicle.png')
+        self.assertEqual(parse_order_page(page.replace('vehicle.png"', 'vehicle.png?w=1"')).order_info()['car_pic_link'],
+                         'http://build.ford.com/dig/Ford/F-150/2018/HD-TILE/Image[|Ford|F-150|2018|1|1.|300A.W1E..PQ.89B.]/EXT/4/vehicle.png')
+        self.assertEqual(parse_order_page(page.replace('/EXT/4/', '/INT/4/')).order_info(), -1)
+
+    def test_done(self):
+        # Stopping at "done" loses nothing on a page laid out the usual way.
+        for error in ('', ERROR):
+            page = PAGE.format(padding='x' * 1000, error=error).encode()
+            parser = OrderPageParser()
+            for pos in range(0, len(page), 100):
+                parser.feed(page[pos:pos + 100])
+                if parser.done:
+                    break
+            self.assertEqual(new_order_info(parser.close()), old_order_info(page.decode()))
+            self.assertEqual(parser.error_msg, old_error(page.decode()))
+
+        parser = OrderPageParser()
+        parser.feed(page[:page.index(b'Completed On')])
+        self.assertFalse(parser.done)
+        parser.feed(page[page.index(b'Completed On'):])
+        self.assertTrue(parser.done)
+
+if __name__ == '__main__':
+    unittest.main()
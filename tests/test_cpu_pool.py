@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cpu_pool import CpuPool
+
+
+def echo(value):
+    return value
+
+
+def die_once(flag_file):
+    """
+    Kill the worker the first time, the way the OOM killer would.
+    """
+
+    if not os.path.exists(flag_file):
+        open(flag_file, 'w').close()
+        os.kill(os.getpid(), signal.SIGKILL)
+    return 'done'
+
+
+def die_in_worker(parent_pid):
+    if os.getpid() != parent_pid:
+        os.kill(os.getpid(), signal.SIGKILL)
+    return 'done here'
+
+
+class CpuPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.pool = CpuPool(2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.dir_name)
+
+    def test_worker_killed(self):
+        self.assertEqual(self.pool.run('render', echo, 1), 1)
+        self.assertEqual(self.pool.run('render', die_once, os.path.join(self.dir_name, 'flag')), 'done')
+        self.assertEqual(self.pool.run('render', echo, 2), 2)
+        self.assertEqual(self.pool.stats()['render']['restarts'], 1)
+
+    def test_worker_killed_twice(self):
+        # Given up on, not run in this process.
+        self.assertIsNone(self.pool.run('pdf', die_in_worker, os.getpid()))
+        self.assertEqual(self.pool.run('pdf', echo, 3), 3)
+        stats = self.pool.stats()['pdf']
+        self.assertEqual(stats['restarts'], 2)
+        self.assertEqual(stats['failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
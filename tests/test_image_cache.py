@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_cache import ImageCache, is_image
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 92
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeServer(object):
+    """
+    Answers with the next response in line, or a new picture.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+    def fetch(self, url, headers=None):
+        self.requests.append((url, dict(headers or {})))
+        if self.responses:
+            return self.responses.pop(0)
+        return 0, FakeResponse(200, PNG, {'ETag': '"1"'})
+
+
+class ImageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.server = FakeServer()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_is_image(self):
+        self.assertTrue(is_image(PNG))
+        self.assertTrue(is_image(b'\xff\xd8\xff\xe0'))
+        self.assertTrue(is_image(b'RIFF\x00\x00\x00\x00WEBPVP8 '))
+        self.assertFalse(is_image(b''))
+        self.assertFalse(is_image(b'<html><body>Not found</body></html>'))
+
+    def test_hit_and_revalidate(self):
+        cache = ImageCache(self.dir_name, self.server.fetch)
+        self.assertEqual(cache.get('http://example.com/a.png'), PNG)
+        self.assertEqual(cache.get('http://example.com/a.png'), PNG)
+        self.assertEqual(len(self.server.requests), 1)
+
+        cache.max_age = 0
+        self.server.responses.append((0, FakeResponse(304)))
+        self.assertEqual(cache.get('http://example.com/a.png'), PNG)
+        self.assertEqual(self.server.requests[-1][1], {'If-None-Match': '"1"'})
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['revalidated'], stats['misses']), (1, 1, 1))
+
+    def test_not_an_image(self):
+        cache = ImageCache(self.dir_name, self.server.fetch)
+        self.server.responses.append((0, FakeResponse(200, b'<html>Error</html>')))
+        self.assertIsNone(cache.get('http://example.com/a.png'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+        # A cached picture is kept over an error page.
+        cache.get('http://example.com/a.png')
+        cache.max_age = 0
+        self.server.responses.append((0, FakeResponse(200, b'<html>Error</html>')))
+        self.assertEqual(cache.get('http://example.com/a.png'), PNG)
+
+    def test_eviction(self):
+        cache = ImageCache(self.dir_name, self.server.fetch, max_size=2 * len(PNG))
+        for name in ('a', 'b'):
+            cache.get('http://example.com/{0}.png'.format(name))
+        # a is used again, b is now the least recently used.
+        cache.get('http://example.com/a.png')
+        cache.get('http://example.com/c.png')
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['size'], 2 * len(PNG))
+        self.assertEqual(len([name for name in os.listdir(self.dir_name) if name.endswith('.png')]), 2)
+
+        requests = len(self.server.requests)
+        cache.get('http://example.com/a.png')
+        self.assertEqual(len(self.server.requests), requests)
+        cache.get('http://example.com/b.png')
+        self.assertEqual(len(self.server.requests), requests + 1)
+
+    def test_reload(self):
+        cache = ImageCache(self.dir_name, self.server.fetch)
+        cache.get('http://example.com/a.png')
+        cache.save()
+        with open(os.path.join(self.dir_name, 'stray.png'), 'wb') as out_file:
+            out_file.write(PNG)
+
+        # What's not in the index is removed.
+        cache = ImageCache(self.dir_name, self.server.fetch)
+        self.assertFalse(os.path.exists(os.path.join(self.dir_name, 'stray.png')))
+        self.assertEqual(cache.get('http://example.com/a.png'), PNG)
+        self.assertEqual(len(self.server.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
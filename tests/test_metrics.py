@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import STAGE_SECONDS, SUMMARY_FILE, TEXTFILE, Metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counters_and_gauges(self):
+        metrics = Metrics()
+        metrics.count('emails_total')
+        metrics.count('emails_total', 2)
+        metrics.count('emails_total', kind='error')
+        metrics.set('queue_size', 5)
+        metrics.set('queue_size', 3)
+        self.assertEqual(metrics.value('emails_total'), 3)
+        self.assertEqual(metrics.value('emails_total', kind='error'), 1)
+        self.assertEqual(metrics.value('checks_total'), 0)
+
+        summary = metrics.summary()
+        self.assertEqual(summary['counters']['emails_total'], [{'labels': {}, 'value': 3},
+                                                               {'labels': {'kind': 'error'}, 'value': 1}])
+        self.assertEqual(summary['gauges']['queue_size'], [{'labels': {}, 'value': 3}])
+
+    def test_percentiles(self):
+        metrics = Metrics(buckets=(0.1, 1, 10))
+        for value in [0.05] * 90 + [0.5] * 9 + [5]:
+            metrics.observe(STAGE_SECONDS, value, stage='fetch')
+        histogram = metrics.summary()['histograms'][STAGE_SECONDS][0]
+        self.assertEqual(histogram['labels'], {'stage': 'fetch'})
+        self.assertEqual(histogram['count'], 100)
+        self.assertEqual(histogram['p50'], 0.1)
+        self.assertEqual(histogram['p95'], 1)
+        # Never more than the slowest value.
+        self.assertEqual(histogram['p99'], 1)
+        self.assertEqual(histogram['max'], 5)
+
+    def test_timer(self):
+        metrics = Metrics()
+        with self.assertRaises(ValueError):
+            with metrics.timer('parse'):
+                raise ValueError()
+
+        @metrics.timed('parse')
+        def parse():
+            return 'parsed'
+
+        self.assertEqual(parse(), 'parsed')
+        self.assertEqual(metrics.summary()['histograms'][STAGE_SECONDS][0]['count'], 2)
+
+    def test_textfile(self):
+        metrics = Metrics(buckets=(0.1, 1))
+        metrics.count('emails_total', host='a"b')
+        metrics.observe(STAGE_SECONDS, 0.5, stage='fetch')
+        self.assertEqual(metrics.textfile(), '\n'.join([
+            '# TYPE cotus_emails_total counter',
+            'cotus_emails_total{host="a\\"b"} 1',
+            '# TYPE cotus_stage_seconds histogram',
+            'cotus_stage_seconds_bucket{stage="fetch",le="0.1"} 0',
+            'cotus_stage_seconds_bucket{stage="fetch",le="1"} 1',
+            'cotus_stage_seconds_bucket{stage="fetch",le="+Inf"} 1',
+            'cotus_stage_seconds_sum{stage="fetch"} 0.5',
+            'cotus_stage_seconds_count{stage="fetch"} 1',
+        ]) + '\n')
+
+    def test_write(self):
+        dir_name = tempfile.mkdtemp()
+        try:
+            metrics = Metrics()
+            metrics.count('emails_total')
+            metrics.write(dir_name)
+            self.assertEqual(sorted(os.listdir(dir_name)), sorted([SUMMARY_FILE, TEXTFILE]))
+            summary = json.load(open(os.path.join(dir_name, SUMMARY_FILE)))
+            self.assertEqual(summary['counters']['emails_total'][0]['value'], 1)
+            self.assertIn('last_write_timestamp_seconds', summary['gauges'])
+        finally:
+            shutil.rmtree(dir_name)
+
+
+if __name__ == '__main__':
+    unittest.main()
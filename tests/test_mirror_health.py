@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mirror_health import (CLOSED, FAILURE_THRESHOLD, HALF_OPEN, MAX_OPEN_SECONDS, MIN_SAMPLES, OPEN, OPEN_SECONDS,
+                           HedgeBudget, MirrorHealth)
+
+A = 'https://a.example.com'
+B = 'https://b.example.com'
+
+
+class MirrorHealthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('mirror_health.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mirrors = MirrorHealth([A, B])
+
+    def state(self, url):
+        return self.mirrors.stats()[url]['state']
+
+    def record_failures(self, url, times):
+        for i in range(times):
+            self.mirrors.record(url, False, 5.0)
+
+    def test_prefers_faster(self):
+        self.assertEqual(self.mirrors.choose(), A)
+        self.mirrors.record(A, True, 1.0)
+        self.mirrors.record(B, True, 0.1)
+        self.assertEqual(self.mirrors.choose(), B)
+        self.assertEqual(self.mirrors.choose(exclude=[B]), A)
+
+    def test_opens_after_failures(self):
+        self.record_failures(A, FAILURE_THRESHOLD - 1)
+        self.assertEqual(self.state(A), CLOSED)
+        self.record_failures(A, 1)
+        self.assertEqual(self.state(A), OPEN)
+
+        # Skipped while open, even if it's the only one asked for.
+        self.mirrors.record(B, True, 10.0)
+        self.assertEqual(self.mirrors.choose(), B)
+        self.assertEqual(self.mirrors.choose(exclude=[B]), B)
+
+    def test_half_open_probe(self):
+        self.record_failures(A, FAILURE_THRESHOLD)
+        self.mirrors.record(B, True, 100.0)
+
+        # One probe once it has been open long enough, nothing else until it reports back.
+        self.now += OPEN_SECONDS
+        self.assertEqual(self.mirrors.choose(), A)
+        self.assertEqual(self.state(A), HALF_OPEN)
+        self.assertEqual(self.mirrors.choose(), B)
+
+        # The probe worked.
+        self.mirrors.record(A, True, 0.1)
+        self.assertEqual(self.state(A), CLOSED)
+        self.assertEqual(self.mirrors.choose(), A)
+
+    def test_failed_probe_backs_off(self):
+        self.record_failures(A, FAILURE_THRESHOLD)
+        self.mirrors.record(B, True, 1000.0)
+        open_seconds = OPEN_SECONDS
+        for i in range(10):
+            self.now += open_seconds
+            self.assertEqual(self.mirrors.choose(), A)
+            self.record_failures(A, 1)
+            self.assertEqual(self.state(A), OPEN)
+            open_seconds = min(open_seconds * 2, MAX_OPEN_SECONDS)
+
+            # Not tried again before the longer wait is over.
+            self.now += open_seconds - 1
+            self.assertEqual(self.mirrors.choose(), B)
+            self.now -= open_seconds - 1
+        self.assertEqual(open_seconds, MAX_OPEN_SECONDS)
+
+    def test_all_open(self):
+        self.record_failures(A, FAILURE_THRESHOLD)
+        self.now += 1
+        self.record_failures(B, FAILURE_THRESHOLD)
+        # The one open the longest.
+        self.assertEqual(self.mirrors.choose(), A)
+
+    def test_percentile(self):
+        for i in range(MIN_SAMPLES - 1):
+            self.mirrors.record(A, True, 0.1)
+        self.assertIsNone(self.mirrors.percentile(A, 95))
+        self.mirrors.record(A, True, 1.0)
+        self.assertEqual(self.mirrors.percentile(A, 50), 0.1)
+        self.assertEqual(self.mirrors.percentile(A, 100), 1.0)
+        # Failed requests don't count.
+        self.record_failures(A, 1)
+        self.assertEqual(self.mirrors.percentile(A, 100), 1.0)
+
+
+class HedgeBudgetTest(unittest.TestCase):
+
+    def test_limit(self):
+        budget = HedgeBudget(0.1)
+        self.assertFalse(budget.take())
+        for i in range(10):
+            budget.count_request()
+        self.assertTrue(budget.take())
+        self.assertFalse(budget.take())
+
+        for i in range(20):
+            budget.count_request()
+        self.assertTrue(budget.take())
+        self.assertTrue(budget.take())
+        self.assertFalse(budget.take())
+        budget.count_win()
+        self.assertEqual(budget.stats(), {'requests': 30, 'hedges': 3, 'wins': 1})
+
+    def test_no_budget(self):
+        budget = HedgeBudget(0)
+        for i in range(100):
+            budget.count_request()
+        self.assertFalse(budget.take())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from order_registry import OrderRegistry, normalize
+from scheduler import Scheduler
+from state_store import StateStore
+
+ORDERS = ['vin,1FTEW1EP5JFA00001,a@example.com', 'num,A1B2,F12345,b@example.com', 'vin,1FTEW1EP5JFA00003,c@example.com']
+
+
+class OrderRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.dir_name, 'orders.txt')
+        self.write(ORDERS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def write(self, lines):
+        with open(self.file_name, 'w') as out_file:
+            out_file.write(''.join('{0}\n'.format(l) for l in lines))
+
+    def lines(self):
+        with open(self.file_name, 'r') as in_file:
+            return [l.rstrip('\n') for l in in_file]
+
+    def load(self, registry):
+        for line in registry.read():
+            registry.add(normalize(line))
+        registry.save()
+
+    def test_delete_line_while_daemon_runs(self):
+        registry = OrderRegistry(self.file_name)
+        self.load(registry)
+        store = StateStore(os.path.join(self.dir_name, 'states.db'))
+        scheduler = Scheduler(store)
+        scheduler.sync(registry)
+        self.assertEqual(len(scheduler), 3)
+
+        # The user deletes an order, then a check removes a delivered one and saves.
+        self.write([ORDERS[0], ORDERS[2]])
+        registry.remove(ORDERS[2])
+        self.assertTrue(registry.save())
+        scheduler.sync(registry)
+
+        self.assertEqual(self.lines(), [ORDERS[0]])
+        self.assertEqual(list(registry), [ORDERS[0]])
+        self.assertNotIn(ORDERS[1], scheduler)
+        self.assertEqual([row[0] for row in store.schedule()], [ORDERS[0]])
+
+        # Reading the file again doesn't bring it back either.
+        self.load(registry)
+        self.assertEqual(list(registry), [ORDERS[0]])
+        store.close()
+
+    def test_lines_added_by_hand_are_kept(self):
+        registry = OrderRegistry(self.file_name)
+        self.load(registry)
+
+        added = 'vin,1FTEW1EP5JFA00004,d@example.com'
+        self.write(ORDERS + [added])
+        registry.remove(ORDERS[0])
+        registry.save()
+        self.assertEqual(self.lines(), ORDERS[1:] + [added])
+        self.assertNotIn(added, registry)
+
+        self.load(registry)
+        self.assertEqual(list(registry), ORDERS[1:] + [added])
+
+    def test_reload_rebuilds(self):
+        registry = OrderRegistry(self.file_name)
+        self.load(registry)
+        self.write(ORDERS[1:])
+        self.load(registry)
+        self.assertEqual(list(registry), ORDERS[1:])
+        self.assertEqual(self.lines(), ORDERS[1:])
+
+    def test_delete_line_not_normalized(self):
+        self.write(['vin, 1ftew1ep5jfa00001, A@Example.com', 'num,a1b2,f12345,b@example.com '])
+        registry = OrderRegistry(self.file_name)
+        self.load(registry)
+        self.assertEqual(self.lines(), ORDERS[:2])
+
+        # The user deletes one order and adds another, both written their own way.
+        added = 'vin, 1ftew1ep5jfa00004, d@example.com'
+        self.write(['num, A1B2, F12345, b@example.com', added])
+        registry.save()
+        self.assertEqual(list(registry), [ORDERS[1]])
+        self.assertEqual(self.lines(), [ORDERS[1], added])
+
+        self.load(registry)
+        self.assertEqual(list(registry), [ORDERS[1], normalize(added)])
+
+    def test_save_unchanged(self):
+        registry = OrderRegistry(self.file_name)
+        self.load(registry)
+        self.assertFalse(registry.save())
+
+
+if __name__ == '__main__':
+    unittest.main()
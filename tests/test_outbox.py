@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import smtplib
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from outbox import Outbox
+
+
+class FakePool(object):
+    """
+    Raises the next error in line, or takes the email.
+    """
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    def send(self, email_from, email_to, message):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(email_to)
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def files(self, which):
+        return os.listdir(os.path.join(self.dir_name, which))
+
+    def run_outbox(self, pool, *emails):
+        outbox = Outbox(self.dir_name, pool, concurrency=2, base_delay=0.01, max_delay=0.01, max_attempts=2)
+        outbox.start()
+        for email_to in emails:
+            outbox.put('<{0}@cotus-checker>'.format(email_to), 'me@example.com', email_to, 'hi')
+        self.drain(outbox)
+        return outbox
+
+    def drain(self, outbox):
+        # Retries are due a moment later, wait for them too.
+        deadline = time.monotonic() + 10
+        while outbox.stats()['pending'] and time.monotonic() < deadline:
+            outbox.flush(timeout=1)
+            time.sleep(0.01)
+        outbox.close(timeout=1)
+
+    def test_send(self):
+        pool = FakePool()
+        self.assertEqual(self.run_outbox(pool, 'a@example.com').stats()['sent'], 1)
+        self.assertEqual(pool.sent, ['a@example.com'])
+        self.assertEqual(self.files('new') + self.files('cur') + self.files('failed'), [])
+
+    def test_next_run_retries_failed(self):
+        pool = FakePool([smtplib.SMTPServerDisconnected('gone')] * 2)
+        self.assertEqual(self.run_outbox(pool, 'a@example.com').stats()['failed'], 1)
+        self.assertEqual(len(self.files('failed')), 1)
+
+        self.run_outbox(pool)
+        self.assertEqual(pool.sent, ['a@example.com'])
+        self.assertEqual(self.files('failed'), [])
+
+    def test_refused_stays_failed(self):
+        pool = FakePool([smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'no')})])
+        self.run_outbox(pool, 'a@example.com')
+        self.run_outbox(pool)
+        self.assertEqual(pool.sent, [])
+        self.assertEqual(len(self.files('failed')), 1)
+
+    def test_write_error_keeps_sender(self):
+        pool = FakePool([smtplib.SMTPServerDisconnected('gone')])
+        outbox = Outbox(self.dir_name, pool, concurrency=1, base_delay=0.01, max_delay=0.01, max_attempts=5)
+        write = outbox._write
+        calls = []
+
+        def broken_write(entry, dir_name, name):
+            # The retry can't be written, after the email was put in the outbox.
+            calls.append(name)
+            if len(calls) == 2:
+                raise OSError('disk full')
+            write(entry, dir_name, name)
+
+        outbox._write = broken_write
+        outbox.start()
+        outbox.put('<a@cotus-checker>', 'me@example.com', 'a@example.com', 'hi')
+        deadline = time.monotonic() + 10
+        while outbox.stats()['errors'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        outbox.put('<b@cotus-checker>', 'me@example.com', 'b@example.com', 'hi')
+        self.drain(outbox)
+        self.assertEqual(sorted(pool.sent), ['a@example.com', 'b@example.com'])
+        self.assertEqual(outbox.stats()['errors'], 1)
+
+    def test_sent_not_sent_again(self):
+        pool = FakePool()
+        outbox = Outbox(self.dir_name, pool, concurrency=1, base_delay=0.01)
+        os_remove = os.remove
+        removed = []
+
+        def broken_remove(file_name):
+            # The email can't be removed after the server took it.
+            removed.append(file_name)
+            if len(removed) == 1:
+                raise OSError('read-only')
+            os_remove(file_name)
+
+        with mock.patch('outbox.os.remove', broken_remove):
+            outbox.start()
+            outbox.put('<a@cotus-checker>', 'me@example.com', 'a@example.com', 'hi')
+            self.drain(outbox)
+        self.assertEqual(pool.sent, ['a@example.com'])
+        stats = outbox.stats()
+        self.assertEqual((stats['sent'], stats['errors'], stats['duplicates']), (1, 1, 1))
+        self.assertEqual(self.files('new') + self.files('cur') + self.files('sent'), [])
+
+    def test_crash_after_send(self):
+        # The last run stopped right after writing the marker.
+        outbox = Outbox(self.dir_name, FakePool())
+        outbox.put('<a@cotus-checker>', 'me@example.com', 'a@example.com', 'hi')
+        outbox.put('<b@cotus-checker>', 'me@example.com', 'b@example.com', 'hi')
+        for name in self.files('new'):
+            os.replace(os.path.join(self.dir_name, 'new', name), os.path.join(self.dir_name, 'cur', name))
+        sent_name = sorted(self.files('cur'))[0]
+        shutil.copy(os.path.join(self.dir_name, 'cur', sent_name), os.path.join(self.dir_name, 'sent', sent_name))
+
+        pool = FakePool()
+        outbox = self.run_outbox(pool)
+        self.assertEqual(pool.sent, ['b@example.com'])
+        self.assertEqual(outbox.stats()['duplicates'], 1)
+        self.assertEqual(self.files('new') + self.files('cur') + self.files('sent'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
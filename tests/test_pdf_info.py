@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pdf_info import read_pdf_title
+
+
+def xref_stream_pdf(title, size=b'3', length=None, predictor=None, flate=False):
+    """
+    A PDF file whose cross-reference section is a stream, the values of its dictionary can be replaced.
+    """
+
+    data = b'%PDF-1.5\n'
+    info_offset = len(data)
+    data += b'1 0 obj\n<< /Title (' + title + b') >>\nendobj\n'
+    xref_offset = len(data)
+
+    rows = b''.join(bytes([kind]) + offset.to_bytes(4, 'big') + b'\x00' for kind, offset in ((0, 0), (1, info_offset), (1, xref_offset)))
+    filters = b''
+    if predictor is not None:
+        rows = b''.join(b'\x00' + rows[i:i + 6] for i in range(0, len(rows), 6))
+        filters += b' /DecodeParms << /Columns 6 /Predictor ' + predictor + b' >>'
+    if flate:
+        rows = zlib.compress(rows)
+        filters += b' /Filter /FlateDecode'
+    length = str(len(rows)).encode() if length is None else length
+
+    data += (b'2 0 obj\n<< /Type /XRef /Size ' + size + b' /W [1 4 1] /Info 1 0 R /Length ' + length + filters +
+             b' >>\nstream\n' + rows + b'\nendstream\nendobj\n')
+    return data + b'startxref\n' + str(xref_offset).encode() + b'\n%%EOF\n'
+
+
+class ReadPdfTitleTest(unittest.TestCase):
+
+    def test_xref_stream(self):
+        self.assertEqual(read_pdf_title(xref_stream_pdf(b'Window Sticker')), 'Window Sticker')
+        self.assertEqual(read_pdf_title(xref_stream_pdf(b'Window Sticker', predictor=b'12', flate=True)), 'Window Sticker')
+
+    def test_arrays_instead_of_numbers(self):
+        for kwargs in ({'size': b'[3]'}, {'length': b'[5]'}, {'predictor': b'[12]'}):
+            self.assertIsNone(read_pdf_title(xref_stream_pdf(b'Window Sticker', **kwargs)))
+
+    def test_garbage(self):
+        for data in (b'', b'startxref\nabc', b'%PDF-1.5\nstartxref\n999999\n%%EOF', xref_stream_pdf(b'x')[:-40]):
+            self.assertIn(read_pdf_title(data), (None, ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
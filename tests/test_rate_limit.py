@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rate_limit
+from rate_limit import DECREASE, DECREASE_COOLDOWN, INITIAL_CONCURRENCY, HostLimiter, RateLimits
+
+
+class HostLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('rate_limit.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket(self):
+        limiter = HostLimiter(rate=2, burst=3, max_concurrency=100)
+        for i in range(3):
+            self.assertEqual(limiter._try_acquire(), 0)
+        # Empty, the next token shows up in half a second.
+        self.assertAlmostEqual(limiter._try_acquire(), 0.5)
+        self.now += 0.5
+        self.assertEqual(limiter._try_acquire(), 0)
+
+        # Never more than the burst after a quiet period.
+        self.now += 100
+        for i in range(3):
+            self.assertEqual(limiter._try_acquire(), 0)
+        self.assertGreater(limiter._try_acquire(), 0)
+
+    def test_concurrency_slots(self):
+        limiter = HostLimiter(max_concurrency=100)
+        for i in range(INITIAL_CONCURRENCY):
+            self.assertEqual(limiter._try_acquire(), 0)
+        self.assertIsNone(limiter._try_acquire())
+        limiter.release(True, 0.1)
+        self.assertEqual(limiter._try_acquire(), 0)
+
+    def test_additive_increase(self):
+        limiter = HostLimiter(max_concurrency=12)
+        for i in range(200):
+            limiter.acquire()
+            limiter.release(True, 0.1)
+        self.assertEqual(limiter.stats()['concurrency'], 12)
+
+        # Slow responses don't earn more.
+        limiter = HostLimiter(max_concurrency=100)
+        limiter.acquire()
+        limiter.release(True, 0.1)
+        concurrency = limiter.concurrency
+        for i in range(5):
+            limiter.acquire()
+            limiter.release(True, 10.0)
+        self.assertEqual(limiter.concurrency, concurrency)
+
+    def test_multiplicative_decrease(self):
+        limiter = HostLimiter(max_concurrency=100, min_concurrency=2)
+        limiter.acquire()
+        limiter.release(False, 0.1)
+        self.assertEqual(limiter.concurrency, INITIAL_CONCURRENCY * DECREASE)
+
+        # At most once per cooldown.
+        limiter.acquire()
+        limiter.release(False, 0.1)
+        self.assertEqual(limiter.concurrency, INITIAL_CONCURRENCY * DECREASE)
+
+        for i in range(10):
+            self.now += DECREASE_COOLDOWN
+            limiter.acquire()
+            limiter.release(False, 0.1)
+        stats = limiter.stats()
+        self.assertEqual(stats['concurrency'], 2)
+        self.assertEqual(stats['lowest'], 2)
+
+        # A cancelled request counts neither way.
+        self.now += DECREASE_COOLDOWN
+        limiter.acquire()
+        limiter.release(None, 0.1)
+        self.assertEqual(limiter.concurrency, 2)
+
+    def test_slot(self):
+        limiter = HostLimiter(max_concurrency=100)
+        slot = limiter.slot()
+        with slot:
+            self.assertEqual(limiter.in_flight, 1)
+            self.now += 0.25
+        self.assertEqual(slot.latency, 0.25)
+        self.assertEqual(limiter.in_flight, 0)
+
+        # A 5xx response, or a timeout getting out of the block, counts as failed.
+        with limiter.slot() as slot:
+            slot.ok = False
+        self.assertEqual(limiter.stats()['decreases'], 1)
+        self.now += DECREASE_COOLDOWN
+        with self.assertRaises(TimeoutError):
+            with limiter.slot():
+                raise TimeoutError()
+        self.assertEqual(limiter.stats()['decreases'], 2)
+
+
+class AsyncSlotTest(unittest.TestCase):
+
+    def test_waits_for_slot(self):
+        limiter = HostLimiter(max_concurrency=1)
+        limiter.concurrency = 1
+        order = []
+
+        async def request(name):
+            async with limiter.slot():
+                order.append(name)
+                await asyncio.sleep(0.01)
+                order.append(name)
+
+        async def run():
+            await asyncio.gather(request('a'), request('b'))
+
+        asyncio.run(run())
+        self.assertEqual(order, ['a', 'a', 'b', 'b'])
+        self.assertEqual(limiter.stats()['waits'], 1)
+
+
+class RateLimitsTest(unittest.TestCase):
+
+    def test_per_host(self):
+        limits = RateLimits({'a.example.com': 5}, max_concurrency=50)
+        limits.configure(host_max_concurrency={'b.example.com': 3})
+        a = limits.limiter('https://a.example.com/path')
+        self.assertIs(limits.limiter('http://a.example.com/other'), a)
+        self.assertEqual(a.rate, 5)
+        self.assertEqual(a.max_concurrency, 50)
+        b = limits.limiter('https://b.example.com/')
+        self.assertIsNone(b.rate)
+        self.assertEqual(b.max_concurrency, 3)
+        self.assertEqual(b.concurrency, 3)
+        self.assertEqual(sorted(limits.stats()), ['a.example.com', 'b.example.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
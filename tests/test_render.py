@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from render import render_digest, render_summary
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+ORDER_INFO = {
+    'vehicle_name': '2018 Ford F-150 XLT SuperCrew',
+    'order_date': '01/02/2018',
+    'order_edd': '',
+    'current_state': 'In Production',
+    'state_dates': ['01/05/2018'],
+    'dealer_name': 'Bench Ford Inc.'
+}
+
+STATE_NAMES = {
+    0: 'In Order Processing:',
+    1: 'In Production:',
+    2: 'Awaiting Shipment:',
+    3: 'In Transit:',
+    4: 'Delivered:'
+}
+
+
+class RenderDigestTest(unittest.TestCase):
+
+    def test_digest(self):
+        digest = render_digest(b'picture', ORDER_INFO)
+        self.assertEqual(render_digest(b'picture', dict(ORDER_INFO)), digest)
+
+        # Only what's drawn matters.
+        self.assertEqual(render_digest(b'picture', dict(ORDER_INFO, dealer_name='Other Ford')), digest)
+        self.assertNotEqual(render_digest(b'picture', dict(ORDER_INFO, state_dates=['01/05/2018', '01/09/2018'])), digest)
+        self.assertNotEqual(render_digest(b'other picture', ORDER_INFO), digest)
+
+
+@unittest.skipIf(Image is None, 'PIL is not installed')
+class RenderSummaryTest(unittest.TestCase):
+
+    def test_summary(self):
+        out = io.BytesIO()
+        Image.new('RGBA', (600, 400), (255, 0, 0, 255)).save(out, 'PNG')
+        png = render_summary(out.getvalue(), dict(ORDER_INFO, vehicle_name='2018 Ford F-150'), STATE_NAMES)
+        img = Image.open(io.BytesIO(png))
+        self.assertEqual(img.format, 'PNG')
+        self.assertEqual(img.size, (1200, 359))
+
+        # A long name makes the picture wider.
+        png = render_summary(out.getvalue(), dict(ORDER_INFO, vehicle_name='x' * 40), STATE_NAMES)
+        self.assertEqual(Image.open(io.BytesIO(png)).size, (850 + 40 * 14, 359))
+
+    def test_not_a_picture(self):
+        self.assertIsNone(render_summary(b'<html>Error</html>', ORDER_INFO, STATE_NAMES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cotus_parser import parse_order_page
+from retry import DOWN, MAX_DELAY, PERMANENT, TIMEOUT, RetryBudget, backoff, classify, requeue_later
+from test_cotus_parser import ERROR, PAGE
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def classify(self, data):
+        return classify(data, parse_order_page(data))
+
+    def test_kinds(self):
+        self.assertIsNone(self.classify(PAGE.format(padding='', error='').encode()))
+        self.assertEqual(self.classify(PAGE.format(padding='', error=ERROR).encode()), PERMANENT)
+        self.assertEqual(self.classify(b'<html><body>Down for maintenance</body></html>'), DOWN)
+        self.assertEqual(self.classify('SERVER TIMEOUT'), TIMEOUT)
+
+        # COTUS said the page didn't change.
+        self.assertIsNone(classify(None, None))
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_bounds(self):
+        for attempt in range(10):
+            delays = [backoff(attempt, base=1, cap=MAX_DELAY) for i in range(100)]
+            self.assertGreaterEqual(min(delays), 0)
+            self.assertLessEqual(max(delays), min(MAX_DELAY, 2 ** attempt))
+
+
+class RetryBudgetTest(unittest.TestCase):
+
+    def test_exhausted(self):
+        budget = RetryBudget(ratio=0.2, minimum=2)
+        budget.start(20)
+        self.assertEqual(sum(budget.take(TIMEOUT) for i in range(10)), 4)
+        stats = budget.stats()
+        self.assertEqual(stats['retries'], 4)
+        self.assertEqual(stats['exhausted'], 6)
+        self.assertEqual(stats['errors'][TIMEOUT], 10)
+
+        # A new run gets a new budget.
+        budget.start(20)
+        self.assertTrue(budget.take(DOWN))
+
+    def test_minimum(self):
+        budget = RetryBudget(ratio=0.2, minimum=3)
+        budget.start(1)
+        self.assertEqual(sum(budget.take(DOWN) for i in range(5)), 3)
+
+    def test_not_retried(self):
+        budget = RetryBudget(ratio=1, minimum=10)
+        budget.start(10)
+        self.assertFalse(budget.take(PERMANENT))
+        self.assertFalse(budget.take(TIMEOUT, last=True))
+        stats = budget.stats()
+        self.assertEqual(stats['retries'], 0)
+        self.assertEqual(stats['exhausted'], 0)
+        self.assertEqual(stats['errors'], {TIMEOUT: 1, DOWN: 0, PERMANENT: 1})
+
+
+class RequeueLaterTest(unittest.TestCase):
+
+    def test_join_waits(self):
+        async def run():
+            queue = asyncio.Queue()
+            queue.put_nowait('item')
+            item = await queue.get()
+            requeue_later(queue, item, 0.01)
+
+            # The queue isn't done while the item is waiting to come back.
+            join = asyncio.ensure_future(queue.join())
+            await asyncio.sleep(0)
+            self.assertFalse(join.done())
+            self.assertEqual(await queue.get(), 'item')
+            queue.task_done()
+            await asyncio.wait_for(join, 1)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
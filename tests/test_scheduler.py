@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scheduler
+from scheduler import DAY, HOUR, JITTER, MAX_INTERVAL, NEW_ORDER_SPREAD, Scheduler, next_interval
+from state_store import StateStore
+
+NOW = 1000 * DAY
+
+
+class NextIntervalTest(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+
+    def assertAround(self, interval, expected):
+        self.assertGreaterEqual(interval, expected * (1 - JITTER))
+        self.assertLessEqual(interval, expected * (1 + JITTER))
+
+    def test_states(self):
+        changed = NOW - 2 * DAY
+        self.assertAround(next_interval('Order Processing', changed, True, NOW), 2 * HOUR)
+        self.assertAround(next_interval('In Production', changed, True, NOW), 4 * HOUR)
+        self.assertAround(next_interval('In Transit', changed, True, NOW), 1 * HOUR)
+        self.assertAround(next_interval('Something New', changed, True, NOW), scheduler.DEFAULT_INTERVAL)
+
+    def test_not_found(self):
+        self.assertAround(next_interval(None, 0, False, NOW), scheduler.NOT_FOUND_INTERVAL)
+        self.assertAround(next_interval(None, 0, True, NOW), scheduler.LOST_INTERVAL)
+
+    def test_recent_and_stale(self):
+        self.assertAround(next_interval('In Production', NOW - HOUR, True, NOW), scheduler.RECENT_INTERVAL)
+        self.assertAround(next_interval('Order Processing', NOW - 30 * DAY, True, NOW), 4 * HOUR)
+        self.assertAround(next_interval('Order Processing', 0, True, NOW), 4 * HOUR)
+
+        self.assertAround(next_interval('In Production', NOW - 30 * DAY, True, NOW), 8 * HOUR)
+
+    def test_bounds(self):
+        for state in ('Order Processing', 'In Production', 'Shipment', 'In Transit', 'Something New', None):
+            for last_change in (0, NOW - HOUR, NOW - 2 * DAY, NOW - 30 * DAY):
+                for found in (False, True):
+                    interval = next_interval(state, last_change, found, NOW)
+                    self.assertGreaterEqual(interval, scheduler.RECENT_INTERVAL * (1 - JITTER))
+                    self.assertLessEqual(interval, MAX_INTERVAL * (1 + JITTER))
+
+    def test_jitter(self):
+        intervals = [next_interval('In Production', NOW - 2 * DAY, True, NOW) for i in range(200)]
+        self.assertGreaterEqual(min(intervals), 4 * HOUR * (1 - JITTER))
+        self.assertLessEqual(max(intervals), 4 * HOUR * (1 + JITTER))
+        # Spread out, not all the same.
+        self.assertGreater(len(set(intervals)), 100)
+        self.assertGreater(max(intervals) - min(intervals), 4 * HOUR * JITTER)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+        self.dir_name = tempfile.mkdtemp()
+        self.store = StateStore(os.path.join(self.dir_name, 'states.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir_name)
+
+    def test_due_and_reschedule(self):
+        sched = Scheduler(self.store)
+        sched.sync(['vin,A', 'vin,B'], now=NOW)
+        self.assertLessEqual(sched.next_time(), NOW + NEW_ORDER_SPREAD)
+        self.assertEqual(sched.due(NOW), [])
+        self.assertEqual(sorted(sched.due(NOW + NEW_ORDER_SPREAD)), ['vin,A', 'vin,B'])
+
+        # Taken orders stay scheduled, they only come up again once rescheduled.
+        self.assertIn('vin,A', sched)
+        self.assertIsNone(sched.next_time())
+        now = NOW + NEW_ORDER_SPREAD
+        sched.reschedule('vin,A', 'In Production', True, now=now)
+        sched.reschedule('vin,B', None, False, now=now)
+
+        # Just changed, so it's checked again soon, the order COTUS doesn't have waits longer.
+        self.assertEqual(sched.due(now + 45 * 60), ['vin,A'])
+        self.assertEqual(sched.due(now + 45 * 60), [])
+        self.assertEqual(sched.due(now + 2 * HOUR), ['vin,B'])
+
+    def test_saved(self):
+        sched = Scheduler(self.store)
+        sched.sync(['vin,A', 'vin,B'], now=NOW)
+        sched.reschedule('vin,A', 'In Production', True, now=NOW)
+        sched.sync(['vin,A'], now=NOW)
+        next_time = sched.next_time()
+        self.store.commit()
+
+        # A restarted daemon picks up where it left off.
+        sched = Scheduler(self.store)
+        self.assertEqual(len(sched), 1)
+        self.assertEqual(sched.next_time(), next_time)
+        self.assertNotIn('vin,B', sched)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import smtplib
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from smtp_pool import SmtpPool
+
+
+class FakeServer(object):
+    """
+    A logged in connection, raises the next error in line or takes the email.
+    """
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+        self.closed = False
+
+    def sendmail(self, email_from, email_to, message):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(email_to)
+
+    def close(self):
+        self.closed = True
+
+    def quit(self):
+        self.closed = True
+
+
+class FakeSmtpPool(SmtpPool):
+    """
+    Hands out the servers in line instead of connecting.
+    """
+
+    def __init__(self, servers, **kwargs):
+        super().__init__(**kwargs)
+        self.servers = list(servers)
+
+    def _connect(self):
+        self.connections += 1
+        return self.servers.pop(0)
+
+
+class SmtpPoolTest(unittest.TestCase):
+
+    def test_reuse(self):
+        server = FakeServer()
+        pool = FakeSmtpPool([server])
+        pool.send('me@example.com', 'a@example.com', 'message')
+        pool.send('me@example.com', 'b@example.com', 'message')
+        self.assertEqual(server.sent, ['a@example.com', 'b@example.com'])
+        stats = pool.stats()
+        self.assertEqual((stats['sent'], stats['connections'], stats['reconnects']), (2, 1, 0))
+        pool.close()
+        self.assertTrue(server.closed)
+
+    def test_reconnect_once(self):
+        dropped = FakeServer()
+        fresh = FakeServer()
+        pool = FakeSmtpPool([dropped, fresh])
+        pool.send('me@example.com', 'a@example.com', 'message')
+
+        # The idle connection was closed by the server, the email goes out on a new one.
+        dropped.errors.append(smtplib.SMTPServerDisconnected('gone'))
+        pool.send('me@example.com', 'b@example.com', 'message')
+        self.assertTrue(dropped.closed)
+        self.assertEqual(fresh.sent, ['b@example.com'])
+        stats = pool.stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['reconnects']), (2, 0, 1))
+
+    def test_no_second_reconnect(self):
+        dropped = FakeServer()
+        pool = FakeSmtpPool([dropped, FakeServer([smtplib.SMTPServerDisconnected('gone')])])
+        pool.send('me@example.com', 'a@example.com', 'message')
+        dropped.errors.append(smtplib.SMTPServerDisconnected('gone'))
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            pool.send('me@example.com', 'b@example.com', 'message')
+        stats = pool.stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['reconnects']), (1, 1, 1))
+
+    def test_new_connection_not_retried(self):
+        pool = FakeSmtpPool([FakeServer([smtplib.SMTPServerDisconnected('gone')]), FakeServer()])
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            pool.send('me@example.com', 'a@example.com', 'message')
+        self.assertEqual(pool.stats()['reconnects'], 0)
+        self.assertEqual(len(pool.servers), 1)
+
+    def test_recipient_refused(self):
+        server = FakeServer([smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'no')})])
+        pool = FakeSmtpPool([server])
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            pool.send('me@example.com', 'a@example.com', 'message')
+
+        # Nothing wrong with the connection, it's used for the next email.
+        pool.send('me@example.com', 'b@example.com', 'message')
+        self.assertFalse(server.closed)
+        self.assertEqual(server.sent, ['b@example.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
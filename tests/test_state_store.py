@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 DukeGaGa
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fingerprint import PAGE_FIELDS, order_fingerprint, page_info
+from state_store import StateStore
+
+ORDER_INFO = {
+    'vehicle_name': '2018 Ford F-150 XLT SuperCrew',
+    'order_date': '01/02/2018',
+    'order_num': 'A1B2',
+    'dealer_code': 'F12345',
+    'order_vin': '1FTEW1EP5JFA00001',
+    'order_edd': '03/04/2018',
+    'current_state': 'In Production',
+    'dealer_name': 'Bench Ford Inc.',
+    'state_dates': ['01/05/2018'],
+    'car_pic_link': 'http://build.ford.com/dig/EXT/4/vehicle.png',
+    'vehicle_summary': ['Option 1', 'Option 2'],
+    'email_sent': True,
+    'window_sticker_sha256': 'abc'
+}
+
+
+class StateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.dir_name, 'states.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def committed(self):
+        """
+        The states another connection sees, only what was committed.
+        """
+
+        conn = sqlite3.connect(self.file_name)
+        try:
+            return dict(((vin, email), json.loads(data)) for vin, email, data in conn.execute('SELECT vin, email, data FROM states'))
+        finally:
+            conn.close()
+
+    def test_batch_commit(self):
+        store = StateStore(self.file_name, batch_size=3, batch_seconds=3600)
+        store.put('VIN1', 'a@example.com', {'n': 1})
+        store.put('VIN2', 'a@example.com', {'n': 2})
+        self.assertEqual(store.get('VIN1', 'a@example.com'), {'n': 1})
+        self.assertEqual(self.committed(), {})
+
+        # The third change commits the batch.
+        store.put('VIN1', 'a@example.com', {'n': 3})
+        self.assertEqual(self.committed(), {('VIN1', 'a@example.com'): {'n': 3}, ('VIN2', 'a@example.com'): {'n': 2}})
+
+        store.put('VIN3', 'b@example.com', {'n': 4})
+        self.assertNotIn(('VIN3', 'b@example.com'), self.committed())
+        store.commit()
+        self.assertIn(('VIN3', 'b@example.com'), self.committed())
+        store.close()
+
+    def test_batch_seconds(self):
+        store = StateStore(self.file_name, batch_size=100, batch_seconds=0)
+        store.put('VIN1', 'a@example.com', {'n': 1})
+        self.assertEqual(self.committed(), {('VIN1', 'a@example.com'): {'n': 1}})
+        store.close()
+
+    def test_migrate(self):
+        with open(os.path.join(self.dir_name, 'VIN1_a@example.com.json'), 'w') as out_file:
+            json.dump({'order_vin': 'VIN1', 'email_sent': True}, out_file)
+        with open(os.path.join(self.dir_name, 'VIN2_b@example.com.json'), 'w') as out_file:
+            out_file.write('{not json')
+
+        store = StateStore(self.file_name)
+        self.assertEqual(store.migrate(self.dir_name), 1)
+        self.assertEqual(store.get('VIN1', 'a@example.com'), {'order_vin': 'VIN1', 'email_sent': True})
+        self.assertIsNone(store.get('VIN2', 'b@example.com'))
+
+        # Only done once, a newer state isn't overwritten by the old file.
+        store.put('VIN1', 'a@example.com', {'order_vin': 'VIN1', 'email_sent': False})
+        store.close()
+        store = StateStore(self.file_name)
+        self.assertEqual(store.migrate(self.dir_name), 0)
+        self.assertEqual(store.states(), [('VIN1', 'a@example.com', {'order_vin': 'VIN1', 'email_sent': False})])
+        store.close()
+
+    def test_schedule(self):
+        store = StateStore(self.file_name)
+        store.put_schedule('vin,VIN1', 100.0, 50.0, True)
+        store.put_schedule('vin,VIN2', 200.0, 0.0, False)
+        store.delete_schedule('vin,VIN2')
+        store.close()
+        store = StateStore(self.file_name)
+        self.assertEqual(store.schedule(), [('vin,VIN1', 100.0, 50.0, True)])
+        store.close()
+
+    def test_fingerprint(self):
+        store = StateStore(self.file_name)
+        key = 'vin,1FTEW1EP5JFA00001,a@example.com'
+        self.assertIsNone(store.fingerprint(key))
+
+        info = page_info(ORDER_INFO)
+        self.assertEqual(sorted(info), sorted(PAGE_FIELDS))
+        self.assertEqual(order_fingerprint(info), order_fingerprint(ORDER_INFO))
+        store.put_fingerprint(key, order_fingerprint(info), '"e1"', None, True, 'abc', info)
+        store.close()
+
+        store = StateStore(self.file_name)
+        self.assertEqual(store.fingerprint(key), {'digest': order_fingerprint(ORDER_INFO), 'etag': '"e1"', 'last_modified': None,
+                                                  'ws_found': True, 'ws_sha256': 'abc', 'order_info': info})
+
+        # Only the orders still in the order file are kept.
+        store.put_fingerprint('num,A1B2,F12345', order_fingerprint(info), None, None, False, None, info)
+        self.assertEqual(store.prune_fingerprints({key}), 1)
+        self.assertIsNone(store.fingerprint('num,A1B2,F12345'))
+        self.assertIsNotNone(store.fingerprint(key))
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()